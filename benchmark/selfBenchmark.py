@@ -0,0 +1,312 @@
+# DNS performance test self-benchmark
+# Measures the overhead of dns-resolution-test.py itself against the local
+# DNS stand-in server, to catch performance regressions in the tool.
+#
+# Run from the repository directory:
+#   python3 -m benchmark.selfBenchmark
+
+import argparse
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from queryEngine import asyncEngine, rawEngine, loadGenerator
+
+repositoryDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+toolFile = os.path.join(repositoryDir, 'dns-resolution-test.py')
+standInFile = os.path.join(repositoryDir, 'standIn', 'dnsStandIn.py')
+
+# Metrics where a higher value is a regression, and where a lower value is.
+higherIsWorse = ('clientOverheadMs', 'wallPerQueryMs', 'memoryPer1000QueriesKB', 'cliSeconds')
+lowerIsWorse = ('queriesPerSecond', 'maxSustainableQps')
+
+# A load step is not sustained when a query was sent more than this many milliseconds after its schedule.
+maxSendLagMs = 100.0
+
+
+def loadTool():
+    """Import dns-resolution-test.py as a module so its performQueries can be measured directly."""
+    spec = importlib.util.spec_from_file_location('dnsResolutionTest', toolFile)
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    tool.args = argparse.Namespace(verbose=False)
+    return tool
+
+
+def freePort():
+    """Return a port that is free on 127.0.0.1 for both UDP and TCP."""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcpSock:
+            tcpSock.bind(('127.0.0.1', 0))
+            port = tcpSock.getsockname()[1]
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udpSock:
+            try:
+                udpSock.bind(('127.0.0.1', port))
+            except OSError:
+                continue
+        return port
+
+
+def startStandIn(latency):
+    """
+    Start the stand-in server in its own process, so it does not compete with
+    the client for the GIL. Returns (process, nameserver).
+    """
+    port = freePort()
+    process = subprocess.Popen([sys.executable, standInFile, '--port', str(port), '--synthesize', '--latency', str(latency)],
+                               stdout=subprocess.DEVNULL)
+
+    # Wait until it is listening.
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, '127.0.0.1:' + str(port)
+        except OSError:
+            time.sleep(0.05)
+
+    process.kill()
+    print('The DNS stand-in server did not start.')
+    sys.exit(1)
+
+
+def makeQueries(count):
+    """Return count queries for synthesized names, mostly A with some AAAA and MX."""
+    queries = []
+    for number in range(count):
+        if number % 10 == 8:
+            queries.append({'aaaa': 'bench' + str(number) + '.example'})
+        elif number % 10 == 9:
+            queries.append({'mx': 'bench' + str(number) + '.example'})
+        else:
+            queries.append({'a': 'bench' + str(number) + '.example'})
+    return queries
+
+
+def measureEngine(runEngine, queryCount):
+    """
+    Run an engine twice: once for the timing and once with tracemalloc for the
+    memory (tracemalloc slows everything down, so it is not used for the timing).
+    """
+    startTime = time.perf_counter()
+    results = runEngine()
+    wall = time.perf_counter() - startTime
+
+    queryResults = [queryResult for server in results for queryResult in results[server]]
+    processing = sum(float(queryResult['processingTime']) for queryResult in queryResults) / len(queryResults)
+    network = sum(float(queryResult['networkTime']) for queryResult in queryResults) / len(queryResults)
+    errors = sum(1 for queryResult in queryResults if queryResult['responseStatus'] != 'NOERROR')
+
+    del results, queryResults
+    tracemalloc.start()
+    results = runEngine()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del results
+
+    return {
+        "queries": queryCount,
+        "errors": errors,
+        "wallSeconds": round(wall, 3),
+        "queriesPerSecond": round(queryCount / wall, 1),
+        "wallPerQueryMs": round(wall * 1000 / queryCount, 4),
+        "clientOverheadMs": round(processing, 4),
+        "networkMs": round(network, 4),
+        "memoryPer1000QueriesKB": round(peak / queryCount, 1)
+    }
+
+
+def maxSustainableQps(nameserver, queries, stepDuration, maxRate):
+    """
+    Double the open-loop rate until the tool (or the stand-in) can no longer keep
+    up: less than 99% of the target rate sent, a query sent more than maxSendLagMs
+    late or more than 0.1% timeouts.
+    Returns the highest rate that was sustained and the steps.
+    """
+    sustained = 0
+    steps = []
+    rate = 500
+
+    while rate <= maxRate:
+        o_loadGenerator = loadGenerator.loadGenerator([nameserver], queries, [rate], stepDuration, 1.0)
+        step = o_loadGenerator.run()['nameservers'][nameserver][0]
+        steps.append(step)
+
+        if (step['achievedQps'] < rate * 0.99 or step['maxSendLagMs'] > maxSendLagMs or
+                step['timeouts'] > step['sent'] * 0.001):
+            break
+        sustained = rate
+        rate *= 2
+
+    return sustained, steps
+
+
+def measureCli(nameserver, queries):
+    """Run the whole script as a subprocess, including Python startup and imports."""
+    with tempfile.TemporaryDirectory() as tmpDir:
+        nameserversFile = os.path.join(tmpDir, 'nameservers.txt')
+        queriesFile = os.path.join(tmpDir, 'queries.txt')
+        with open(nameserversFile, 'w', encoding='utf-8') as f_ns:
+            f_ns.write(nameserver + '\n')
+        with open(queriesFile, 'w', encoding='utf-8') as f_query:
+            for query in queries:
+                queryType, queryName = list(query.items())[0]
+                f_query.write(queryName + ',' + queryType + '\n')
+
+        startTime = time.perf_counter()
+        subprocess.run([sys.executable, toolFile, '--ifname', nameserversFile, '--ifquery', queriesFile, '--engine', 'raw'],
+                       cwd=tmpDir, stdout=subprocess.DEVNULL, check=True)
+        return round(time.perf_counter() - startTime, 3)
+
+
+def runBenchmarks(queryCount, stepDuration, maxRate, concurrency):
+    """Run all the benchmarks and return the report."""
+    tool = loadTool()
+    queries = makeQueries(queryCount)
+    process, nameserver = startStandIn(0)
+
+    try:
+        engines = {
+            "resolver": lambda: tool.performQueries([nameserver], queries),
+            "async": lambda: asyncEngine.asyncEngine([nameserver], queries, concurrency, concurrency).performQueries(),
+            "raw": lambda: rawEngine.rawEngine([nameserver], queries, concurrency, concurrency).performQueries()
+        }
+
+        report = {"queries": queryCount, "concurrency": concurrency, "engines": {}}
+        for name, runEngine in engines.items():
+            print('Measuring the ' + name + ' engine...')
+            report["engines"][name] = measureEngine(runEngine, queryCount)
+
+        print('Measuring the maximum sustainable rate...')
+        report["maxSustainableQps"], report["loadSteps"] = maxSustainableQps(nameserver, queries, stepDuration, maxRate)
+
+        print('Measuring a complete script run...')
+        report["cliSeconds"] = measureCli(nameserver, queries)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return report
+
+
+def flattenMetrics(report):
+    """Return the metrics of the report as {name: value} for comparing with a baseline."""
+    metrics = {"maxSustainableQps": report["maxSustainableQps"], "cliSeconds": report["cliSeconds"]}
+    for name, engine in report["engines"].items():
+        for metric in higherIsWorse + lowerIsWorse:
+            if metric in engine:
+                metrics[name + '.' + metric] = engine[metric]
+    return metrics
+
+
+def compareBaseline(report, baseline, tolerance):
+    """Return the list of metrics that are more than tolerance (fraction) worse than the baseline."""
+    regressions = []
+    current = flattenMetrics(report)
+    previous = flattenMetrics(baseline)
+
+    for name, value in current.items():
+        if name not in previous or not previous[name]:
+            continue
+        change = (value - previous[name]) / previous[name]
+        metric = name.split('.')[-1]
+        if (metric in higherIsWorse and change > tolerance) or (metric in lowerIsWorse and change < -tolerance):
+            regressions.append((name, previous[name], value, change))
+
+    return regressions
+
+
+def displayReport(report):
+    """Display the benchmark report."""
+    filler = ' '
+    headers = ['Engine', 'Queries/sec', 'Wall/query (ms)', 'Overhead (ms)', 'Network (ms)', 'KB/1000 queries']
+    widths = [12, 14, 18, 16, 15, 16]
+
+    print()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for name, engine in report["engines"].items():
+        row = [name, engine['queriesPerSecond'], engine['wallPerQueryMs'], engine['clientOverheadMs'],
+               engine['networkMs'], engine['memoryPer1000QueriesKB']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+    print()
+    print('Max sustainable open-loop rate: ' + str(report["maxSustainableQps"]) + ' queries/sec')
+    print('Complete script run (' + str(report["queries"]) + ' queries): ' + str(report["cliSeconds"]) + ' seconds')
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Self-benchmark of dns-resolution-test against the local DNS stand-in server')
+
+    parser.add_argument('--queries', type=int, default=2000,
+                        help='number of queries per engine. Default 2000')
+
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='queries in flight for the async and raw engines. Default 50')
+
+    parser.add_argument('--stepDuration', type=float, default=2.0,
+                        help='seconds per rate step when finding the maximum rate. Default 2')
+
+    parser.add_argument('--maxRate', type=int, default=64000,
+                        help='highest rate to try in queries per second. Default 64000')
+
+    parser.add_argument('--output', default='',
+                        help='write the report as json to this file')
+
+    parser.add_argument('--baseline', default='',
+                        help='compare with a report from --output and exit with code 1 on regressions')
+
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed change compared with the baseline, as a fraction. Default 0.2')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    report = runBenchmarks(args.queries, args.stepDuration, args.maxRate, args.concurrency)
+    displayReport(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outputFile:
+            outputFile.write(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baselineFile:
+            baseline = json.load(baselineFile)
+
+        regressions = compareBaseline(report, baseline, args.tolerance)
+        print()
+        if not regressions:
+            print('No regressions compared with ' + args.baseline)
+            return
+
+        for name, previous, value, change in regressions:
+            print(f'Regression: {name} {previous} -> {value} ({change:+.0%})')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
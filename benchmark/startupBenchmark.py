@@ -0,0 +1,211 @@
+# DNS performance test startup benchmark
+# Measures the start time and the import time of dns-resolution-test.py for
+# each command line path, so the management commands that run from cron on
+# every device stay cheap.
+#
+# Run from the repository directory:
+#   python3 -m benchmark.startupBenchmark
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.selfBenchmark import toolFile, startStandIn
+
+# Modules that the management commands must not import.
+heavyModules = ('dns.resolver', 'requests')
+
+# The command line paths and their arguments. NAMESERVERS and QUERIES are replaced by the files.
+cliPaths = {
+    "help": ['-h'],
+    "getTag": ['--getTag'],
+    "setTag": ['--setTag', 'bench'],
+    "getUuid": ['--getUuid'],
+    "query": ['--ifname', 'NAMESERVERS', '--ifquery', 'QUERIES'],
+    "queryRaw": ['--ifname', 'NAMESERVERS', '--ifquery', 'QUERIES', '--engine', 'raw']
+}
+managementPaths = ('help', 'getTag', 'setTag', 'getUuid')
+
+# Metrics where a higher value is a regression.
+higherIsWorse = ('wallMs', 'importMs', 'modules')
+
+
+def parseImportTime(stderr):
+    """
+    Return the import time in ms of the script (the top-level imports after
+    Python's own startup, which ends with site) and the imported module names,
+    from the -X importtime output.
+    """
+    importUs = 0
+    modules = []
+    afterSite = False
+
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append(name.strip())
+        topLevel = name.startswith(' ') and not name.startswith('  ')
+        if topLevel and afterSite:
+            importUs += int(cumulative)
+        if topLevel and name.strip() == 'site':
+            afterSite = True
+
+    return importUs / 1000, modules
+
+
+def measurePath(arguments, repeats, workDir):
+    """Run the script with arguments repeats times and return the median wall time and import time."""
+    wallTimes = []
+    importTimes = []
+    modules = []
+
+    for _ in range(repeats):
+        startTime = time.perf_counter()
+        subprocess.run([sys.executable, toolFile] + arguments, cwd=workDir, stdout=subprocess.DEVNULL, check=True)
+        wallTimes.append((time.perf_counter() - startTime) * 1000)
+
+        process = subprocess.run([sys.executable, '-X', 'importtime', toolFile] + arguments, cwd=workDir,
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+        importMs, modules = parseImportTime(process.stderr)
+        importTimes.append(importMs)
+
+    return {
+        "wallMs": round(statistics.median(wallTimes), 1),
+        "importMs": round(statistics.median(importTimes), 1),
+        "modules": len(modules),
+        "heavyModules": [module for module in heavyModules if module in modules]
+    }
+
+
+def runBenchmarks(repeats):
+    """Measure every command line path and return the report."""
+    process, nameserver = startStandIn(0)
+    report = {"python": sys.version.split()[0], "repeats": repeats, "paths": {}}
+
+    try:
+        with tempfile.TemporaryDirectory() as workDir:
+            files = {"NAMESERVERS": os.path.join(workDir, 'nameservers.txt'), "QUERIES": os.path.join(workDir, 'queries.txt')}
+            with open(files["NAMESERVERS"], 'w', encoding='utf-8') as f_ns:
+                f_ns.write(nameserver + '\n')
+            with open(files["QUERIES"], 'w', encoding='utf-8') as f_query:
+                f_query.write('startup.example,a\n')
+
+            for name, arguments in cliPaths.items():
+                print('Measuring ' + name + '...')
+                arguments = [files.get(argument, argument) for argument in arguments]
+                report["paths"][name] = measurePath(arguments, repeats, workDir)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return report
+
+
+def compareBaseline(report, baseline, tolerance):
+    """
+    Return the list of metrics that are more than tolerance (fraction) worse than
+    the baseline, and the management paths that import a heavy module.
+    """
+    regressions = []
+
+    for name, current in report["paths"].items():
+        if name in managementPaths and current["heavyModules"]:
+            regressions.append((name + '.heavyModules', [], current["heavyModules"], None))
+
+        previous = baseline["paths"].get(name)
+        if previous is None:
+            continue
+        for metric in higherIsWorse:
+            if not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if change > tolerance:
+                regressions.append((name + '.' + metric, previous[metric], current[metric], change))
+
+    return regressions
+
+
+def displayReport(report):
+    """Display the benchmark report."""
+    filler = ' '
+    headers = ['Path', 'Wall (ms)', 'Imports (ms)', 'Modules', 'Heavy modules']
+    widths = [12, 12, 15, 10, 20]
+
+    print()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for name, path in report["paths"].items():
+        row = [name, path['wallMs'], path['importMs'], path['modules'], ', '.join(path['heavyModules']) or '-']
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Startup benchmark of the dns-resolution-test command line paths')
+
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='runs per command line path, the median is reported. Default 5')
+
+    parser.add_argument('--output', default='',
+                        help='write the report as json to this file')
+
+    parser.add_argument('--baseline', default='',
+                        help='compare with a report from --output and exit with code 1 on regressions')
+
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed change compared with the baseline, as a fraction. Default 0.2')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    report = runBenchmarks(max(args.repeats, 1))
+    displayReport(report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outputFile:
+            outputFile.write(json.dumps(report, indent=2))
+
+    regressions = compareBaseline(report, {"paths": {}}, args.tolerance)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as baselineFile:
+            baseline = json.load(baselineFile)
+        regressions = compareBaseline(report, baseline, args.tolerance)
+
+    print()
+    if not regressions:
+        print('No regressions' + (' compared with ' + args.baseline if args.baseline else ''))
+        return
+
+    for name, previous, value, change in regressions:
+        if change is None:
+            print(f'Regression: {name} {value}')
+        else:
+            print(f'Regression: {name} {previous} -> {value} ({change:+.0%})')
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
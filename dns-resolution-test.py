@@ -1,108 +1,196 @@
 # DNS Performance Testing
-# Version:            0.21
-# Last updated:       2022-12-04
+# Version:            0.45
+# Last updated:       2026-10-18
 import sys
 import argparse
 import json
-import dns.resolver
-from datetime import datetime, timedelta
+import time
+import signal
+import threading
+import atexit
+from contextlib import nullcontext
+from datetime import datetime
 import os.path
-from os import path
 
 from systemInfo import systemInfo, systemData
 
-import requests
+# dnspython, requests and the query engine are imported by the functions that
+# use them, so the management commands (--getTag, --setTag, --getUuid, ...)
+# start without loading them.
 
 # Global Variables
-dnsResponseTextMaxLength = 0
-scriptVersion = "0.21"
+o_connectionPool = None
+o_serverHealth = None
+o_runProfiler = None
+noSpan = nullcontext()
+o_systemInfo = None
+o_resultUploader = None
+o_archiveWriter = None
+o_resultSink = None
+scriptVersion = "0.45"
 
 
 def writeResults(results, outputFile):
     """Send the json data to the outputFile variable."""
+    from queryEngine import queryRecord
+
+    with profileSpan('serialize'):
+        jsonText = json.dumps(results, default=queryRecord.toJson)
     with open(outputFile, "w", encoding="utf-8") as outputFile:
-        outputFile.write(json.dumps(results))
+        outputFile.write(jsonText)
 
 
 def printJsonStdout(results):
     """This will output the json data to stdout."""
-    print(json.dumps(results))
+    from queryEngine import queryRecord
+
+    with profileSpan('serialize'):
+        jsonText = json.dumps(results, default=queryRecord.toJson)
+    print(jsonText)
     print()
 
 
+def profileSpan(name, perQuery=False, **details):
+    """
+    Return a span of the --profile profiler for the phase name, or a context
+    manager that does nothing when profiling is off. perQuery spans are only
+    recorded with --profileQueries.
+    """
+    if o_runProfiler is None or (perQuery and not o_runProfiler.perQuery):
+        return noSpan
+    return o_runProfiler.span(name, **details)
+
+
+def profileQueryCallback(resultCallback):
+    """
+    With --profileQueries, return a resultCallback that records a query span for
+    every completed query of an engine that times the queries itself.
+    """
+    if o_runProfiler is None or not o_runProfiler.perQuery:
+        return resultCallback
+
+    def addQuerySpan(server, queryResult):
+        """Record the query span from the response time before passing the result on."""
+        durationNs = int(float(queryResult['responseTime']) * 1000000)
+        o_runProfiler.addSpan({
+            "name": "query",
+            "startNs": time.perf_counter_ns() - durationNs,
+            "durationNs": durationNs,
+            "blocks": 0,
+            "thread": threading.get_ident(),
+            "details": {"server": server, "query": queryResult['query']}
+        })
+        if resultCallback is not None:
+            resultCallback(server, queryResult)
+
+    return addQuerySpan
+
+
+def startProfiling():
+    """
+    Start the profiler and cProfile for the --profile arguments. The results are
+    displayed and written when the script exits, also after Ctrl-C or in --daemon.
+    """
+    from queryStats import runProfiler
+
+    global o_runProfiler
+    if not (args.profile or args.profileQueries or args.profileMemory or args.profileTrace or args.profileCProfile):
+        return
+
+    o_runProfiler = runProfiler.runProfiler(args.profileQueries, args.profileMemory)
+    o_cProfile = None
+    if args.profileCProfile:
+        import cProfile
+        o_cProfile = cProfile.Profile()
+        o_cProfile.enable()
+
+    atexit.register(finishProfiling, o_cProfile)
+
+
+def finishProfiling(o_cProfile):
+    """Display the span summary and write the --profileTrace and --profileCProfile files."""
+    if o_cProfile is not None:
+        o_cProfile.disable()
+        o_cProfile.dump_stats(args.profileCProfile)
+        print('cProfile statistics written to ' + args.profileCProfile, file=sys.stderr)
+
+    o_runProfiler.displaySummary()
+
+    if args.profileTrace:
+        o_runProfiler.writeTrace(args.profileTrace)
+        print('Chrome trace written to ' + args.profileTrace, file=sys.stderr)
+
+
+def startHealthTracking():
+    """
+    Start tracking the health of the nameservers for --circuitBreaker and
+    --adaptiveTimeout. The state is kept for the whole script, so a tripped
+    nameserver stays tripped between iterations and --daemon runs until a probe
+    gets a response.
+    """
+    from queryEngine import serverHealth
+
+    global o_serverHealth
+    if args.circuitBreaker <= 0 and args.adaptiveTimeout <= 0:
+        return
+
+    if args.transport != 'udp' or args.qps > 0 or args.ramp:
+        print('--circuitBreaker and --adaptiveTimeout can not be combined with --transport tcp, dot or doh or a load test.')
+        sys.exit(1)
+
+    o_serverHealth = serverHealth.serverHealth(max(args.circuitBreaker, 0), args.probeInterval, max(args.adaptiveTimeout, 0))
+
+
 def uploadJsonHTTP(url, jsonData):
     """
     This will upload the json data to a URL via a POST method.
     If the verbose argument is set, it'll display what URL it's being
     submitted to as well as the json data (jsonData).
     When the response is returned, it'll return the X-Headers that are sent back
-    from the server.
+    from the server. With --uploadSpool the runs are spooled and uploaded in
+    batches, in the background with --daemon, and a run that could not be
+    uploaded is sent with the next upload.
     """
-    x = requests.post(url, json=jsonData)
+    from queryEngine import queryRecord
+    from resultStore import resultUploader
+
+    global o_resultUploader
+    # Keep the session and its connection open for the next upload (--daemon).
+    if o_resultUploader is None:
+        o_resultUploader = resultUploader.resultUploader(url, args.uploadSpool, args.uploadBatch, args.uploadCompression,
+                                                         args.uploadRetries, int(args.uploadMaxSpool * 1048576),
+                                                         batchInterval=args.uploadInterval, background=args.daemon)
+    x = o_resultUploader.upload(jsonData)
     if args.verbose:
         print('Submission URL: ', url)
-        print('jsonData: ', json.dumps(jsonData))
+        print('jsonData: ', json.dumps(jsonData, default=queryRecord.toJson))
+    if x is None:
+        if args.uploadSpool:
+            return 'The run is kept in ' + args.uploadSpool + ' for the next upload.'
+        return 'Upload to ' + url + ' failed.'
+    if args.verbose:
         print('X-Headers: ', x.headers)
     return x.headers
 
 
-def getFileFromURL(fileURL):
-    """This function will download the contents of fileURL and return a list with the contents."""
-    tmpData = []
-    try:
-        urlData = requests.get(fileURL)
-        if urlData.status_code == 200:
-            tmpData = urlData.text.split('\n')
-            try:
-                # Attempt to remove any blank entries in the dict
-                tmpData.remove('')
-            except ValueError:
-                # Do nothing
-                print()
-        else:
-            tmpData = ['Error while retrieving URL']
-    except socket.gaierror:
-        print('Invalid hostname')
-        tmpData = ['URL error']
-    except requests.exceptions.Timeout:
-        print('Timeout while retrieving URL.')
-        tmpData = ['URL Timeout']
-    except requests.exceptions.TooManyRedirects:
-        print('Too many redirects while accessing the URL')
-        tmpData = ['URL Redirects too many']
-    except requests.exceptions.ConnectionError:
-        print('Could not connect to URL - ' + fileURL + '\n')
-        tmpData = ['URL connection error']
-    return tmpData
-
-
 def loadNameServersFile(nameserversFile):
     """
-    This will load the name servers from the file nameserversFile.
+    This will load the name servers from the file (or URL, .gz or .zst) nameserversFile.
     Each name server should be on it's own line.
     """
-    dnsNameServers = []
-
-    # Check to see if nameserversFile is a URL and if it is, attempt to download it.
-    if nameserversFile.startswith('http://') or nameserversFile.startswith('https://'):
-        dnsnameServers = getFileFromURL(nameserversFile)
-        return dnsnameServers
-
-    if not path.exists(nameserversFile):
-        print('I cannot find file ' + nameserversFile)
-        sys.exit(1)
+    from queryEngine import queryLoader
 
     if args.verbose:
         print('Loading the nameservers that are to be queried.')
 
-    nameServerFile = open(nameserversFile, "r", encoding="utf-8")
+    try:
+        dnsNameServers = queryLoader.loadLines(nameserversFile)
+    except OSError as err:
+        print(str(err))
+        sys.exit(1)
 
-    for line in nameServerFile:
-        if args.verbose:
-            print(line.rstrip('\n'), end=' ')
-        dnsNameServers.append(line.rstrip('\n'))
     if args.verbose:
-        print()
+        print(' '.join(dnsNameServers))
 
     return dnsNameServers
 
@@ -110,270 +198,573 @@ def loadNameServersFile(nameserversFile):
 def loadQueriesFile(queriesFile):
     """
     This will load the queries that need to be performed against each name server.
-    One query per line. Right now it's only meant to be for 'A' record resolutions.
+    One query per line: NAME, NAME,TYPE or RANK,NAME (Tranco and Umbrella top lists),
+    from a plain, .gz or .zst file or URL. The queries are read while the first
+    ones are already sent, and duplicates are skipped.
     """
-    queries = []
+    from queryEngine import queryLoader
 
-    # Check to see if queriesFile is a URL and if it is, attempt to download it.
-    if queriesFile.startswith('http://') or queriesFile.startswith('https://'):
-        queries = getFileFromURL(queriesFile)
-        return queries
+    if args.verbose:
+        print('Loading queries from ' + queriesFile)
 
-    # Check to see if if the file exists. If not, exit with error code 1.
-    if not path.exists(queriesFile):
-        print('I cannot find file ' + queriesFile)
+    try:
+        queries = queryLoader.loadQueries(queriesFile)
+    except OSError as err:
+        print(str(err))
         sys.exit(1)
 
-    if args.verbose:
-        print('Loading queries from ' + queriesFile)
+    return queries
+
+
+def displayResults(results):
+    """
+    This will display the results to stdout. Responses longer than --responseWidth
+    are cut off, or wrapped on the next lines with --wrapResponses.
+    """
+    from queryStats import liveDisplay
+
+    print(liveDisplay.headerLine(args.responseWidth))
+
+    for nameserverItem in results:
+        for dataItem in results[nameserverItem]:
+            for line in liveDisplay.formatResult(nameserverItem, dataItem, args.responseWidth, args.wrapResponses):
+                print(line)
+
+
+def performQueries(nameservers, queries, resultCallback=None, keepResults=True):
+    """
+    This will perform all the all the queries against each nameserver.
+    resultCallback(server, queryResult) is called as soon as each query completes.
+    When keepResults is False the results are only passed to resultCallback.
+    """
+    from queryEngine import responseParser, timedQuery
+
+    # Set the results to empty dict
+    results = {}
+
+    counter = 1
+
+    # The count would wait for the whole queries file, it is only needed for --verbose.
+    totalQueries = len(nameservers) * len(queries) if args.verbose else 0
+
+    for server in nameservers:
+        # Every query goes to this single name server.
+        # We don't need multiple failover nameservers because we want
+        # a result from each name server and want to point out any failures.
+        for query in queries:
+            # Display the query count to keep track of progress.
+            queryType, queryName = responseParser.getQueryParts(query)
+
+            if args.verbose:
+                print('Query = ' + str(query))
+                print('Query count = ' + str(counter) + ' of ' + str(totalQueries))
+
+            # A nameserver that stopped responding does not wait out the lifetime of every query.
+            queryToken = o_serverHealth.shouldQuery(server) if o_serverHealth is not None else None
+            if o_serverHealth is not None and queryToken is None:
+                thisQuery = responseParser.buildSkippedResult(query)
+                if resultCallback is not None:
+                    resultCallback(server, thisQuery)
+                if keepResults:
+                    results.setdefault(server, []).append(thisQuery)
+                counter += 1
+                continue
+
+            timeout, lifetime = o_serverHealth.timeouts(server) if o_serverHealth is not None else (timedQuery.defaultTimeout, timedQuery.defaultLifetime)
+
+            # Start Query Time. The monotonic clock is not affected by NTP adjustments.
+            timer = timedQuery.queryTimer()
+            error = None
+
+            with profileSpan('resolve', True, server=server, query=query):
+                try:
+                    answer = timedQuery.resolve(server, queryType, queryName, timer, timeout=timeout, lifetime=lifetime)
+
+                # If there's a timeout, display the timeout, which query and which nameserver
+                # typical timeout is 5.5s
+                except responseParser.queryErrors as err:
+                    print(responseParser.queryErrorText(err) + str(query) + ' @' + server)
+                    answer = []
+                    error = err
+
+                # End query time.
+                timer.stop()
+
+            # Create the json dict with all of the responses and the time breakdown.
+            # If there were any errors, the response is 'Err'
+            with profileSpan('extract', True, server=server, query=query):
+                thisQuery = responseParser.buildResult(query, answer, timer, error)
+
+            if o_serverHealth is not None:
+                o_serverHealth.addResult(server, thisQuery, queryToken)
 
-    queryFile = open(queriesFile, "r", encoding="utf-8")
+            if resultCallback is not None:
+                resultCallback(server, thisQuery)
 
-    for line in queryFile:
-        if "," in line:
-            tmpLine = line.rstrip('\n').split(',')
-            queries.append({tmpLine[1]: tmpLine[0]})
+            if keepResults:
+                # If the server is not in the results, set the response to a blank list.
+                if server not in results:
+                    results[server] = []
+
+                results[server].append(thisQuery)
+
+            counter += 1
+
+    return results
+
+
+def getConnectionPool():
+    """Return the connectionPool for --transport. It is created once, so connections are reused between iterations."""
+    from queryEngine import connectionPool
+
+    global o_connectionPool
+    if o_connectionPool is None:
+        o_connectionPool = connectionPool.connectionPool(args.transport, args.tlsHostname, args.tlsCaFile, args.tlsInsecure, args.dohPath)
+    return o_connectionPool
+
+
+def runQueries(nameservers, queries, resultCallback=None, keepResults=True):
+    """
+    Perform all the queries against each nameserver with the engine selected in the arguments.
+    Every call is one pass over the query matrix: the --ofstream records of a nameserver
+    never span passes (iterations, --daemon runs, --rank rounds, ...).
+    """
+    if o_resultSink is not None:
+        o_resultSink.startPass(queries)
+
+    try:
+        if args.transport != 'udp' or args.engine == 'raw' or args.concurrency > 0:
+            resultCallback = profileQueryCallback(resultCallback)
+
+        if args.transport != 'udp':
+            # Persistent tcp, dot or doh connections, one per nameserver.
+            from queryEngine import transportEngine
+            o_transportEngine = transportEngine.transportEngine(nameservers, queries, getConnectionPool(), args.pipeline, args.verbose,
+                                                                resultCallback=resultCallback, keepResults=keepResults)
+            results = o_transportEngine.performQueries()
+        elif args.engine == 'raw':
+            # Pre-built wire format queries over one socket per nameserver.
+            from queryEngine import rawEngine
+            o_rawEngine = rawEngine.rawEngine(nameservers, queries, args.concurrency, args.serverConcurrency, args.verbose,
+                                              resultCallback=resultCallback, keepResults=keepResults, health=o_serverHealth)
+            results = o_rawEngine.performQueries()
+        elif args.concurrency > 0:
+            # Run all the nameservers at the same time.
+            from queryEngine import asyncEngine
+            o_asyncEngine = asyncEngine.asyncEngine(nameservers, queries, args.concurrency, args.serverConcurrency, args.verbose,
+                                                    resultCallback=resultCallback, keepResults=keepResults, health=o_serverHealth)
+            results = o_asyncEngine.performQueries()
         else:
-            queries.append({'a': line.rstrip('\n')})
+            results = performQueries(nameservers, queries, resultCallback, keepResults)
+
+        return results
+    finally:
+        # The nameservers that are not complete, for example after Ctrl-C.
+        if o_resultSink is not None:
+            o_resultSink.endPass()
+
+
+def resumeQueries(nameservers, queries, o_runCheckpoint, resultCallback=None, keepResults=True):
+    """
+    Perform only the (nameserver, query) pairs that are not completed in the
+    checkpoint, and merge the completed results back in, in the query order.
+    Nameservers with the same remaining queries are run together.
+    """
+    from queryEngine import responseParser
+
+    completedResults = {}
+    groups = {}
+
+    for server in nameservers:
+        completedResults[server] = {}
+        remaining = []
+        for index, query in enumerate(queries):
+            queryType, queryName = responseParser.getQueryParts(query)
+            queryResult = o_runCheckpoint.takeCompleted(server, queryType, queryName)
+            if queryResult is None:
+                remaining.append(index)
+            else:
+                completedResults[server][index] = queryResult
+        groups.setdefault(tuple(remaining), []).append(server)
+
+    if o_runCheckpoint.completedCount:
+        print('Resuming from ' + args.checkpoint + ': ' + str(o_runCheckpoint.completedCount) + ' of ' +
+              str(len(nameservers) * len(queries)) + ' queries already completed.')
+
+    for remaining, servers in groups.items():
+        if not remaining:
+            continue
+        groupResults = runQueries(servers, [queries[index] for index in remaining], resultCallback, keepResults)
+        for server in groupResults:
+            completedResults[server].update(zip(remaining, groupResults[server]))
+
+    if not keepResults:
+        return {}
+
+    results = {}
+    for server in nameservers:
+        if completedResults[server]:
+            results[server] = [completedResults[server][index] for index in sorted(completedResults[server])]
+    return results
+
+
+def repeatQueries(nameservers, queries, iterations, duration, resultCallback=None, keepResults=True):
+    """
+    Run the query matrix iterations times, or until duration seconds have passed
+    if duration is set (whichever comes first). Every result is added to a
+    sampleAggregator so memory stays the same no matter how many samples there are.
+    Returns the results of the last run and the aggregated results.
+    """
+    from queryStats import sampleAggregator
+
+    o_sampleAggregator = sampleAggregator.sampleAggregator()
+    startTime = time.monotonic()
+
+    def addResult(server, queryResult):
+        """Add each result to the statistics before passing it on."""
+        o_sampleAggregator.addResult(server, queryResult)
+        if resultCallback is not None:
+            resultCallback(server, queryResult)
+
+    while True:
+        iterationStartTime = datetime.utcnow()
+        results = runQueries(nameservers, queries, addResult, keepResults)
+        o_sampleAggregator.endIteration()
+
+        if args.ofarchive:
+            # Every iteration is a run of its own in the archive, written together as one segment.
+            with profileSpan('ofarchive'):
+                archiveRun(gatherData(results, str(iterationStartTime), str(datetime.utcnow())))
 
         if args.verbose:
-            print(line.rstrip('\n'), end=' ')
+            print('Iteration ' + str(o_sampleAggregator.iterations) + ' complete.')
 
-    if args.verbose:
-        print()
-        print(queries)
+        elapsed = time.monotonic() - startTime
 
-    queryFile.close()
+        if duration > 0:
+            if elapsed >= duration or (iterations > 1 and o_sampleAggregator.iterations >= iterations):
+                break
+        elif o_sampleAggregator.iterations >= iterations:
+            break
 
-    return queries
+    return results, o_sampleAggregator.aggregatedResults(elapsed)
 
 
-def displayResults(results):
+def cacheTestQueries(nameservers, queries, repeats, interval, resultCallback=None, keepResults=True):
     """
-    This will display the results to stdout. Not always formatted correctly
-    because the responses could have a variable number.
+    Send every query paired with a cache-busting query (random label in front of
+    the name) repeats times, interval seconds apart, so the TTLs of the answers
+    to the real names show whether they came from the resolver cache.
+    Returns the results of the last repeat and the cacheResults section.
     """
-    # Get the global variable dnsResponseTextMaxLength
-    global dnsResponseTextMaxLength
-    filler = ' '
+    from queryStats import cacheAnalyzer
 
-    if args.verbose:
-        print("dnsResponseTextMaxLength = ", dnsResponseTextMaxLength)
+    o_cacheAnalyzer = cacheAnalyzer.cacheAnalyzer(queries, repeats)
 
-    headers = ['DNS Server', 'DNS Type', 'DNS Query', 'DNS Response', 'Response Time (ms)', 'DNS TTL']
+    def addResult(server, queryResult):
+        """Add each result to the cache analysis before passing it on."""
+        o_cacheAnalyzer.addResult(server, queryResult)
+        if resultCallback is not None:
+            resultCallback(server, queryResult)
 
-    # DNS Column lengths
-    dnsServerLength = 18
-    dnsQueryTypeLength = 15
-    dnsQueryLength = 30
-    dnsResponseTextMaxLength += 10
-    dnsResponseTimeLength = 20
-    dnsResponseTTLLength = 8
+    for repeat in range(repeats):
+        if repeat:
+            time.sleep(interval)
+        results = runQueries(nameservers, o_cacheAnalyzer.pairedQueries(), addResult, keepResults)
 
-    # Print the headers with appropriate spacing.
-    for count, item in enumerate(headers):
-        if count == 0:
-            # DNS Server
-            print(f'{item:{filler}<{dnsServerLength}}', end='')
+        if args.verbose:
+            print('Cache test repeat ' + str(repeat + 1) + ' complete.')
 
-        if count == 1:
-            # DNS Type
-            print(f'{item:{filler}<{dnsQueryTypeLength}}', end='')
+    return results, o_cacheAnalyzer.cacheResults()
 
-        if count == 2:
-            # DNS Query
-            print(f'{item:{filler}<{dnsQueryLength}}', end='')
 
-        if count == 3:
-            # DNS Response
-            print(f'{item:{filler}<{dnsResponseTextMaxLength}}', end='')
+def rankNameservers(nameservers, queries, resultCallback=None, keepResults=True):
+    """
+    Send rounds of --rankSample random queries to every nameserver until the
+    ranking is stable, or for --rankRounds rounds. Returns the results of the
+    last round and the rankResults section.
+    """
+    from queryStats import resolverRanking
 
-        if count == 4:
-            # Response Time (ms)
-            print(f'{item:{filler}<{dnsResponseTimeLength}}', end='')
+    o_resolverRanking = resolverRanking.resolverRanking(nameservers, args.rankTolerance)
 
-        if count == 5:
-            # DNS TTL
-            print(f'{item:{filler}<{dnsResponseTTLLength}}', end='')
+    def addResult(server, queryResult):
+        """Add each result to the ranking before passing it on."""
+        o_resolverRanking.addResult(server, queryResult)
+        if resultCallback is not None:
+            resultCallback(server, queryResult)
 
-    print()
+    while True:
+        results = runQueries(nameservers, o_resolverRanking.sampleQueries(queries, max(args.rankSample, 1)), addResult, keepResults)
+        o_resolverRanking.endRound()
 
-    # Iterate through the response data and format the columns with appropriate spaces.
-    for nameserverItem in results:
-        for dataItem in results[nameserverItem]:
-            print(f'{nameserverItem:{filler}<{dnsServerLength}}', end='')
+        if o_resolverRanking.isStable():
+            if args.verbose:
+                print('Ranking is stable after ' + str(o_resolverRanking.rounds) + ' rounds.')
+            break
+        if o_resolverRanking.rounds >= max(args.rankRounds, resolverRanking.minRounds):
+            print('Ranking is not stable after ' + str(o_resolverRanking.rounds) + ' rounds, the closest nameservers may swap places.')
+            break
 
-            for dataItem2 in dataItem:
-                if dataItem2 == 'query':
-                    queryType = list(dataItem[dataItem2].items())[0][0]
-                    queryName = list(dataItem[dataItem2].items())[0][1]
-                    print(f'{queryType:{filler}<{dnsQueryTypeLength}}', end='')
-                    print(f'{queryName:{filler}<{dnsQueryLength}}', end='')
+        if args.verbose:
+            print('Ranking round ' + str(o_resolverRanking.rounds) + ' complete.')
 
-                if dataItem2 == 'response':
-                    dnsElements = list(dataItem[dataItem2])
+    return results, o_resolverRanking.rankResults()
 
-                    dnsResponseFormatted = ','.join(dnsElements)
-                    print(f'{dnsResponseFormatted:{filler}<{dnsResponseTextMaxLength}}', end='')
 
-                if dataItem2 == 'responseTime':
-                    responseTime = dataItem[dataItem2]
-                    print(f'{responseTime:{filler}<{dnsResponseTimeLength}}', end='')
+def displayRankResults(rankResults):
+    """Display the ranked nameservers and the recommended resolv.conf fragment to stdout."""
+    from queryStats import resolverRanking
 
-                if dataItem2 == 'responseTTL':
-                    responseTTL = dataItem[dataItem2]
-                    print(f'{responseTTL:{filler}<{dnsResponseTTLLength}}')
+    filler = ' '
+    headers = ['Rank', 'DNS Server', 'Score', 'p50', 'p90', 'p99', 'Jitter', 'Samples', 'Failures', 'Consistency']
+    widths = [6, 18, 10, 10, 10, 10, 10, 9, 10, 13]
 
+    print()
+    print('Rounds: ' + str(rankResults['rounds']) + '  Stable: ' + ('yes' if rankResults['stable'] else 'no'))
 
-def performQueries(nameservers, queries):
-    """This will perform all the all the queries against each nameserver."""
-    # Set the resolver
-    resolver = dns.resolver.Resolver()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
 
-    # Set the results to empty dict
-    results = {}
+    for entry in rankResults['nameservers']:
+        row = [entry['rank'], entry['nameserver'], entry['score'], entry['p50'], entry['p90'], entry['p99'], entry['jitter'], entry['samples'],
+               f"{entry['failureRate']:.1%}", f"{entry['consistency']:.1%}" if entry['consistency'] is not None else '-']
+        row = ['-' if item is None else item for item in row]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
 
-    counter = 1
+    print()
+    print(resolverRanking.resolvConf(rankResults), end='')
 
-    totalQueries = len(nameservers) * len(queries)
 
-    # Get the global variable dnsResponseTextMaxLength
-    global dnsResponseTextMaxLength
+def displayCacheResults(cacheResults):
+    """Display the cached and uncached latency of every nameserver to stdout."""
+    filler = ' '
+    headers = ['DNS Server', 'Hits', 'Misses', 'Unknown', 'Cached p50', 'Cached p90', 'Cached Mean', 'Uncached p50', 'Uncached p90', 'Uncached Mean']
+    widths = [18, 6, 8, 9, 12, 12, 13, 14, 14, 14]
 
-    for server in nameservers:
-        # Set the name servers to a single list entry.
-        # We don't need multiple failover nameservers because we want
-        # a result from each name server and want to point out any failures.
-        resolver.nameservers = [server]
-        for query in queries:
-            # Display the query count to keep track of progress.
-            queryType = list(query.items())[0][0].lower()
-            queryName = list(query.items())[0][1].lower()
+    print()
+    print('Cache test repeats: ' + str(cacheResults['repeats']))
+
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for server, entry in cacheResults['nameservers'].items():
+        cached = entry['cached']
+        uncached = entry['uncached']
+        row = [server, entry['hits'], entry['misses'], entry['unknown'], cached['p50'], cached['p90'], cached['mean'],
+               uncached['p50'], uncached['p90'], uncached['mean']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+
+def runCoordinator(nameservers, queries):
+    """
+    Hand out the shards of the query matrix to the --worker processes until every
+    shard is completed. Returns the merged results and the shardResults section.
+    """
+    from queryEngine import shardCoordinator
+
+    o_shardCoordinator = shardCoordinator.shardCoordinator(nameservers, queries, max(args.shardSize, 1), args.leaseTimeout)
+    o_coordinatorServer = shardCoordinator.coordinatorServer(o_shardCoordinator, args.coordinatorAddress, args.coordinatorPort).start()
+    print('Coordinating ' + str(len(o_shardCoordinator.shards)) + ' shards on http://' + args.coordinatorAddress + ':' + str(o_coordinatorServer.port))
 
+    try:
+        while not o_shardCoordinator.finished.wait(5):
             if args.verbose:
-                print('Query = ' + str(query))
-                print('Query count = ' + str(counter) + ' of ' + str(totalQueries))
+                print('Shards: ' + str(o_shardCoordinator.status()))
 
-            # Start Query Time
-            queryStartTime = datetime.now()
+        # Keep answering until the workers know the run is done, so they exit instead of retrying.
+        lingerUntil = time.monotonic() + 5 * shardCoordinator.waitInterval
+        while not o_shardCoordinator.allWorkersDone() and time.monotonic() < lingerUntil:
+            time.sleep(0.1)
+    finally:
+        o_coordinatorServer.stop()
 
-            try:
-                if queryType == "ptr":
-                    answer = resolver.resolve_address(queryName)
-                else:
-                    answer = resolver.resolve(queryName, queryType)
-
-            # If there's a timeout, display the timeout, which query and which nameserver
-            # typical timeout is 5.5s
-
-            except dns.rdatatype.UnknownRdatatype:
-                print('Unkown DNS response - ' + str(query) + ' @' + server)
-                answer = []
-
-            except dns.resolver.NoAnswer:
-                # No answer from DNS server
-                print('No DNS answer - ' + str(query) + ' @' + server)
-                answer = []
-
-            except dns.exception.Timeout:
-                # DNS Server timed out
-                print('DNS Timeout - ' + str(query) + ' @' + server)
-                answer = []
-
-            except dns.resolver.NXDOMAIN:
-                # NXDOMAIN response from DNS server
-                print('NXDOMAIN response - ' + str(query) + ' @' + server)
-                answer = []
-
-            except dns.resolver.NoNameservers:
-                # If there are no responses from name servers, display No Response.
-                print('No response. ' + str(query) + ' @' + server)
-                answer = []
-
-            # End query time.
-            queryEndTime = datetime.now()
-
-            # Calculate the difference between End Query Time and Start Query Time
-            # Multiply the result by a 1000 to get millisecond response.
-            queryTime = (queryEndTime - queryStartTime).total_seconds() * 1000
-
-            # Format the queryTime response.
-            s_queryTime = str("{:.1f}".format(queryTime))
-
-            l_response = []
-
-            # If there were any answers from the query, append the response
-            # to l_response.
-            # If there were any errors, add 'Err'
-            if answer:
-                if queryType in ("a", "aaaa"):
-                    for counter, response in enumerate(answer):
-                        aResponse = response.address
-                        l_response.append(aResponse)
-                        currentLength = len(str(aResponse)) * (counter + 1)
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                if queryType == "mx":
-                    for response in answer:
-                        mxResponse = response.to_text()
-                        l_response.append(mxResponse)
-                        currentLength = len(str(mxResponse))
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                if queryType == "ptr":
-                    for response in answer:
-                        ptrResponse = response.to_text()
-                        l_response.append(ptrResponse)
-                        currentLength = len(str(ptrResponse))
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                if queryType == "soa":
-                    for response in answer:
-                        soaResponse = response.to_text().split(' ')[0]
-                        l_response.append(soaResponse)
-                        currentLength = len(str(soaResponse))
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                if queryType == "cname":
-                    for response in answer:
-                        cnameResponse = response.to_text()
-                        l_response.append(cnameResponse)
-                        currentLength = len(str(cnameResponse))
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                if queryType == "ns":
-                    for response in answer:
-                        nsResponse = response.to_text()
-                        l_response.append(nsResponse)
-                        currentLength = len(str(nsResponse))
-                        dnsResponseTextMaxLength = max(dnsResponseTextMaxLength, currentLength)
-
-                a_responseTTL = answer.rrset.ttl
-            else:
-                a_responseTTL = -1
-                l_response.append('Err')
-                if dnsResponseTextMaxLength < 3:
-                    dnsResponseTextMaxLength = 4
+    return o_shardCoordinator.mergedResults(), o_shardCoordinator.shardResults()
+
+
+def runWorker(url):
+    """Perform the shards of the coordinator at url with the query engine selected in the arguments, until the run is done."""
+    from queryEngine import shardCoordinator
 
-            # If the server is not in the results, set the response to a blank list.
-            if server not in results:
-                results[server] = []
+    o_coordinatorClient = shardCoordinator.coordinatorClient(url)
+    # The worker is identified by its deviceUuid, deviceTag and hostName.
+    identity = gatherData({}, '', '')
+    del identity['queryResults']
+    completedShards = 0
 
+    try:
+        while True:
             try:
-                # Create the json dict with all of the responses.
-                thisQuery = {"query": query, "response": l_response, "responseTime": s_queryTime, "responseTTL": a_responseTTL}
-                results[server].append(thisQuery)
+                shardLease = o_coordinatorClient.lease(identity)
+            except OSError as err:
+                print('Unable to lease a shard: ' + str(err))
+                sys.exit(1)
+
+            if shardLease.get('done'):
+                break
+            if 'wait' in shardLease:
+                time.sleep(shardLease['wait'])
+                continue
+
+            shardStartTime = datetime.utcnow()
+            with profileSpan('queries', shard=shardLease['shard']):
+                results = runQueries(shardLease['nameservers'], shardLease['queries'])
+            myData = gatherData(results, str(shardStartTime), str(datetime.utcnow()))
+            myData['shard'] = shardLease['shard']
+            myData['lease'] = shardLease['lease']
 
-                counter += 1
+            try:
+                with profileSpan('upload', shard=shardLease['shard']):
+                    reply = o_coordinatorClient.complete(myData)
+            except OSError as err:
+                print('Unable to send the results of shard ' + str(shardLease['shard']) + ': ' + str(err))
+                sys.exit(1)
+
+            if reply.get('accepted'):
+                completedShards += 1
+            if args.verbose:
+                print('Shard ' + str(shardLease['shard']) + ' ' + ('accepted' if reply.get('accepted') else reply.get('reason', 'rejected')))
+    finally:
+        if o_connectionPool is not None:
+            o_connectionPool.close()
 
-            except KeyError:
-                # If there's some accidental programming error, then display error.
-                print('I made an oops.')
+    print('Completed ' + str(completedShards) + ' shards.')
 
-    return results
+
+def displayShardResults(shardResults):
+    """Display the workers of a sharded run to stdout."""
+    filler = ' '
+    headers = ['Worker UUID', 'Tag', 'Host', 'Leases', 'Shards', 'Queries']
+    widths = [38, 15, 20, 8, 8, 9]
+
+    print()
+    print('Shards: ' + str(shardResults['shards']) + '  Reassigned: ' + str(shardResults['reassignedShards']) +
+          '  Backups: ' + str(shardResults['backupShards']) + '  Duplicates: ' + str(shardResults['duplicateResults']))
+
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for worker in shardResults['workers']:
+        row = [worker['deviceUuid'], worker['deviceTag'], worker['hostName'], worker['leases'], worker['shards'], worker['queries']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+
+def displayHealthResults(healthResults):
+    """Display the circuit breaker and the timeouts of every nameserver to stdout."""
+    filler = ' '
+    headers = ['DNS Server', 'Tripped', 'Trips', 'Probes', 'Skipped', 'Timeout (s)', 'Lifetime (s)']
+    widths = [18, 9, 7, 8, 9, 13, 14]
+
+    print()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for server, entry in healthResults['nameservers'].items():
+        row = [server, 'yes' if entry['tripped'] else 'no', entry['trips'], entry['probes'], entry['skipped'], entry['timeout'], entry['lifetime']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+
+def displayAggregatedResults(aggregatedResults):
+    """Display the statistics of a repeated run to stdout."""
+    filler = ' '
+    headers = ['DNS Server', 'DNS Type', 'DNS Query', 'Samples', 'Lost', 'Errors', 'Min', 'Mean', 'p50', 'p90', 'p99', 'Max']
+    widths = [18, 15, 30, 9, 6, 8, 10, 10, 10, 10, 10, 10]
+
+    print()
+    print('Iterations: ' + str(aggregatedResults['iterations']) + '  Duration (s): ' + str(aggregatedResults['durationSeconds']))
+
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for server in aggregatedResults['nameservers']:
+        for entry in aggregatedResults['nameservers'][server]:
+            queryType, queryName = list(entry['query'].items())[0]
+            row = [server, queryType, queryName, entry['samples'], entry['lost'], entry['errors'],
+                   entry['min'], entry['mean'], entry['p50'], entry['p90'], entry['p99'], entry['max']]
+            for item, width in zip(row, widths):
+                print(f'{str(item):{filler}<{width}}', end='')
+            print()
+
+
+def runLoadTest(nameservers, queries):
+    """Run the open-loop load test with the rates from the --qps or --ramp arguments."""
+    from queryEngine import loadGenerator
+
+    if args.ramp:
+        try:
+            rates = loadGenerator.parseRamp(args.ramp)
+        except ValueError:
+            print('Invalid --ramp value. Use START:STOP:STEP or a comma separated list of rates.')
+            sys.exit(1)
+    else:
+        rates = [args.qps]
+
+    try:
+        o_loadGenerator = loadGenerator.loadGenerator(nameservers, queries, rates, args.stepDuration, args.loadTimeout, args.verbose)
+    except ValueError:
+        print('None of the queries can be sent in a load test, check the query types in the queries file.')
+        sys.exit(1)
+    return o_loadGenerator.run()
+
+
+def displayLoadTestResults(loadTestResults):
+    """Display the results of a load test to stdout."""
+    filler = ' '
+    headers = ['DNS Server', 'Target QPS', 'Achieved QPS', 'Responses', 'Timeouts', 'Errors', 'p50', 'p90', 'p99', 'Max']
+    widths = [18, 12, 14, 11, 10, 8, 10, 10, 10, 10]
+
+    print()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for server in loadTestResults['nameservers']:
+        for step in loadTestResults['nameservers'][server]:
+            row = [server, step['targetQps'], step['achievedQps'], step['responses'], step['timeouts'], step['errors'],
+                   step['p50'], step['p90'], step['p99'], step['max']]
+            for item, width in zip(row, widths):
+                print(f'{str(item):{filler}<{width}}', end='')
+            print()
+
+
+def displayTransportResults(transportResults):
+    """Display the connection setup times and the query times on new and reused connections to stdout."""
+    filler = ' '
+    headers = ['DNS Server', 'Connections', 'Handshake (ms)', 'TLS Resumed', 'New Conn Query (ms)', 'Reused Conn Query (ms)']
+    widths = [18, 13, 16, 13, 21, 23]
+
+    print()
+    print('Transport: ' + transportResults['transport'])
+
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for server, entry in transportResults['nameservers'].items():
+        handshakes = [connection['handshakeTime'] for connection in entry['connections']]
+        resumed = sum(1 for connection in entry['connections'] if connection.get('tlsResumed'))
+        row = [server, len(handshakes), round(sum(handshakes) / len(handshakes), 3) if handshakes else '-', resumed,
+               entry['newConnectionQueryTime'], entry['reusedConnectionQueryTime']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
 
 
-def gatherData(queryResults, scriptStartTime, scriptEndTime):
+def gatherData(queryResults, scriptStartTime, scriptEndTime, aggregatedResults=None, loadTestResults=None, transportResults=None, cacheResults=None,
+               shardResults=None, healthResults=None, rankResults=None):
     """
     This will collect all the data into a uniform data structure that can
     help with measuring results across multiple executions.
@@ -386,13 +777,30 @@ def gatherData(queryResults, scriptStartTime, scriptEndTime):
     * scriptUTCStartTime - script start time (UTC format).
     * scriptUTCEndTime   - script end time (UTC format).
     * queryResults       - The results of all queries that were performed against the nameservers.
+    * aggregatedResults  - Latency statistics per nameserver and query when the queries
+                           were repeated (--iterations/--duration).
+    * loadTestResults    - Achieved rate, timeouts and latency per rate step of a load test (--qps/--ramp).
+    * transportResults   - Connection setup times and query times on new and reused
+                           connections (--transport tcp, dot or doh).
+    * cacheResults       - Cache hit/miss classification and the cached and uncached
+                           latency per nameserver (--cacheTest).
+    * shardResults       - The workers and the shards they measured (--coordinate).
+    * healthResults      - Tripped circuits, skipped queries and timeouts per nameserver
+                           (--circuitBreaker/--adaptiveTimeout).
+    * rankResults        - The nameservers ranked on their scores and the recommended
+                           resolvers (--rank).
     """
-    myInfo = systemInfo.systemInfo()
+    global o_systemInfo
+    # uuid.cfg and tag.cfg are only read once, also when a daemon gathers the data of every run.
+    if o_systemInfo is None:
+        o_systemInfo = systemInfo.systemInfo()
 
-    if myInfo.uuid == "":
-        n = systemData.systemData()
-        n.createUuidIfNotExist()
-        myInfo.uuid = myInfo.getUuid()
+        if o_systemInfo.uuid == "":
+            n = systemData.systemData()
+            n.createUuidIfNotExist()
+            o_systemInfo.uuid = o_systemInfo.getUuid()
+
+    myInfo = o_systemInfo
 
     myData = {
         "deviceUuid": myInfo.uuid,
@@ -400,13 +808,154 @@ def gatherData(queryResults, scriptStartTime, scriptEndTime):
         "hostName": myInfo.hostname,
         "scriptUTCStartTime": scriptStartTime,
         "scriptUTCEndTime": scriptEndTime,
-        "dataFormatVersion": 3,
+        "dataFormatVersion": 7,
         "queryResults": queryResults
     }
 
+    if aggregatedResults is not None:
+        myData["aggregatedResults"] = aggregatedResults
+
+    if loadTestResults is not None:
+        myData["loadTestResults"] = loadTestResults
+
+    if transportResults is not None:
+        myData["transportResults"] = transportResults
+
+    if cacheResults is not None:
+        myData["cacheResults"] = cacheResults
+
+    if shardResults is not None:
+        myData["shardResults"] = shardResults
+
+    if healthResults is not None:
+        myData["healthResults"] = healthResults
+
+    if rankResults is not None:
+        myData["rankResults"] = rankResults
+
     return myData
 
 
+def archiveRun(myData):
+    """Add a run to the --ofarchive segment, which is written per partition or --archiveBatch runs."""
+    global o_archiveWriter
+    if o_archiveWriter is None:
+        from resultStore import resultArchive
+        o_archiveWriter = resultArchive.archiveWriter(args.ofarchive, args.archivePartition, args.archiveBatch)
+    o_archiveWriter.addRun(myData)
+
+
+def publishResults(myData):
+    """Send the json data of a run to all the outputs that are selected in the arguments."""
+    # If the httpPOST argument is set, send the json data to the URL via POST method
+    if args.httpPOST:
+        with profileSpan('upload'):
+            print(uploadJsonHTTP(args.httpPOST, myData))
+
+    # If the jsonstdout argument is set, then print myData to stdout.
+    if args.jsonstdout:
+        with profileSpan('jsonstdout'):
+            printJsonStdout(myData)
+
+    # If the ofresults is set, output the data to output.json.
+    # Results will always be overwritten.
+    if args.ofresults:
+        with profileSpan('ofresults'):
+            writeResults(myData, 'output.json')
+
+    # If ofarchive is set, add the results to the compact columnar archive.
+    if args.ofarchive:
+        from resultStore import resultArchive
+        with profileSpan('ofarchive'):
+            if args.daemon:
+                # The runs are collected into one segment per partition or --archiveBatch runs.
+                archiveRun(myData)
+            elif o_archiveWriter is None:
+                resultArchive.writeArchive([myData], args.ofarchive, args.archivePartition)
+            # Otherwise the iterations of the run are archived already, and their results include the last one in myData.
+
+
+def liveQueryCount(nameservers, queries, o_runCheckpoint=None):
+    """Return the number of queries the run will perform for the --live ETA, 0 when it is not known in advance."""
+    if args.daemon or args.duration > 0 or args.rank:
+        return 0
+    if args.cacheTest:
+        from queryStats import cacheAnalyzer
+        return len(nameservers) * cacheAnalyzer.pairedQueryCount(queries) * max(args.cacheRepeats, 1)
+    if o_runCheckpoint is not None:
+        return len(nameservers) * len(queries) - o_runCheckpoint.completedCount
+    return len(nameservers) * len(queries) * max(args.iterations, 1)
+
+
+def runDaemon(nameservers, queries, resultCallback=None, keepResults=True):
+    """
+    Run the query matrix every args.interval seconds until SIGTERM or Ctrl-C.
+    Runs start at fixed times (first start + n * interval), so the schedule does
+    not drift with the run time. A run that takes longer than the interval skips
+    the runs it overlaps. The latency of every query is added to the /metrics
+    endpoint, and the json data of every run goes to the selected outputs.
+    """
+    from queryStats import prometheusMetrics
+
+    o_metrics = prometheusMetrics.prometheusMetrics()
+    o_metricsServer = None
+    if args.metricsPort:
+        o_metricsServer = prometheusMetrics.metricsServer(o_metrics, args.metricsAddress, args.metricsPort).start()
+        print('Metrics on http://' + args.metricsAddress + ':' + str(o_metricsServer.port) + '/metrics')
+
+    def addResult(server, queryResult):
+        """Add each result to the metrics before passing it on."""
+        o_metrics.addResult(server, queryResult)
+        if resultCallback is not None:
+            resultCallback(server, queryResult)
+
+    stopEvent = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: stopEvent.set())
+
+    firstStart = time.monotonic()
+    runNumber = 0
+
+    try:
+        while not stopEvent.is_set():
+            runStart = time.monotonic()
+            scriptStartTime = datetime.utcnow()
+            with profileSpan('queries', run=runNumber):
+                results = runQueries(nameservers, queries, addResult, keepResults)
+            scriptEndTime = datetime.utcnow()
+            runDuration = time.monotonic() - runStart
+
+            # The next run is on the fixed schedule, skipping any runs this one overlapped.
+            runNumber += 1
+            missedRuns = 0
+            behind = time.monotonic() - (firstStart + runNumber * args.interval)
+            if behind > 0:
+                missedRuns = int(behind // args.interval) + 1
+                runNumber += missedRuns
+                print('Run took ' + str(round(runDuration, 1)) + ' seconds, skipped ' + str(missedRuns) + ' scheduled run(s).')
+            o_metrics.runCompleted(runDuration, time.time(), missedRuns)
+
+            transportResults = o_connectionPool.transportResults() if o_connectionPool is not None else None
+            healthResults = o_serverHealth.healthResults() if o_serverHealth is not None else None
+
+            if args.displayResponses:
+                displayResults(results)
+                if healthResults:
+                    displayHealthResults(healthResults)
+
+            publishResults(gatherData(results, str(scriptStartTime), str(scriptEndTime), transportResults=transportResults, healthResults=healthResults))
+
+            stopEvent.wait(max(firstStart + runNumber * args.interval - time.monotonic(), 0))
+    finally:
+        if o_metricsServer is not None:
+            o_metricsServer.stop()
+        # Write the runs that are not archived yet.
+        if o_archiveWriter is not None:
+            o_archiveWriter.flush()
+        # Finish the upload in progress, the runs that are not sent stay in the spool.
+        if o_resultUploader is not None:
+            o_resultUploader.close()
+
+
 def parseArguments():
     """Create argument options and parse through them to determine what to do with script."""
     # Instantiate the parser
@@ -423,12 +972,36 @@ def parseArguments():
     parser.add_argument('--ofresults', action='store_true',
                         help='JSON results output file')
 
+    parser.add_argument('--ofstream', default='',
+                        help='Append the results to this json lines file as the queries complete.')
+
+    parser.add_argument('--streamGranularity', default='query', choices=['query', 'nameserver'],
+                        help='Write one --ofstream line per completed query or per completed nameserver. Default query.')
+
+    parser.add_argument('--ofarchive', default='',
+                        help='Add the results to the compact columnar archive in this directory.')
+
+    parser.add_argument('--archivePartition', default='day', choices=['day', 'hour'],
+                        help='Time partition of the --ofarchive files. Default day.')
+
+    parser.add_argument('--archiveBatch', type=int, default=60,
+                        help='Runs per --ofarchive file with --daemon or --iterations, a new file is also started for every partition. Default 60.')
+
     parser.add_argument('--jsonstdout', action='store_true',
                         help='print results to stdout')
 
     parser.add_argument('--displayResponses', action='store_true',
                         help='Display formatted results')
 
+    parser.add_argument('--live', nargs='?', const='rows', default='', choices=['rows', 'progress'],
+                        help='Print every result as its query completes, with the query rate, ETA and rolling latency per nameserver. --live progress only shows the progress line.')
+
+    parser.add_argument('--responseWidth', type=int, default=40,
+                        help='Width of the DNS Response column of --displayResponses and --live, longer responses are cut off. Default 40.')
+
+    parser.add_argument('--wrapResponses', action='store_true',
+                        help='Wrap long responses on the next lines instead of cutting them off.')
+
     parser.add_argument('--verbose', action='store_true',
                         help='Displays the response times of all the tests.')
 
@@ -453,6 +1026,150 @@ def parseArguments():
     parser.add_argument('--httpPOST', default='',
                         help='Upload the JSON results to the URL')
 
+    parser.add_argument('--uploadCompression', default='none', choices=['none', 'gzip', 'zstd'],
+                        help='Compress the --httpPOST body (Content-Encoding). zstd needs the zstandard package. Default none.')
+
+    parser.add_argument('--uploadRetries', type=int, default=5,
+                        help='Retries of a failed --httpPOST upload, with exponential backoff and jitter. Default 5.')
+
+    parser.add_argument('--uploadSpool', default='',
+                        help='Spool the --httpPOST runs in this directory and upload them in batches as json lines. Runs that could not be uploaded are sent with the next upload.')
+
+    parser.add_argument('--uploadBatch', type=int, default=10,
+                        help='Maximum runs per --uploadSpool upload. Default 10.')
+
+    parser.add_argument('--uploadInterval', type=float, default=300.0,
+                        help='Upload the --uploadSpool runs once --uploadBatch runs are waiting or the oldest has waited this many seconds, 0 after every run. Default 300.')
+
+    parser.add_argument('--uploadMaxSpool', type=float, default=100.0,
+                        help='Maximum size of --uploadSpool in MB, the oldest runs are dropped beyond it. Default 100.')
+
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help='Query all nameservers concurrently with up to CONCURRENCY queries in flight. Default 0 (one query at a time).')
+
+    parser.add_argument('--serverConcurrency', type=int, default=10,
+                        help='Maximum queries in flight per nameserver when --concurrency or --engine raw is used. Default 10.')
+
+    parser.add_argument('--engine', default='resolver', choices=['resolver', 'raw'],
+                        help='Query engine. raw encodes every query once and reuses one socket per nameserver. Default resolver.')
+
+    parser.add_argument('--transport', default='udp', choices=['udp', 'tcp', 'dot', 'doh'],
+                        help='Query over udp, tcp, DNS-over-TLS (dot) or DNS-over-HTTPS (doh). tcp, dot and doh keep one connection per nameserver open. Default udp.')
+
+    parser.add_argument('--pipeline', type=int, default=1,
+                        help='Queries in flight on each tcp or dot connection. Default 1.')
+
+    parser.add_argument('--tlsHostname', default='',
+                        help='Name for SNI, certificate verification and the HTTP Host header with --transport dot or doh. Default the IP address of the nameserver.')
+
+    parser.add_argument('--tlsCaFile', default='',
+                        help='Also trust the certificates in this file (for example a self-signed certificate) with --transport dot or doh.')
+
+    parser.add_argument('--tlsInsecure', action='store_true',
+                        help='Do not verify the certificate of the nameserver with --transport dot or doh.')
+
+    parser.add_argument('--dohPath', default='/dns-query',
+                        help='URL path of DNS-over-HTTPS requests. Default /dns-query.')
+
+    parser.add_argument('--circuitBreaker', type=int, default=0,
+                        help='Skip the queries to a nameserver after this many consecutive timeouts, probing it every --probeInterval seconds until it responds again. Default 0 (off).')
+
+    parser.add_argument('--probeInterval', type=float, default=30.0,
+                        help='Seconds between the probe queries to a nameserver skipped by --circuitBreaker. Default 30.')
+
+    parser.add_argument('--adaptiveTimeout', type=float, default=0,
+                        help='Time out a query attempt after ADAPTIVETIMEOUT x the p99 network time of its nameserver (at most the default 2 seconds) instead of after 2 seconds. Default 0 (off).')
+
+    parser.add_argument('--iterations', type=int, default=1,
+                        help='Repeat all the queries ITERATIONS times and add latency statistics to the results. Default 1.')
+
+    parser.add_argument('--duration', type=float, default=0,
+                        help='Repeat all the queries for DURATION seconds and add latency statistics to the results.')
+
+    parser.add_argument('--checkpoint', default='',
+                        help='Record the completed queries in this file. An interrupted run started again with the same file only performs the remaining queries.')
+
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and perform all the queries every INTERVAL seconds, with live metrics on --metricsPort.')
+
+    parser.add_argument('--interval', type=float, default=60.0,
+                        help='Seconds between the starts of the --daemon runs. Default 60.')
+
+    parser.add_argument('--metricsPort', type=int, default=9153,
+                        help='Port of the Prometheus /metrics endpoint of --daemon, 0 to disable. Default 9153.')
+
+    parser.add_argument('--metricsAddress', default='127.0.0.1',
+                        help='Address of the /metrics endpoint of --daemon. Default 127.0.0.1.')
+
+    parser.add_argument('--cacheTest', action='store_true',
+                        help='Pair every query with a cache-busting query and report cached and uncached latency separately.')
+
+    parser.add_argument('--cacheRepeats', type=int, default=3,
+                        help='Number of times the paired queries are sent with --cacheTest. Default 3.')
+
+    parser.add_argument('--cacheInterval', type=float, default=2.0,
+                        help='Seconds between the --cacheTest repeats, so the TTLs count down. Default 2.')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='Time every phase of the run (input loading, queries, display, serialization, upload) and display a summary on stderr.')
+
+    parser.add_argument('--profileQueries', action='store_true',
+                        help='Like --profile, and also record a span for every query.')
+
+    parser.add_argument('--profileMemory', action='store_true',
+                        help='Like --profile, and also trace the bytes allocated by every span with tracemalloc and display the top allocation sites.')
+
+    parser.add_argument('--profileTrace', default='',
+                        help='Like --profile, and write the spans to this Chrome trace format json file (chrome://tracing or Perfetto).')
+
+    parser.add_argument('--profileCProfile', default='',
+                        help='Run the script under cProfile and write the statistics to this file (python3 -m pstats FILE).')
+
+    parser.add_argument('--coordinate', action='store_true',
+                        help='Split the nameservers x queries into shards, hand them out to --worker processes and publish the merged results.')
+
+    parser.add_argument('--coordinatorAddress', default='127.0.0.1',
+                        help='Address the --coordinate endpoint listens on. Default 127.0.0.1.')
+
+    parser.add_argument('--coordinatorPort', type=int, default=8953,
+                        help='Port of the --coordinate endpoint. Default 8953.')
+
+    parser.add_argument('--shardSize', type=int, default=100,
+                        help='Queries of one nameserver per --coordinate shard. Default 100.')
+
+    parser.add_argument('--leaseTimeout', type=float, default=60.0,
+                        help='Seconds after which a shard that a worker has not completed is given to another worker. Default 60.')
+
+    parser.add_argument('--worker', default='',
+                        help='Perform the shards of the coordinator at this URL (http://host:8953) instead of the --ifname and --ifquery files.')
+
+    parser.add_argument('--rank', action='store_true',
+                        help='Rank the nameservers on latency, jitter, failures and answer consistency over rounds of random queries, and recommend a resolver list.')
+
+    parser.add_argument('--rankSample', type=int, default=50,
+                        help='Random queries from the queries file sent to every nameserver in each --rank round. Default 50.')
+
+    parser.add_argument('--rankRounds', type=int, default=20,
+                        help='Maximum --rank rounds, sampling stops earlier once the ranking is stable. Default 20.')
+
+    parser.add_argument('--rankTolerance', type=float, default=1.0,
+                        help='Score difference in milliseconds within which --rank treats two nameservers as equivalent. Default 1.')
+
+    parser.add_argument('--rankOutput', default='',
+                        help='Write the recommended nameservers of --rank to this file as a resolv.conf fragment.')
+
+    parser.add_argument('--qps', type=float, default=0,
+                        help='Load test: send the queries to each nameserver at QPS queries per second, no matter when responses arrive.')
+
+    parser.add_argument('--ramp', default='',
+                        help='Load test with several rate steps. START:STOP:STEP (for example 100:1000:100) or a comma separated list of rates.')
+
+    parser.add_argument('--stepDuration', type=float, default=10.0,
+                        help='Seconds to send at each load test rate. Default 10.')
+
+    parser.add_argument('--loadTimeout', type=float, default=2.0,
+                        help='Seconds after which a load test query counts as a timeout. Default 2.')
+
     global args
     args = parser.parse_args()
 
@@ -495,6 +1212,8 @@ def defineInfoArguments(o_systemData, o_systemInfo):
 
 def main():
     """main definition"""
+    global o_resultSink
+
     # Parse all the arguments
     parseArguments()
 
@@ -504,6 +1223,10 @@ def main():
 
     defineInfoArguments(o_mySystemData, o_myInfo)
 
+    startProfiling()
+
+    startHealthTracking()
+
     # Script start time (UTC format)
     scriptStartTime = datetime.utcnow()
 
@@ -511,26 +1234,192 @@ def main():
     if args.verbose:
         print('Script start time: ', str(scriptStartTime), '\n')
 
+    if args.worker:
+        if (args.coordinate or args.daemon or args.iterations > 1 or args.duration > 0 or args.cacheTest or args.checkpoint or args.rank or
+                args.qps > 0 or args.ramp):
+            print('--worker can not be combined with --coordinate, --daemon, --iterations, --duration, --cacheTest, --checkpoint, --rank or a load test.')
+            sys.exit(1)
+        # The coordinator publishes the merged results.
+        runWorker(args.worker)
+        return
+
     # Query file from ifquery argument
     queryFile = args.ifquery
 
     # Nameserver file from ifname argument
     nameserversFile = args.ifname
 
-    # Results to be written to output.json
-    outputFileResults = 'output.json'
+    with profileSpan('loadInput', queries=queryFile, nameservers=nameserversFile):
+        queries = loadQueriesFile(queryFile)
+        nameservers = loadNameServersFile(nameserversFile)
+
+    if args.daemon and (args.iterations > 1 or args.duration > 0 or args.cacheTest or args.checkpoint or args.qps > 0 or args.ramp):
+        print('--daemon can not be combined with --iterations, --duration, --cacheTest, --checkpoint or a load test.')
+        sys.exit(1)
 
-    queries = loadQueriesFile(queryFile)
-    nameservers = loadNameServersFile(nameserversFile)
+    if args.daemon and args.interval <= 0:
+        print('--interval must be more than 0 seconds.')
+        sys.exit(1)
 
-    results = performQueries(nameservers, queries)
+    if args.checkpoint and (args.iterations > 1 or args.duration > 0 or args.cacheTest or args.qps > 0 or args.ramp):
+        print('--checkpoint can not be combined with --iterations, --duration, --cacheTest or a load test.')
+        sys.exit(1)
+
+    if args.coordinate and (args.daemon or args.iterations > 1 or args.duration > 0 or args.cacheTest or args.checkpoint or args.ofstream or
+                            args.live or args.qps > 0 or args.ramp):
+        print('--coordinate can not be combined with --daemon, --iterations, --duration, --cacheTest, --checkpoint, --ofstream, --live or a load test.')
+        sys.exit(1)
+
+    if args.rank and (args.daemon or args.iterations > 1 or args.duration > 0 or args.cacheTest or args.checkpoint or args.coordinate or
+                      args.qps > 0 or args.ramp):
+        print('--rank can not be combined with --daemon, --iterations, --duration, --cacheTest, --checkpoint, --coordinate or a load test.')
+        sys.exit(1)
+
+    if args.live and (args.qps > 0 or args.ramp):
+        print('--live can not be combined with a load test.')
+        sys.exit(1)
+
+    if args.transport != 'udp' and (args.engine == 'raw' or args.concurrency > 0 or args.qps > 0 or args.ramp):
+        print('--transport ' + args.transport + ' can not be combined with --engine raw, --concurrency or a load test. Use --pipeline for queries in flight.')
+        sys.exit(1)
+
+    aggregatedResults = None
+    loadTestResults = None
+    transportResults = None
+    cacheResults = None
+    shardResults = None
+    healthResults = None
+    rankResults = None
+    resultCallback = None
+    keepResults = True
+    o_runCheckpoint = None
+    o_liveDisplay = None
+
+    if args.checkpoint:
+        # Continue an interrupted run with the same nameservers and queries.
+        from resultStore import runCheckpoint
+        try:
+            o_runCheckpoint = runCheckpoint.runCheckpoint(args.checkpoint, nameservers, queries, str(scriptStartTime))
+        except (ValueError, OSError) as err:
+            print('Unable to use the checkpoint: ' + str(err))
+            sys.exit(1)
+        scriptStartTime = o_runCheckpoint.scriptStartTime
+
+    if args.ofstream:
+        # Append every completed result to the json lines file while the queries run.
+        from resultStore import resultSink
+        streamHeader = gatherData({}, str(scriptStartTime), '')
+        del streamHeader['queryResults']
+        # Every runQueries pass writes the nameservers it completed.
+        o_resultSink = resultSink.resultSink(args.ofstream, streamHeader, args.streamGranularity)
+        resultCallback = o_resultSink.add
+
+        # Only keep the results in memory when another output needs them.
+        keepResults = bool(args.displayResponses or args.ofresults or args.jsonstdout or args.httpPOST or args.ofarchive or args.verbose)
+
+    if o_runCheckpoint is not None:
+        streamCallback = resultCallback
+
+        def checkpointResult(server, queryResult):
+            """Record every completed query in the checkpoint before passing it on."""
+            o_runCheckpoint.add(server, queryResult)
+            if streamCallback is not None:
+                streamCallback(server, queryResult)
+
+        resultCallback = checkpointResult
+
+    if args.live:
+        # Print the results as they complete, with the rate, ETA and rolling latency.
+        from queryStats import liveDisplay
+        # The count is known once the whole queries file is read.
+        o_liveDisplay = liveDisplay.liveDisplay(lambda: liveQueryCount(nameservers, queries, o_runCheckpoint) if getattr(queries, 'finished', True) else 0,
+                                                args.responseWidth, args.wrapResponses, args.live == 'rows')
+        liveCallback = resultCallback
+
+        def liveResult(server, queryResult):
+            """Show every completed query before passing it on."""
+            o_liveDisplay.addResult(server, queryResult)
+            if liveCallback is not None:
+                liveCallback(server, queryResult)
+
+        resultCallback = liveResult
+
+    try:
+        if args.daemon:
+            # Every run is published by runDaemon.
+            runDaemon(nameservers, queries, resultCallback, keepResults)
+            return
+
+        with profileSpan('queries'):
+            if args.coordinate:
+                # The workers perform the queries, their results are merged.
+                results, shardResults = runCoordinator(nameservers, queries)
+            elif args.qps > 0 or args.ramp:
+                # Open-loop load test instead of the query matrix.
+                results = {}
+                loadTestResults = runLoadTest(nameservers, queries)
+            elif args.rank:
+                # Rounds of random queries until the ranking of the nameservers is stable.
+                results, rankResults = rankNameservers(nameservers, queries, resultCallback, keepResults)
+            elif args.cacheTest:
+                # Paired cache-busting and real queries, classified from the TTLs.
+                results, cacheResults = cacheTestQueries(nameservers, queries, max(args.cacheRepeats, 1), args.cacheInterval, resultCallback, keepResults)
+            elif args.iterations > 1 or args.duration > 0:
+                # Repeat the whole query matrix and keep streaming statistics.
+                results, aggregatedResults = repeatQueries(nameservers, queries, args.iterations, args.duration, resultCallback, keepResults)
+            elif o_runCheckpoint is not None:
+                # Skip the queries that were completed before the run was interrupted.
+                results = resumeQueries(nameservers, queries, o_runCheckpoint, resultCallback, keepResults)
+            else:
+                results = runQueries(nameservers, queries, resultCallback, keepResults)
+    finally:
+        # Whatever was completed stays usable, even after Ctrl-C.
+        if o_liveDisplay is not None:
+            o_liveDisplay.close()
+        if o_resultSink is not None:
+            o_resultSink.close()
+        if o_runCheckpoint is not None:
+            o_runCheckpoint.close()
+        if o_connectionPool is not None:
+            o_connectionPool.close()
+            transportResults = o_connectionPool.transportResults()
+        if o_serverHealth is not None:
+            healthResults = o_serverHealth.healthResults()
+        # The iterations that were completed.
+        if o_archiveWriter is not None:
+            o_archiveWriter.flush()
 
     # If verbose argument is parsed, display the results to stdout.
     if args.verbose:
         print(results)
 
+    # The ranking is the result of --rank, it is always displayed.
+    if rankResults:
+        displayRankResults(rankResults)
+        if args.rankOutput:
+            from queryStats import resolverRanking
+            try:
+                with open(args.rankOutput, 'w') as rankFile:
+                    rankFile.write(resolverRanking.resolvConf(rankResults, 'dns-resolution-test.py --rank ' + str(scriptStartTime)[:19] + ' UTC'))
+            except OSError as err:
+                print('Unable to write ' + args.rankOutput + ': ' + str(err))
+
     if args.displayResponses:
-        displayResults(results)
+        with profileSpan('display'):
+            if not loadTestResults:
+                displayResults(results)
+            if aggregatedResults:
+                displayAggregatedResults(aggregatedResults)
+            if loadTestResults:
+                displayLoadTestResults(loadTestResults)
+            if transportResults:
+                displayTransportResults(transportResults)
+            if cacheResults:
+                displayCacheResults(cacheResults)
+            if shardResults:
+                displayShardResults(shardResults)
+            if healthResults:
+                displayHealthResults(healthResults)
 
     # Script end time (UTC format)
     scriptEndTime = datetime.utcnow()
@@ -540,20 +1429,16 @@ def main():
         print('\nScript stop time: ', str(scriptEndTime))
 
     # Collate all the data into myData
-    myData = gatherData(results, str(scriptStartTime), str(scriptEndTime))
-
-    # If the httpPOST argument is set, send the json data to the URL via POST method
-    if args.httpPOST:
-        print(uploadJsonHTTP(args.httpPOST, myData))
+    with profileSpan('gatherData'):
+        myData = gatherData(results, str(scriptStartTime), str(scriptEndTime), aggregatedResults, loadTestResults, transportResults, cacheResults,
+                            shardResults, healthResults, rankResults)
 
-    # If the jsonstdout argument is set, then print myData to stdout.
-    if args.jsonstdout:
-        printJsonStdout(myData)
+    with profileSpan('publish'):
+        publishResults(myData)
 
-    # If the ofresults is set, output the data to outputFileResults.
-    # Results will always be overwritten.
-    if args.ofresults:
-        writeResults(myData, outputFileResults)
+    # The run is complete and its results are written, the checkpoint is no longer needed.
+    if o_runCheckpoint is not None:
+        o_runCheckpoint.remove()
 
 
 if __name__ == '__main__':
@@ -1,17 +1,86 @@
 # JSON to Excel spreadsheet
-# Version:            0.02
-# Last updated:       2022-12-04
+# Version:            0.04
+# Last updated:       2026-10-18
 
 import xlsxwriter
 import json
 import os.path
 from os import path
 import sys
+import time
 import argparse
 
-
-def copyJsonFile2Excel(jsonFile, excelFile):
-    """copyJsonFile2Excel definition."""
+import summaryStats
+
+# Excel worksheets are limited to 1,048,576 rows.
+excelMaxRows = 1048576
+
+dataHeaders = ['deviceUuid', 'hostname', 'deviceTag', 'scriptStartTime', 'scriptEndTime', 'Nameserver', 'Query',
+               'Record', 'Response', 'Response Time', 'Status', 'Network Time', 'Processing Time']
+
+
+class progressReport:
+    """progressReport class. Displays the number of rows converted and the rate every interval seconds."""
+
+    def update(self, rows):
+        """Report progress if the interval has passed."""
+        self.rows = rows
+        now = time.monotonic()
+        if now - self.lastReport >= self.interval:
+            self.lastReport = now
+            print(f'{rows} rows, {self.rate():.0f} rows/sec')
+
+    def rate(self):
+        """Return the average number of rows per second."""
+        elapsed = time.monotonic() - self.startTime
+        if elapsed <= 0:
+            return 0.0
+        return self.rows / elapsed
+
+    def done(self):
+        """Report the totals."""
+        elapsed = time.monotonic() - self.startTime
+        print(f'{self.rows} rows in {elapsed:.1f} seconds, {self.rate():.0f} rows/sec')
+
+    def __init__(self, interval=5.0):
+        """Initialize the counters."""
+        self.interval = interval
+        self.rows = 0
+        self.startTime = time.monotonic()
+        self.lastReport = self.startTime
+
+
+def optionalFloat(value):
+    """Convert a time from the json data to a float, or '' when the data format version does not have it."""
+    if value is None:
+        return ''
+    return float(value)
+
+
+def resultRows(json_dict):
+    """Return a spreadsheet row for every query result in a line of the json file."""
+    for nsEntry in json_dict['queryResults']:
+        for query in json_dict['queryResults'][nsEntry]:
+            queryElements = list(query['query'].items())
+            yield [
+                json_dict['deviceUuid'],
+                json_dict['hostName'],
+                json_dict['deviceTag'],
+                json_dict['scriptUTCStartTime'],
+                json_dict['scriptUTCEndTime'],
+                nsEntry,
+                queryElements[0][0],
+                queryElements[0][1],
+                ','.join(query['response']),
+                float(query['responseTime']),
+                query.get('responseStatus', ''),
+                optionalFloat(query.get('networkTime')),
+                optionalFloat(query.get('processingTime'))
+            ]
+
+
+def copyJsonFile2Excel(jsonFile, excelFile, summary=False):
+    """copyJsonFile2Excel definition. If summary is set, the summary sheets are added."""
     print('Starting conversion...')
     if path.exists(jsonFile):
         jf = open(jsonFile, 'r', encoding='utf-8')
@@ -43,16 +112,13 @@ def copyJsonFile2Excel(jsonFile, excelFile):
     row = 6
 
     # Create headers for all data.
-    worksheet.write(row, col, 'deviceUuid', headersFormat)
-    worksheet.write(row, col+1, 'hostname', headersFormat)
-    worksheet.write(row, col+2, 'deviceTag', headersFormat)
-    worksheet.write(row, col+3, 'scriptStartTime', headersFormat)
-    worksheet.write(row, col+4, 'scriptEndTime', headersFormat)
-    worksheet.write(row, col+5, 'Nameserver', headersFormat)
-    worksheet.write(row, col+6, 'Query', headersFormat)
-    worksheet.write(row, col+7, 'Record', headersFormat)
-    worksheet.write(row, col+8, 'Response', headersFormat)
-    worksheet.write(row, col+9, 'Response Time', headersFormat)
+    worksheet.write_row(row, col, dataHeaders, headersFormat)
+
+    # The times are formatted by column so each row can be written at once.
+    worksheet.set_column(col+9, col+9, None, numberFormat)
+    worksheet.set_column(col+11, col+12, None, numberFormat)
+
+    o_summaryStats = summaryStats.summaryStats() if summary else None
 
     # Grab the first line from the file
     jf_line = jf.readline()
@@ -61,20 +127,11 @@ def copyJsonFile2Excel(jsonFile, excelFile):
     while jf_line:
         json_dict = json.loads(jf_line)
 
-        for nsEntry in json_dict['queryResults']:
-            for query in json_dict['queryResults'][nsEntry]:
-                queryElements = list(query['query'].items())
-                row += 1
-                worksheet.write(row, col, json_dict['deviceUuid'])
-                worksheet.write(row, col+1, json_dict['hostName'])
-                worksheet.write(row, col+2, json_dict['deviceTag'])
-                worksheet.write(row, col+3, json_dict['scriptUTCStartTime'])
-                worksheet.write(row, col+4, json_dict['scriptUTCEndTime'])
-                worksheet.write(row, col+5, nsEntry)
-                worksheet.write(row, col+6, queryElements[0][0])
-                worksheet.write(row, col+7, queryElements[0][1])
-                worksheet.write(row, col+8, ','.join(query['response']))
-                worksheet.write_number(row, col+9, float(query['responseTime']), numberFormat)
+        for dataRow in resultRows(json_dict):
+            row += 1
+            worksheet.write_row(row, col, dataRow)
+            if o_summaryStats is not None:
+                o_summaryStats.add(dataRow)
 
         # Keep track with the number of entries.
         entries += 1
@@ -96,12 +153,109 @@ def copyJsonFile2Excel(jsonFile, excelFile):
     # Display the average time at the information section of spreadsheet for comparison purposes.
     worksheet.write(3, 1, '=AVERAGE(' + responseTimeArea + ')', numberFormat)
 
+    if o_summaryStats is not None:
+        o_summaryStats.writeSheets(workbook, headersFormat, numberFormat, workbook.add_format({'num_format': '0.00%'}))
+
     # Close the excel spreadsheet.
     workbook.close()
 
     print('Done.')
 
 
+def copyJsonFile2ExcelStreaming(jsonFile, excelFile, summary=False):
+    """
+    Convert very large json files with constant memory.
+    The workbook is opened in constant_memory mode, so every row is flushed to
+    disk as soon as the next row is started and rows have to be written in order.
+    Each row is written with a single write_row call. When a sheet is full
+    (1,048,576 rows) the rows continue on a new sheet.
+    The Info sheet with the totals is written last, with pre-computed values.
+    If summary is set, the summary sheets are added after the result sheets.
+    """
+    print('Starting streaming conversion...')
+    if not path.exists(jsonFile):
+        print('json file does not exist!')
+        sys.exit(1)
+
+    workbook = xlsxwriter.Workbook(excelFile, {'constant_memory': True})
+
+    headersFormat = workbook.add_format({'bold': 1})
+    responseTimeFormat = workbook.add_format({'bold': 1, 'font_color': 'red'})
+    numberFormat = workbook.add_format({'num_format': '0.0'})
+
+    # Added first so it is the first sheet, but filled in once all the rows are known.
+    infoSheet = workbook.add_worksheet('Info')
+
+    sheets = []
+
+    def newDataSheet():
+        """Add a data sheet with the headers in the first row."""
+        worksheet = workbook.add_worksheet('Results ' + str(len(sheets) + 1))
+        worksheet.set_column(9, 9, None, numberFormat)
+        worksheet.set_column(11, 12, None, numberFormat)
+        worksheet.write_row(0, 0, dataHeaders, headersFormat)
+        sheets.append(worksheet)
+        return worksheet
+
+    worksheet = newDataSheet()
+    row = 0
+    totalRows = 0
+    entries = 0
+    responseTimeTotal = 0.0
+    sheetRows = []
+    progress = progressReport()
+    o_summaryStats = summaryStats.summaryStats() if summary else None
+
+    with open(jsonFile, 'r', encoding='utf-8') as jf:
+        for jf_line in jf:
+            if not jf_line.strip():
+                continue
+
+            json_dict = json.loads(jf_line)
+
+            for dataRow in resultRows(json_dict):
+                if row == excelMaxRows - 1:
+                    # Sheet is full, continue on the next one.
+                    sheetRows.append(row)
+                    worksheet = newDataSheet()
+                    row = 0
+
+                row += 1
+                worksheet.write_row(row, 0, dataRow)
+                responseTimeTotal += dataRow[9]
+                totalRows += 1
+                if o_summaryStats is not None:
+                    o_summaryStats.add(dataRow)
+
+            # Keep track with the number of entries.
+            entries += 1
+            progress.update(totalRows)
+
+    sheetRows.append(row)
+
+    # Highlight any entries above the average response time of the sheet.
+    for dataSheet, lastRow in zip(sheets, sheetRows):
+        if lastRow > 0:
+            dataSheet.conditional_format(1, 9, lastRow, 9, {'type': 'average', 'criteria': 'above', 'format': responseTimeFormat})
+
+    infoSheet.write_row(0, 0, ['Input file:', jsonFile])
+    infoSheet.write_row(1, 0, ['Output file:', excelFile])
+    infoSheet.write_row(2, 0, ['Number of Nameserver Entries:', entries])
+    infoSheet.write(3, 0, 'Average response time:')
+    infoSheet.write_number(3, 1, responseTimeTotal / totalRows if totalRows else 0, numberFormat)
+    infoSheet.write_row(4, 0, ['Number of rows:', totalRows])
+    infoSheet.write_row(5, 0, ['Number of result sheets:', len(sheets)])
+    infoSheet.activate()
+
+    if o_summaryStats is not None:
+        o_summaryStats.writeSheets(workbook, headersFormat, numberFormat, workbook.add_format({'num_format': '0.00%'}))
+
+    workbook.close()
+
+    progress.done()
+    print('Done.')
+
+
 def parseArguments():
     """parseArguments definition."""
     # Instantiate the parser
@@ -114,6 +268,12 @@ def parseArguments():
     parser.add_argument('--excelfile', default='output.xlsx',
                         help='the excel file where you want to format the results')
 
+    parser.add_argument('--streaming', action='store_true',
+                        help='convert with constant memory, continuing on new sheets when a sheet is full')
+
+    parser.add_argument('--summary', action='store_true',
+                        help='add summary sheets per nameserver, record type, device tag and hour (requires numpy)')
+
     global args
     args = parser.parse_args()
 
@@ -127,7 +287,10 @@ def main():
     print('Input file argument : ', jsonFile)
     print('Output file argument: ', excelFile)
 
-    copyJsonFile2Excel(jsonFile, excelFile)
+    if args.streaming:
+        copyJsonFile2ExcelStreaming(jsonFile, excelFile, args.summary)
+    else:
+        copyJsonFile2Excel(jsonFile, excelFile, args.summary)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+from array import array
+import sys
+
+
+# The dimensions of the summary sheets: (sheet name, header, column in the data rows).
+summaryDimensions = [
+    ('By Nameserver', 'Nameserver', 5),
+    ('By Record Type', 'Record Type', 6),
+    ('By Device Tag', 'deviceTag', 2),
+    ('By Hour', 'Hour (UTC)', 3)
+]
+
+summaryHeaders = ['Queries', 'Errors', 'Error Rate', 'Mean', 'p50', 'p95', 'p99']
+
+
+class summaryStats:
+    """
+    summaryStats class.
+    Collects the response time, error flag and the dimension values of every
+    row in compact arrays (the dimension values are dictionary encoded), then
+    computes the statistics of all groups of a dimension at once with numpy.
+    """
+
+    def add(self, dataRow):
+        """Add a spreadsheet row created by resultRows."""
+        self.responseTimes.append(dataRow[9])
+        status = dataRow[10]
+        isError = dataRow[8] == 'Err' or (status != '' and status != 'NOERROR')
+        self.errors.append(1 if isError else 0)
+
+        for number, (_, _, column) in enumerate(summaryDimensions):
+            value = dataRow[column]
+            if column == 3:
+                # Group the start time by hour, 'YYYY-MM-DD HH'.
+                value = value[:13]
+            dictionary = self.dictionaries[number]
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+            self.codes[number].append(code)
+
+    def groupStatistics(self, codes):
+        """
+        Return the statistics of every group in codes as rows.
+        The rows are sorted by group code, then by response time, so each group
+        is a contiguous slice and the percentiles are picked by index.
+        """
+        numpy = self.numpy
+        responseTimes = numpy.frombuffer(self.responseTimes, dtype=numpy.float32)
+        errors = numpy.frombuffer(self.errors, dtype=numpy.uint8)
+        codes = numpy.frombuffer(codes, dtype=numpy.uint32)
+
+        order = numpy.lexsort((responseTimes, codes))
+        sortedTimes = responseTimes[order].astype(numpy.float64)
+        sortedCodes = codes[order]
+        sortedErrors = errors[order].astype(numpy.int64)
+
+        starts = numpy.flatnonzero(numpy.r_[True, sortedCodes[1:] != sortedCodes[:-1]])
+        counts = numpy.diff(numpy.r_[starts, len(sortedCodes)])
+
+        groupCodes = sortedCodes[starts]
+        errorCounts = numpy.add.reduceat(sortedErrors, starts)
+        means = numpy.add.reduceat(sortedTimes, starts) / counts
+
+        # Nearest rank percentiles within each group.
+        percentiles = []
+        for q in (0.50, 0.95, 0.99):
+            percentiles.append(sortedTimes[starts + numpy.floor(q * (counts - 1)).astype(numpy.int64)])
+
+        return zip(groupCodes.tolist(), counts.tolist(), errorCounts.tolist(), (errorCounts / counts).tolist(),
+                   means.tolist(), percentiles[0].tolist(), percentiles[1].tolist(), percentiles[2].tolist())
+
+    def writeSheets(self, workbook, headersFormat, numberFormat, percentFormat):
+        """Add a summary sheet for every dimension with the pre-computed values."""
+        for number, (sheetName, header, _) in enumerate(summaryDimensions):
+            worksheet = workbook.add_worksheet(sheetName)
+            worksheet.write_row(0, 0, [header] + summaryHeaders, headersFormat)
+            worksheet.set_column(0, 0, 20)
+            worksheet.set_column(3, 3, None, percentFormat)
+            worksheet.set_column(4, 7, None, numberFormat)
+
+            if not self.responseTimes:
+                continue
+
+            values = {code: value for value, code in self.dictionaries[number].items()}
+            groups = sorted(self.groupStatistics(self.codes[number]), key=lambda statistics: values[statistics[0]])
+            for row, statistics in enumerate(groups, start=1):
+                worksheet.write_row(row, 0, [values[statistics[0]]] + list(statistics[1:]))
+
+    def __init__(self):
+        """Initialize the arrays. Response times are stored as float32."""
+        # numpy is only needed for the summary sheets, so check for it before the conversion starts.
+        try:
+            import numpy
+        except ImportError:
+            print('numpy is required for the summary sheets. Install it with: pip install numpy')
+            sys.exit(1)
+
+        self.numpy = numpy
+        self.responseTimes = array('f')
+        self.errors = array('B')
+        self.codes = [array('I') for _ in summaryDimensions]
+        self.dictionaries = [{} for _ in summaryDimensions]
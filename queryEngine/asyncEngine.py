@@ -0,0 +1,104 @@
+import asyncio
+
+from queryEngine import responseParser, timedQuery
+
+
+class asyncEngine:
+    """
+    asyncEngine class.
+    Performs the queries against all nameservers concurrently with asyncio.
+    The number of queries in flight is limited globally (concurrency) and for
+    each nameserver (serverConcurrency).
+    """
+
+    async def resolveQuery(self, server, query):
+        """Resolve a single query against server and return the json dict for it (skipped when its circuit is tripped)."""
+        queryType, queryName = responseParser.getQueryParts(query)
+
+        if self.health is not None:
+            queryToken = self.health.shouldQuery(server)
+            if queryToken is None:
+                return responseParser.buildSkippedResult(query)
+            timeout, lifetime = self.health.timeouts(server)
+        else:
+            timeout, lifetime = timedQuery.defaultTimeout, timedQuery.defaultLifetime
+
+        timer = timedQuery.queryTimer()
+        error = None
+
+        try:
+            answer = await timedQuery.resolveAsync(server, queryType, queryName, timer, timeout=timeout, lifetime=lifetime)
+
+        except responseParser.queryErrors as err:
+            print(responseParser.queryErrorText(err) + str(query) + ' @' + server)
+            answer = []
+            error = err
+
+        timer.stop()
+
+        queryResult = responseParser.buildResult(query, answer, timer, error)
+        if self.health is not None:
+            self.health.addResult(server, queryResult, queryToken)
+        return queryResult
+
+    async def serverWorker(self, server, pending, serverResults):
+        """Take the next query index for server from pending until there are none left."""
+        for index in pending:
+            async with self.globalLimit:
+                queryResult = await self.resolveQuery(server, self.queries[index])
+
+            if self.resultCallback is not None:
+                self.resultCallback(server, queryResult)
+            if self.keepResults:
+                serverResults[index] = queryResult
+
+            self.counter += 1
+            if self.verbose:
+                print('Query = ' + str(self.queries[index]) + ' @' + server)
+                print('Query count = ' + str(self.counter) + ' of ' + str(self.totalQueries))
+
+    async def run(self):
+        """Start the workers for every nameserver and wait for all of them to finish."""
+        self.globalLimit = asyncio.Semaphore(self.concurrency)
+
+        workers = []
+
+        for server in self.nameservers:
+            if self.keepResults:
+                self.results[server] = [None] * len(self.queries)
+
+            # All the workers of a nameserver share the same iterator, so every
+            # query is only performed once and at most serverConcurrency are in flight.
+            pending = iter(range(len(self.queries)))
+
+            for _ in range(min(self.serverConcurrency, len(self.queries))):
+                workers.append(self.serverWorker(server, pending, self.results.get(server)))
+
+        await asyncio.gather(*workers)
+
+        return self.results
+
+    def performQueries(self):
+        """Perform all the queries against each nameserver and return the results."""
+        return asyncio.run(self.run())
+
+    def __init__(self, nameservers, queries, concurrency, serverConcurrency=None, verbose=False, resultCallback=None, keepResults=True,
+                 health=None):
+        """
+        Initialize the class variables.
+        resultCallback(server, queryResult) is called as soon as each query completes.
+        When keepResults is False the results are only passed to resultCallback.
+        health is the serverHealth that skips the queries of tripped nameservers
+        and sets their timeouts, if any.
+        """
+        self.nameservers = nameservers
+        self.queries = queries
+        self.concurrency = max(concurrency, 1)
+        self.serverConcurrency = max(serverConcurrency or self.concurrency, 1)
+        self.verbose = verbose
+        self.counter = 0
+        self.totalQueries = len(nameservers) * len(queries)
+        self.resultCallback = resultCallback
+        self.keepResults = keepResults
+        self.health = health
+        self.results = {}
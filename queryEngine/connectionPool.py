@@ -0,0 +1,300 @@
+import socket
+import ssl
+import struct
+import time
+
+import dns.exception
+import dns.inet
+import dns.resolver
+
+from queryEngine import timedQuery
+
+
+# Transports of --transport and their default ports.
+transportPorts = {
+    'udp': 53,
+    'tcp': 53,
+    'dot': 853,
+    'doh': 443
+}
+
+
+class pooledConnection:
+    """
+    pooledConnection class.
+    A persistent connection to a single nameserver: plain TCP, TLS (DNS-over-TLS)
+    or HTTPS with HTTP/1.1 keep-alive (DNS-over-HTTPS). The TLS session is kept
+    so a new connection to the same nameserver can resume it.
+    """
+
+    def remaining(self, deadline):
+        """Seconds left until deadline (perf_counter_ns). Raises Timeout when it has passed."""
+        remaining = (deadline - time.perf_counter_ns()) / 1000000000
+        if remaining <= 0:
+            raise dns.exception.Timeout
+        return remaining
+
+    def open(self, deadline):
+        """
+        Connect (and do the TLS handshake) unless the connection is already open.
+        Returns the nanoseconds spent, 0 when the open connection is reused.
+        """
+        if self.sock is not None:
+            return 0
+
+        startNs = time.perf_counter_ns()
+        sock = socket.socket(dns.inet.af_for_address(self.address), socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(self.remaining(deadline))
+            sock.connect((self.address, self.port))
+            connectNs = time.perf_counter_ns()
+
+            if self.pool.transport in ('dot', 'doh'):
+                sock = self.pool.sslContext.wrap_socket(sock, server_hostname=self.pool.tlsHostname or self.address, session=self.session)
+        except socket.timeout:
+            sock.close()
+            raise dns.exception.Timeout
+        except BaseException:
+            sock.close()
+            raise
+
+        endNs = time.perf_counter_ns()
+        self.sock = sock
+        self.buffer.clear()
+        self.queries = 0
+
+        connection = {
+            "connectTime": round((connectNs - startNs) / 1000000, 3),
+            "handshakeTime": round((endNs - startNs) / 1000000, 3)
+        }
+        if isinstance(sock, ssl.SSLSocket):
+            connection["tlsVersion"] = sock.version()
+            connection["tlsResumed"] = sock.session_reused
+        self.connections.append(connection)
+
+        return endNs - startNs
+
+    def close(self):
+        """Close the connection. The next query opens a new one."""
+        if self.sock is not None:
+            if isinstance(self.sock, ssl.SSLSocket) and self.sock.session is not None:
+                self.session = self.sock.session
+            self.sock.close()
+            self.sock = None
+
+    def send(self, wire):
+        """Send a query in wire format with the framing of the transport."""
+        if self.pool.transport == 'doh':
+            request = ('POST ' + self.pool.dohPath + ' HTTP/1.1\r\n'
+                       'Host: ' + self.host + '\r\n'
+                       'Content-Type: application/dns-message\r\n'
+                       'Accept: application/dns-message\r\n'
+                       'Content-Length: ' + str(len(wire)) + '\r\n\r\n')
+            self.sock.sendall(request.encode('ascii') + wire)
+        else:
+            self.sock.sendall(struct.pack('!H', len(wire)) + wire)
+        self.queries += 1
+
+    def receiveMore(self, deadline):
+        """Read more bytes from the connection into the buffer."""
+        self.sock.settimeout(self.remaining(deadline))
+        try:
+            data = self.sock.recv(65536)
+        except socket.timeout:
+            raise dns.exception.Timeout
+        if not data:
+            raise EOFError('connection closed by the nameserver')
+        self.lastReceiveNs = time.perf_counter_ns()
+        self.buffer += data
+
+        # TLS 1.3 session tickets arrive after the handshake, keep the latest one.
+        if isinstance(self.sock, ssl.SSLSocket) and self.sock.session is not None:
+            self.session = self.sock.session
+
+    def receiveExactly(self, count, deadline):
+        """Remove count bytes from the buffer, reading more when needed."""
+        while len(self.buffer) < count:
+            self.receiveMore(deadline)
+        data = bytes(self.buffer[:count])
+        del self.buffer[:count]
+        return data
+
+    def receiveHttp(self, deadline):
+        """Read a single HTTP/1.1 response and return its body."""
+        while b'\r\n\r\n' not in self.buffer:
+            self.receiveMore(deadline)
+        headerLength = self.buffer.index(b'\r\n\r\n') + 4
+        headerLines = bytes(self.buffer[:headerLength]).decode('latin-1').split('\r\n')
+        del self.buffer[:headerLength]
+
+        statusParts = headerLines[0].split(' ', 2)
+        headers = {}
+        for line in headerLines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                while b'\r\n' not in self.buffer:
+                    self.receiveMore(deadline)
+                lineLength = self.buffer.index(b'\r\n') + 2
+                chunkLength = int(bytes(self.buffer[:lineLength]).split(b';')[0], 16)
+                del self.buffer[:lineLength]
+                chunk = self.receiveExactly(chunkLength + 2, deadline)
+                if chunkLength == 0:
+                    break
+                body += chunk[:-2]
+        else:
+            body = self.receiveExactly(int(headers.get('content-length', '0')), deadline)
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+
+        if len(statusParts) < 2 or statusParts[1] != '200':
+            raise ConnectionError('HTTP ' + ' '.join(statusParts[1:]))
+
+        return body
+
+    def receive(self, deadline):
+        """
+        Read the next response. Returns (wire, firstByteNs).
+        When the response was already (partly) read together with an earlier
+        one, the first byte time is the time of that earlier read.
+        """
+        firstByteNs = self.lastReceiveNs if self.buffer else 0
+
+        if self.pool.transport == 'doh':
+            if not self.buffer:
+                self.receiveMore(deadline)
+                firstByteNs = self.lastReceiveNs
+            return self.receiveHttp(deadline), firstByteNs
+
+        if not self.buffer:
+            self.receiveMore(deadline)
+            firstByteNs = self.lastReceiveNs
+        length = struct.unpack('!H', self.receiveExactly(2, deadline))[0]
+        return self.receiveExactly(length, deadline), firstByteNs
+
+    def __init__(self, pool, server):
+        """Initialize the (closed) connection to server."""
+        self.pool = pool
+        self.server = server
+        self.address, self.port = timedQuery.parseNameserver(server, transportPorts[pool.transport])
+        self.host = pool.tlsHostname or (self.address if ':' not in self.address else '[' + self.address + ']')
+        self.sock = None
+        self.session = None
+        self.buffer = bytearray()
+        self.lastReceiveNs = 0
+        self.queries = 0
+        self.connections = []
+
+
+class connectionPool:
+    """
+    connectionPool class.
+    Keeps one persistent connection per nameserver for the tcp, dot and doh
+    transports, across all the queries (and iterations) of a run, and
+    collects the connection setup times for the transportResults section.
+    """
+
+    def connection(self, server):
+        """Return the pooledConnection of server."""
+        connection = self.connections.get(server)
+        if connection is None:
+            connection = self.connections[server] = pooledConnection(self, server)
+        return connection
+
+    def resolve(self, server, queryType, queryName, timer, timeout=timedQuery.defaultTimeout, lifetime=timedQuery.defaultLifetime):
+        """
+        Resolve queryName over the pooled connection to server, the same way
+        timedQuery.resolve does over UDP. The connection setup time is recorded
+        in timer separately from the network time. A reused connection that
+        the nameserver has closed in the meantime is reopened once.
+        """
+        connection = self.connection(server)
+        qname, rdtype, message = timedQuery.makeQuery(queryType, queryName)
+        if self.transport == 'doh':
+            # RFC 8484 recommends ID 0 so responses can be cached.
+            message.id = 0
+        wire = message.to_wire()
+        deadline = timer.startNs + int(lifetime * 1000000000)
+
+        for attempt in range(2):
+            reused = connection.sock is not None
+            try:
+                timer.addHandshakeTime(connection.open(deadline))
+                sendNs = time.perf_counter_ns()
+                connection.send(wire)
+                responseWire, firstByteNs = connection.receive(min(deadline, sendNs + int(timeout * 1000000000)))
+                timer.addNetworkTime(sendNs, firstByteNs)
+                break
+            except dns.exception.Timeout:
+                # A late response would be read as the answer to the next query.
+                connection.close()
+                raise
+            except (OSError, EOFError, ValueError) as err:
+                connection.close()
+                if attempt or not reused:
+                    raise dns.resolver.NoNameservers(request=message, errors=[(server, True, connection.port, err, None)])
+
+        response = timedQuery.parseResponse(message, responseWire)
+        if response is None:
+            connection.close()
+            raise dns.resolver.NoNameservers(request=message, errors=[(server, True, connection.port, 'bad response', None)])
+
+        return timedQuery.makeAnswer(connection.address, connection.port, qname, rdtype, message, response)
+
+    def recordQuery(self, server, timer):
+        """Keep the time of a stopped query apart for queries that opened a connection and queries that reused one."""
+        times = self.queryTimes.setdefault(server, ([], []))
+        times[0 if timer.handshakeNs else 1].append(timer.totalMs())
+
+    def close(self):
+        """Close all the connections."""
+        for connection in self.connections.values():
+            connection.close()
+
+    def transportResults(self):
+        """
+        Return the transportResults section of the json data: every connection
+        that was opened and the mean query time with and without connection setup.
+        """
+        nameservers = {}
+        for server, connection in self.connections.items():
+            newTimes, reusedTimes = self.queryTimes.get(server, ([], []))
+            nameservers[server] = {
+                "connections": connection.connections,
+                "newConnectionQueries": len(newTimes),
+                "newConnectionQueryTime": round(sum(newTimes) / len(newTimes), 3) if newTimes else None,
+                "reusedConnectionQueries": len(reusedTimes),
+                "reusedConnectionQueryTime": round(sum(reusedTimes) / len(reusedTimes), 3) if reusedTimes else None
+            }
+
+        return {
+            "transport": self.transport,
+            "nameservers": nameservers
+        }
+
+    def __init__(self, transport, tlsHostname='', tlsCaFile='', tlsInsecure=False, dohPath='/dns-query'):
+        """
+        Initialize the pool. tlsHostname is used for SNI, certificate verification
+        and the HTTP Host header, without it the certificate has to be valid for
+        the IP address of the nameserver. tlsCaFile adds trusted certificates (for
+        example a self-signed one), tlsInsecure disables the verification.
+        """
+        self.transport = transport
+        self.tlsHostname = tlsHostname
+        self.dohPath = dohPath
+        self.connections = {}
+        self.queryTimes = {}
+        self.sslContext = None
+
+        if transport in ('dot', 'doh'):
+            self.sslContext = ssl.create_default_context(cafile=tlsCaFile or None)
+            if transport == 'doh':
+                self.sslContext.set_alpn_protocols(['http/1.1'])
+            if tlsInsecure:
+                self.sslContext.check_hostname = False
+                self.sslContext.verify_mode = ssl.CERT_NONE
@@ -0,0 +1,253 @@
+import math
+import selectors
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+import dns.inet
+
+from queryEngine import rawEngine, timedQuery
+from queryStats import latencyHistogram
+
+
+# Message IDs are 16 bits, so keep well below 65536 queries in flight per socket.
+maxInFlightPerSocket = 50000
+
+
+def parseRamp(ramp):
+    """
+    Convert the --ramp argument to a list of rates (queries per second).
+    Accepts START:STOP:STEP (for example 100:1000:100) or a comma separated list.
+    """
+    if ':' in ramp:
+        start, stop, step = (float(value) for value in ramp.split(':'))
+        if step <= 0 or start <= 0 or stop < start:
+            raise ValueError('Invalid ramp ' + ramp)
+        rates = []
+        rate = start
+        while rate <= stop + 1e-9:
+            rates.append(rate)
+            rate += step
+        return rates
+
+    rates = [float(value) for value in ramp.split(',') if value]
+    if not rates or min(rates) <= 0:
+        raise ValueError('Invalid ramp ' + ramp)
+    return rates
+
+
+class stepResult:
+    """stepResult class. The counters of one rate step against one nameserver."""
+
+    def toDict(self):
+        """Return the step as a json serializable dict."""
+        data = {
+            "targetQps": self.targetQps,
+            "achievedQps": round(self.sent / self.sendSeconds, 1) if self.sendSeconds else 0.0,
+            "responseQps": round(self.responses / self.sendSeconds, 1) if self.sendSeconds else 0.0,
+            "sent": self.sent,
+            "responses": self.responses,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "sendErrors": self.sendErrors,
+            "maxSendLagMs": round(self.maxLagNs / 1000000, 3)
+        }
+        data.update(self.histogram.summary())
+        return data
+
+    def __init__(self, targetQps):
+        """Initialize the counters."""
+        self.targetQps = targetQps
+        self.sent = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.sendErrors = 0
+        self.sendSeconds = 0.0
+        self.firstSendNs = 0
+        self.lastSendNs = 0
+        self.maxLagNs = 0
+        self.histogram = latencyHistogram.latencyHistogram()
+
+
+class loadSocket:
+    """loadSocket class. One UDP socket of the pool of a nameserver with its queries in flight."""
+
+    def __init__(self, server, port):
+        """Create the connected socket."""
+        address, port = timedQuery.parseNameserver(server, port)
+        self.sock = socket.socket(dns.inet.af_for_address(address), socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        # When the nameserver can not be reached every send is counted as a send error.
+        self.error = None
+        try:
+            self.sock.connect((address, port))
+        except OSError as err:
+            self.error = err
+        self.sock.setblocking(False)
+        # Ordered by send time so the oldest query is always first.
+        self.inFlight = OrderedDict()
+        self.nextId = 0
+
+
+class loadGenerator:
+    """
+    loadGenerator class.
+    Open-loop load generation. Queries are sent on a fixed schedule (rate
+    queries per second) no matter when, or if, the responses arrive.
+    Latency is measured from the time a query was supposed to be sent, so
+    the results are not hidden by the client falling behind (coordinated omission).
+    """
+
+    def runStep(self, server, rate):
+        """Send queries to server at rate queries per second for stepDuration seconds."""
+        result = stepResult(rate)
+        intervalNs = 1000000000 / rate
+        socketCount = max(1, math.ceil(rate * self.timeout / maxInFlightPerSocket))
+        sockets = [loadSocket(server, self.port) for _ in range(socketCount)]
+        if sockets[0].error is not None:
+            print('Unable to send to ' + server + ': ' + str(sockets[0].error))
+        selector = selectors.DefaultSelector()
+        for loadSock in sockets:
+            selector.register(loadSock.sock, selectors.EVENT_READ, loadSock)
+
+        timeoutNs = int(self.timeout * 1000000000)
+        stepStartNs = time.perf_counter_ns()
+        stepEndNs = stepStartNs + int(self.stepDuration * 1000000000)
+        sendIndex = 0
+
+        try:
+            while True:
+                now = time.perf_counter_ns()
+
+                # Send everything that is due, catching up if the client fell behind.
+                while True:
+                    intendedNs = stepStartNs + int(sendIndex * intervalNs)
+                    if intendedNs > now or intendedNs >= stepEndNs:
+                        break
+                    self.sendQuery(sockets[sendIndex % socketCount], sendIndex, intendedNs, result)
+                    result.maxLagNs = max(result.maxLagNs, time.perf_counter_ns() - intendedNs)
+                    sendIndex += 1
+
+                sending = stepStartNs + int(sendIndex * intervalNs) < stepEndNs
+                if not sending and not any(loadSock.inFlight for loadSock in sockets):
+                    break
+
+                # Wait for responses until the next send or the next timeout.
+                nextEvents = []
+                if sending:
+                    nextEvents.append(stepStartNs + int(sendIndex * intervalNs))
+                for loadSock in sockets:
+                    if loadSock.inFlight:
+                        # Queries are in send order, so the first one times out first.
+                        nextEvents.append(next(iter(loadSock.inFlight.values()))[0] + timeoutNs)
+                wait = max((min(nextEvents) - time.perf_counter_ns()) / 1000000000, 0)
+
+                for key, _ in selector.select(wait):
+                    self.receive(key.data, result)
+
+                now = time.perf_counter_ns()
+                for loadSock in sockets:
+                    self.expire(loadSock, now - timeoutNs, result)
+
+            # The time the sends actually took, the sent queries span sent - 1 intervals.
+            if result.sent > 1:
+                result.sendSeconds = (result.lastSendNs - result.firstSendNs) * result.sent / (result.sent - 1) / 1000000000
+        finally:
+            for loadSock in sockets:
+                selector.unregister(loadSock.sock)
+                loadSock.sock.close()
+            selector.close()
+
+        return result
+
+    def sendQuery(self, loadSock, sendIndex, intendedNs, result):
+        """Send the next query from the list on loadSock."""
+        if loadSock.error is not None:
+            result.sendErrors += 1
+            return
+        queryIndex = sendIndex % len(self.prepared)
+        prepared = self.prepared[queryIndex]
+        queryId = loadSock.nextId
+        loadSock.nextId = (queryId + 1) & 0xffff
+        struct.pack_into('!H', prepared.wire, 0, queryId)
+        try:
+            loadSock.sock.send(prepared.wire)
+        except OSError:
+            result.sendErrors += 1
+            return
+        loadSock.inFlight[queryId] = (intendedNs, self.questions[queryIndex])
+        result.lastSendNs = time.perf_counter_ns()
+        if not result.sent:
+            result.firstSendNs = result.lastSendNs
+        result.sent += 1
+
+    def receive(self, loadSock, result):
+        """Read the waiting responses from loadSock."""
+        while True:
+            try:
+                responseWire = loadSock.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            receivedNs = time.perf_counter_ns()
+            if len(responseWire) < 12:
+                continue
+
+            queryId = (responseWire[0] << 8) | responseWire[1]
+            entry = loadSock.inFlight.get(queryId)
+            # The question section is echoed back, a cheap check that it is our query.
+            if entry is None or not responseWire[12:].startswith(entry[1]):
+                continue
+
+            del loadSock.inFlight[queryId]
+            result.responses += 1
+            result.histogram.add((receivedNs - entry[0]) / 1000000)
+
+            # Any rcode other than NOERROR.
+            if responseWire[3] & 0x0f:
+                result.errors += 1
+
+    def expire(self, loadSock, expiredBeforeNs, result):
+        """Count the queries that were sent before expiredBeforeNs as timeouts."""
+        while loadSock.inFlight:
+            queryId, entry = next(iter(loadSock.inFlight.items()))
+            if entry[0] > expiredBeforeNs:
+                break
+            del loadSock.inFlight[queryId]
+            result.timeouts += 1
+
+    def run(self):
+        """Run every rate step against each nameserver. Returns the loadTestResults section of the json data."""
+        servers = {}
+
+        for server in self.nameservers:
+            servers[server] = []
+            for rate in self.rates:
+                if self.verbose:
+                    print('Load test ' + server + ' at ' + str(rate) + ' queries per second.')
+                servers[server].append(self.runStep(server, rate).toDict())
+
+        return {
+            "stepDurationSeconds": self.stepDuration,
+            "timeoutSeconds": self.timeout,
+            "nameservers": servers
+        }
+
+    def __init__(self, nameservers, queries, rates, stepDuration=10.0, timeout=2.0, verbose=False, port=53):
+        """Initialize the class variables and encode every query once."""
+        self.nameservers = nameservers
+        # Queries that cannot be encoded (for example an unknown type) are skipped.
+        self.prepared = [prepared for prepared in (rawEngine.preparedQuery(query) for query in queries) if prepared.error is None]
+        if not self.prepared:
+            raise ValueError('No valid queries to send.')
+        # The question section after the 12 byte header, which the response starts with as well.
+        self.questions = [bytes(prepared.wire[12:16 + len(prepared.qname.to_wire())]) for prepared in self.prepared]
+        self.rates = rates
+        self.stepDuration = stepDuration
+        self.timeout = timeout
+        self.verbose = verbose
+        self.port = port
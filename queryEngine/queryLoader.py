@@ -0,0 +1,199 @@
+import gzip
+import io
+import os
+import sys
+import threading
+from array import array
+
+
+# Lines read by the loader thread before the waiting readers are woken up.
+notifyBatch = 1000
+
+
+def isUrl(source):
+    """Return True when source is an http or https URL."""
+    return source.startswith('http://') or source.startswith('https://')
+
+
+def openSource(source):
+    """
+    Open a plain, .gz or .zst file or URL and return a binary file object, streamed
+    without reading it all. Raises OSError when it can not be opened.
+    """
+    if isUrl(source):
+        import requests
+
+        try:
+            response = requests.get(source, stream=True, timeout=30)
+        except requests.exceptions.RequestException as err:
+            raise OSError('Could not connect to URL - ' + source + ': ' + str(err))
+        if response.status_code != 200:
+            response.close()
+            raise OSError('Error while retrieving URL ' + source + ': HTTP ' + str(response.status_code))
+        # A Content-Encoding of the transfer is decoded, the .gz or .zst of the file itself is handled below.
+        response.raw.decode_content = True
+        rawFile = response.raw
+        fileName = source.split('?')[0]
+    else:
+        rawFile = open(source, 'rb')
+        fileName = source
+
+    if fileName.endswith('.gz'):
+        return gzip.GzipFile(fileobj=rawFile)
+    if fileName.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            rawFile.close()
+            raise OSError('zstandard is required for .zst files. Install it with: pip install zstandard')
+        return zstandard.ZstdDecompressor().stream_reader(rawFile, closefd=True)
+    return rawFile
+
+
+def readLines(sourceFile):
+    """Yield the lines of a binary file object without line ends, skipping blank lines and # comments. Closes the file."""
+    with sourceFile:
+        for line in io.TextIOWrapper(sourceFile, encoding='utf-8', errors='replace'):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+def parseQueryLine(line):
+    """
+    Return the (queryType, queryName) of a line of a queries file, lower case.
+    The line is NAME or NAME,TYPE, or RANK,NAME as in the Tranco and Umbrella top lists.
+    """
+    if ',' not in line:
+        return 'a', line.lower()
+
+    first, second = line.split(',', 2)[:2]
+    first = first.strip()
+    second = second.strip()
+    if first.isdigit() and '.' in second:
+        # rank,domain
+        return 'a', second.lower()
+    return second.lower(), first.lower()
+
+
+class queryList:
+    """
+    queryList class.
+    The queries of a queries file, read by a background thread, so the first
+    queries can be sent while the rest of the file is still being read. Each
+    query is stored once as an interned name and a type number (duplicates are
+    skipped) and is only turned into the usual {type: name} dict when it is used.
+    Iterating waits for the next query to be read, len() and indexing wait as long
+    as needed, so the engines that need the whole list simply start a bit later.
+    """
+
+    def loadLines(self, lines):
+        """Read all the lines into the list. Runs in the loader thread."""
+        names = self.names
+        types = self.types
+        typeNumbers = self.typeNumbers
+        seen = self.seen
+        pending = 0
+
+        try:
+            for line in lines:
+                queryType, queryName = parseQueryLine(line)
+                queryName = sys.intern(queryName)
+
+                typeNumber = typeNumbers.get(queryType)
+                if typeNumber is None:
+                    typeNumber = typeNumbers[queryType] = len(self.typeNames)
+                    self.typeNames.append(sys.intern(queryType))
+
+                # The set of type numbers of every name, as a bit mask.
+                typeBit = 1 << typeNumber
+                typeMask = seen.get(queryName, 0)
+                if typeMask & typeBit:
+                    self.duplicates += 1
+                    continue
+                seen[queryName] = typeMask | typeBit
+
+                names.append(queryName)
+                types.append(typeNumber)
+
+                pending += 1
+                if pending >= notifyBatch:
+                    pending = 0
+                    with self.condition:
+                        self.condition.notify_all()
+        except (OSError, EOFError, ValueError) as err:
+            self.error = err
+            print('Error while reading the queries: ' + str(err))
+        finally:
+            # The duplicate check is not needed anymore once the list is complete.
+            self.seen = None
+            with self.condition:
+                self.finished = True
+                self.condition.notify_all()
+
+    def waitFor(self, count):
+        """Wait until count queries are read or the whole list is read."""
+        if len(self.names) >= count or self.finished:
+            return
+        with self.condition:
+            while len(self.names) < count and not self.finished:
+                self.condition.wait()
+
+    def query(self, index):
+        """Return the query at index as a {type: name} dict."""
+        return {self.typeNames[self.types[index]]: self.names[index]}
+
+    def __iter__(self):
+        """Yield the queries, also while the list is still being read."""
+        index = 0
+        while True:
+            self.waitFor(index + 1)
+            if index >= len(self.names):
+                return
+            yield self.query(index)
+            index += 1
+
+    def __len__(self):
+        """Return the number of queries, after the whole list is read."""
+        self.waitFor(sys.maxsize)
+        return len(self.names)
+
+    def __getitem__(self, index):
+        """Return the query at index, or a list of queries for a slice."""
+        if isinstance(index, slice):
+            return [self.query(position) for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        self.waitFor(index + 1)
+        if index >= len(self.names):
+            raise IndexError('query index out of range')
+        return self.query(index)
+
+    def __init__(self, lines=()):
+        """Start reading lines (an iterable of query lines) in the loader thread."""
+        self.names = []
+        self.types = array('H')
+        self.typeNames = []
+        self.typeNumbers = {}
+        self.seen = {}
+        self.duplicates = 0
+        self.error = None
+        self.finished = False
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.loadLines, args=(lines,), daemon=True)
+        self.thread.start()
+
+
+def loadQueries(source):
+    """Return a queryList that streams the queries from a file or URL. Raises OSError when it can not be opened."""
+    if not isUrl(source) and not os.path.exists(source):
+        raise OSError('I cannot find file ' + source)
+    return queryList(readLines(openSource(source)))
+
+
+def loadLines(source):
+    """Return all the lines of a small file or URL (the nameservers file) as a list. Raises OSError when it can not be opened."""
+    if not isUrl(source) and not os.path.exists(source):
+        raise OSError('I cannot find file ' + source)
+    return list(readLines(openSource(source)))
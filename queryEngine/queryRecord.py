@@ -0,0 +1,84 @@
+import sys
+from collections.abc import Mapping
+
+
+# The keys of a query result in the json data, in order. handshakeTime is only
+# there for the connection transports.
+resultKeys = ('query', 'response', 'responseStatus', 'responseTime', 'networkTime', 'processingTime', 'responseTTL', 'handshakeTime')
+
+# The response of a query without an answer.
+errResponse = ('Err',)
+
+
+class queryRecord(Mapping):
+    """
+    queryRecord class.
+    The result of a single query, without the per-result dicts of the json
+    layout: the times are float milliseconds at full precision, the query type,
+    name and status are interned strings and the response is a tuple. It reads
+    like the json dict (queryResult['responseTime'], queryResult.get(...),
+    'handshakeTime' in queryResult), and toDict() returns that dict when the
+    results are serialized.
+    """
+
+    __slots__ = ('queryType', 'queryName', 'response', 'responseStatus', 'responseTime', 'networkTime', 'processingTime',
+                 'responseTTL', 'handshakeTime')
+
+    def __getitem__(self, key):
+        """Return the json value for key."""
+        if key == 'query':
+            return {self.queryType: self.queryName}
+        if key == 'handshakeTime' and self.handshakeTime is None:
+            raise KeyError(key)
+        if key not in resultKeys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        """Yield the json keys."""
+        for key in resultKeys:
+            if key != 'handshakeTime' or self.handshakeTime is not None:
+                yield key
+
+    def __len__(self):
+        """Return the number of json keys."""
+        return len(resultKeys) - (self.handshakeTime is None)
+
+    def toDict(self):
+        """Return the json dict of the result."""
+        result = {
+            "query": {self.queryType: self.queryName},
+            "response": list(self.response),
+            "responseStatus": self.responseStatus,
+            "responseTime": self.responseTime,
+            "networkTime": self.networkTime,
+            "processingTime": self.processingTime,
+            "responseTTL": self.responseTTL
+        }
+        if self.handshakeTime is not None:
+            result["handshakeTime"] = self.handshakeTime
+        return result
+
+    def __repr__(self):
+        """Return the json dict as text, as for --verbose."""
+        return repr(self.toDict())
+
+    def __init__(self, queryType, queryName, response, responseStatus, responseTime, networkTime, processingTime,
+                 responseTTL, handshakeTime=None):
+        """Initialize the record. The times are in milliseconds."""
+        self.queryType = sys.intern(queryType)
+        self.queryName = sys.intern(queryName)
+        self.response = response
+        self.responseStatus = responseStatus
+        self.responseTime = responseTime
+        self.networkTime = networkTime
+        self.processingTime = processingTime
+        self.responseTTL = responseTTL
+        self.handshakeTime = handshakeTime
+
+
+def toJson(value):
+    """json.dumps default= function that serializes queryRecords as their json dicts."""
+    if isinstance(value, queryRecord):
+        return value.toDict()
+    raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
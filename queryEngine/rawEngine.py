@@ -0,0 +1,345 @@
+import random
+import selectors
+import socket
+import struct
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.resolver
+
+from queryEngine import responseParser, timedQuery
+
+
+# Threads for the TCP retries of truncated responses.
+tcpWorkers = 8
+
+
+class preparedQuery:
+    """
+    preparedQuery class.
+    A query from the queries file encoded to wire format once. Only the
+    16-bit message ID is rewritten before each send.
+    """
+
+    __slots__ = ('query', 'qname', 'rdtype', 'message', 'wire', 'error')
+
+    def matches(self, response):
+        """Check that response answers this question."""
+        if not response.flags & dns.flags.QR or len(response.question) != 1:
+            return False
+        question = response.question[0]
+        return question.name == self.qname and question.rdtype == self.rdtype
+
+    def __init__(self, query):
+        """Build the message for query. Invalid queries keep the error to report later."""
+        self.query = query
+        self.error = None
+        queryType, queryName = responseParser.getQueryParts(query)
+        try:
+            self.qname, self.rdtype, self.message = timedQuery.makeQuery(queryType, queryName)
+            self.wire = bytearray(self.message.to_wire())
+        except (dns.exception.DNSException, ValueError) as err:
+            self.error = err
+
+
+class inFlightQuery:
+    """inFlightQuery class. A query that has been sent and is waiting for its response."""
+
+    __slots__ = ('index', 'timer', 'sendNs', 'timeoutNs', 'attemptDeadline', 'deadline', 'healthToken')
+
+
+class serverState:
+    """serverState class. The long-lived socket and the queue of a single nameserver."""
+
+    def nextId(self):
+        """Pick a random message ID that is not in flight on this socket."""
+        while True:
+            queryId = random.getrandbits(16)
+            if queryId not in self.inFlight:
+                return queryId
+
+    def __init__(self, server, port, queryCount, resultCount):
+        """Create the socket for server."""
+        self.server = server
+        self.address, self.port = timedQuery.parseNameserver(server, port)
+        self.sock = socket.socket(dns.inet.af_for_address(self.address), socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        # A connected socket only receives datagrams from the nameserver.
+        # When the nameserver can not be reached every query fails with the error.
+        self.error = None
+        try:
+            self.sock.connect((self.address, self.port))
+        except OSError as err:
+            self.error = err
+        self.sock.setblocking(False)
+        self.pending = deque(range(queryCount))
+        self.inFlight = {}
+        self.results = [None] * resultCount
+
+
+class rawEngine:
+    """
+    rawEngine class.
+    Low overhead query engine. Every query is encoded once, each nameserver
+    has one long-lived UDP socket with up to serverConcurrency queries in
+    flight, and responses are matched to their query by message ID.
+    Truncated responses are retried over TCP in worker threads, so they do
+    not hold up the other queries.
+    """
+
+    def finishQuery(self, state, entry, answer, error=None):
+        """Store the result of a query and free its slot."""
+        prepared = self.prepared[entry.index]
+        if error is not None:
+            print(responseParser.queryErrorText(error) + str(prepared.query) + ' @' + state.server)
+        entry.timer.stop()
+        queryResult = responseParser.buildResult(prepared.query, answer, entry.timer, error)
+        if self.health is not None:
+            self.health.addResult(state.server, queryResult, entry.healthToken)
+        if self.resultCallback is not None:
+            self.resultCallback(state.server, queryResult)
+        if self.keepResults:
+            state.results[entry.index] = queryResult
+        self.inFlightTotal -= 1
+        self.counter += 1
+
+        if self.verbose:
+            print('Query = ' + str(prepared.query) + ' @' + state.server)
+            print('Query count = ' + str(self.counter) + ' of ' + str(self.totalQueries))
+
+    def skipQuery(self, state, index):
+        """Store the skipped result of a query to a nameserver whose circuit is tripped."""
+        queryResult = responseParser.buildSkippedResult(self.prepared[index].query)
+        if self.resultCallback is not None:
+            self.resultCallback(state.server, queryResult)
+        if self.keepResults:
+            state.results[index] = queryResult
+        self.counter += 1
+
+    def sendQuery(self, state, entry):
+        """Write a new message ID into the prepared wire data and send it."""
+        prepared = self.prepared[entry.index]
+        queryId = state.nextId()
+        struct.pack_into('!H', prepared.wire, 0, queryId)
+        entry.sendNs = time.perf_counter_ns()
+        entry.attemptDeadline = min(entry.sendNs + entry.timeoutNs, entry.deadline)
+        state.inFlight[queryId] = entry
+        try:
+            state.sock.send(prepared.wire)
+        except OSError:
+            # The attempt will time out and be retried.
+            pass
+
+    def fillWindow(self, state):
+        """Send queued queries until the nameserver or the global limit is reached."""
+        while state.pending and len(state.inFlight) < self.serverConcurrency and self.inFlightTotal < self.concurrency:
+            index = state.pending.popleft()
+            healthToken = self.health.shouldQuery(state.server) if self.health is not None else None
+            if self.health is not None and healthToken is None:
+                self.skipQuery(state, index)
+                continue
+
+            entry = inFlightQuery()
+            entry.index = index
+            entry.healthToken = healthToken
+            entry.timer = timedQuery.queryTimer()
+            if self.health is not None:
+                timeout, lifetime = self.health.timeouts(state.server)
+                entry.timeoutNs = int(timeout * 1000000000)
+                entry.deadline = entry.timer.startNs + int(lifetime * 1000000000)
+            else:
+                entry.timeoutNs = self.timeoutNs
+                entry.deadline = entry.timer.startNs + self.lifetimeNs
+            self.inFlightTotal += 1
+
+            prepared = self.prepared[index]
+            if prepared.error is not None:
+                self.finishQuery(state, entry, [], prepared.error)
+                continue
+            if state.error is not None:
+                error = dns.resolver.NoNameservers(request=prepared.message, errors=[(state.address, False, state.port, state.error, None)])
+                self.finishQuery(state, entry, [], error)
+                continue
+
+            self.sendQuery(state, entry)
+
+    def receive(self, state):
+        """Read all the waiting responses from the socket of state."""
+        while True:
+            try:
+                responseWire = state.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP errors on the connected socket. The queries will time out.
+                return
+
+            firstByteNs = time.perf_counter_ns()
+
+            if len(responseWire) < 12:
+                continue
+
+            entry = state.inFlight.get((responseWire[0] << 8) | responseWire[1])
+            if entry is None:
+                # Late response to a query that has already been retried or timed out.
+                continue
+
+            prepared = self.prepared[entry.index]
+            try:
+                response = dns.message.from_wire(responseWire)
+            except dns.exception.DNSException:
+                continue
+            if not prepared.matches(response):
+                continue
+
+            del state.inFlight[response.id]
+            entry.timer.addNetworkTime(entry.sendNs, firstByteNs)
+
+            if response.flags & dns.flags.TC:
+                # The query keeps its slot until the TCP retry is done.
+                future = self.tcpExecutor.submit(timedQuery.queryTcp, state.address, state.port, prepared.message,
+                                                 prepared.message.to_wire(), entry.timer, entry.deadline)
+                future.add_done_callback(self.wake)
+                self.tcpQueries.append((state, entry, future))
+                continue
+
+            self.answerQuery(state, entry, response)
+
+    def answerQuery(self, state, entry, response):
+        """Finish a query with the response of the nameserver."""
+        prepared = self.prepared[entry.index]
+        try:
+            answer = timedQuery.makeAnswer(state.address, state.port, prepared.qname, prepared.rdtype, prepared.message, response)
+        except responseParser.queryErrors as err:
+            self.finishQuery(state, entry, [], err)
+        else:
+            self.finishQuery(state, entry, answer)
+
+    def wake(self, future):
+        """Wake up the selector when a TCP retry is done. Called from the worker thread."""
+        try:
+            self.wakeSend.send(b'\0')
+        except OSError:
+            # The selector is already woken up.
+            pass
+
+    def finishTcp(self):
+        """Finish the queries whose TCP retry is done."""
+        running = []
+        for state, entry, future in self.tcpQueries:
+            if not future.done():
+                running.append((state, entry, future))
+                continue
+            try:
+                response = future.result()
+            except responseParser.queryErrors as err:
+                self.finishQuery(state, entry, [], err)
+            else:
+                self.answerQuery(state, entry, response)
+        self.tcpQueries = running
+
+    def expire(self, state, now):
+        """Retry the queries whose attempt has timed out, or fail them once the lifetime has passed."""
+        for queryId, entry in list(state.inFlight.items()):
+            if entry.attemptDeadline > now:
+                continue
+            del state.inFlight[queryId]
+            entry.timer.addNetworkTime(entry.sendNs, now)
+            if now >= entry.deadline:
+                self.finishQuery(state, entry, [], dns.exception.Timeout())
+            else:
+                self.sendQuery(state, entry)
+
+    def performQueries(self):
+        """Perform all the queries against each nameserver and return the results."""
+        selector = selectors.DefaultSelector()
+        states = []
+
+        for server in self.nameservers:
+            state = serverState(server, self.port, len(self.queries), len(self.queries) if self.keepResults else 0)
+            selector.register(state.sock, selectors.EVENT_READ, state)
+            states.append(state)
+
+        # The worker threads of the TCP retries wake up the selector through this socket pair.
+        wakeReceive, self.wakeSend = socket.socketpair()
+        wakeReceive.setblocking(False)
+        self.wakeSend.setblocking(False)
+        selector.register(wakeReceive, selectors.EVENT_READ, None)
+        self.tcpExecutor = ThreadPoolExecutor(tcpWorkers)
+        self.tcpQueries = []
+
+        try:
+            while self.tcpQueries or any(state.pending or state.inFlight for state in states):
+                for state in states:
+                    self.fillWindow(state)
+
+                deadlines = [entry.attemptDeadline for state in states for entry in state.inFlight.values()]
+                if deadlines:
+                    wait = max((min(deadlines) - time.perf_counter_ns()) / 1000000000, 0)
+                elif self.tcpQueries:
+                    # Only TCP retries left, which end by their deadline.
+                    wait = None
+                else:
+                    # fillWindow sends whenever a slot is free, so the queries that were left have been skipped or have failed.
+                    break
+
+                for key, _ in selector.select(wait):
+                    if key.data is None:
+                        try:
+                            wakeReceive.recv(4096)
+                        except BlockingIOError:
+                            pass
+                    else:
+                        self.receive(key.data)
+
+                self.finishTcp()
+                now = time.perf_counter_ns()
+                for state in states:
+                    self.expire(state, now)
+        finally:
+            self.tcpExecutor.shutdown(wait=True, cancel_futures=True)
+            for state in states:
+                selector.unregister(state.sock)
+                state.sock.close()
+            selector.unregister(wakeReceive)
+            wakeReceive.close()
+            self.wakeSend.close()
+            selector.close()
+
+        if self.keepResults:
+            for state in states:
+                self.results[state.server] = state.results
+
+        return self.results
+
+    def __init__(self, nameservers, queries, concurrency=0, serverConcurrency=10, verbose=False, port=53,
+                 timeout=timedQuery.defaultTimeout, lifetime=timedQuery.defaultLifetime, resultCallback=None, keepResults=True, health=None):
+        """
+        Initialize the class variables and encode every query once.
+        resultCallback(server, queryResult) is called as soon as each query completes.
+        When keepResults is False the results are only passed to resultCallback.
+        health is the serverHealth that skips the queries of tripped nameservers
+        and sets their timeouts instead of timeout and lifetime, if any.
+        """
+        self.nameservers = nameservers
+        self.queries = queries
+        self.prepared = [preparedQuery(query) for query in queries]
+        self.serverConcurrency = max(serverConcurrency, 1)
+        # A concurrency of 0 means no global limit.
+        self.concurrency = concurrency if concurrency > 0 else len(nameservers) * self.serverConcurrency
+        self.verbose = verbose
+        self.port = port
+        self.timeoutNs = int(timeout * 1000000000)
+        self.lifetimeNs = int(lifetime * 1000000000)
+        self.resultCallback = resultCallback
+        self.keepResults = keepResults
+        self.health = health
+        self.inFlightTotal = 0
+        self.counter = 0
+        self.totalQueries = len(nameservers) * len(queries)
+        self.results = {}
@@ -0,0 +1,124 @@
+import dns.exception
+import dns.rcode
+import dns.rdatatype
+import dns.resolver
+
+from queryEngine import queryRecord
+
+
+# Exceptions that are reported as a failed query rather than stopping the run.
+queryErrors = (
+    dns.rdatatype.UnknownRdatatype,
+    dns.resolver.NoAnswer,
+    dns.exception.Timeout,
+    dns.resolver.NXDOMAIN,
+    dns.resolver.NoNameservers
+)
+
+
+# Values of responseStatus in the query results.
+statusOk = 'NOERROR'
+statusNxdomain = 'NXDOMAIN'
+statusNoAnswer = 'NOANSWER'
+statusTimeout = 'TIMEOUT'
+statusServfail = 'SERVFAIL'
+# No DNS response: the query could not be sent or the connection failed.
+statusError = 'ERROR'
+statusBadType = 'BADTYPE'
+# Not sent, the circuit of the nameserver was tripped (--circuitBreaker).
+statusSkipped = 'SKIPPED'
+
+# Statuses where no usable response came back from the nameserver.
+lossStatuses = (statusTimeout, statusSkipped)
+
+
+def getQueryParts(query):
+    """Return the (queryType, queryName) pair of a query entry, both lower case."""
+    queryType, queryName = list(query.items())[0]
+    return queryType.lower(), queryName.lower()
+
+
+def queryErrorText(error):
+    """Return the text that is displayed when a query fails with error."""
+    # Typical timeout is 5.5s
+    if isinstance(error, dns.rdatatype.UnknownRdatatype):
+        return 'Unkown DNS response - '
+    if isinstance(error, dns.resolver.NoAnswer):
+        return 'No DNS answer - '
+    if isinstance(error, dns.exception.Timeout):
+        return 'DNS Timeout - '
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return 'NXDOMAIN response - '
+    return 'No response. '
+
+
+def queryErrorStatus(error):
+    """Return the responseStatus for a query that failed with error."""
+    if isinstance(error, dns.rdatatype.UnknownRdatatype):
+        return statusBadType
+    if isinstance(error, dns.resolver.NoAnswer):
+        return statusNoAnswer
+    if isinstance(error, dns.exception.Timeout):
+        return statusTimeout
+    if isinstance(error, dns.resolver.NXDOMAIN):
+        return statusNxdomain
+    # A response with an error rcode has the rcode as its status, for example SERVFAIL or REFUSED.
+    if isinstance(error, dns.resolver.NoNameservers):
+        for errorEntry in reversed(error.kwargs.get('errors', [])):
+            if errorEntry[4] is not None:
+                return dns.rcode.to_text(errorEntry[4].rcode())
+    return statusError
+
+
+def parseAnswer(queryType, answer):
+    """
+    Extract the response text from answer for the queryType.
+    Returns a list of strings, one entry per record in the answer.
+    """
+    l_response = []
+
+    if queryType in ("a", "aaaa"):
+        for response in answer:
+            l_response.append(response.address)
+
+    if queryType in ("mx", "ptr", "cname", "ns"):
+        for response in answer:
+            l_response.append(response.to_text())
+
+    if queryType == "soa":
+        for response in answer:
+            l_response.append(response.to_text().split(' ')[0])
+
+    return l_response
+
+
+def buildResult(query, answer, timer, error=None):
+    """
+    Create the queryRecord for a single query from the answer and the
+    queryTimer (timer) that measured it.
+    If there were no answers from the query, the response is set to 'Err'
+    and the TTL to -1. error is the exception the query failed with, if any.
+    """
+    queryType, queryName = list(query.items())[0]
+
+    if answer:
+        l_response = tuple(parseAnswer(queryType.lower(), answer))
+        a_responseTTL = answer.rrset.ttl
+    else:
+        l_response = queryRecord.errResponse
+        a_responseTTL = -1
+
+    if error is not None:
+        s_status = queryErrorStatus(error)
+    else:
+        s_status = statusOk
+
+    # The times are kept as float milliseconds, they are only formatted for display.
+    return queryRecord.queryRecord(queryType, queryName, l_response, s_status, timer.totalMs(), timer.networkMs(),
+                                   timer.processingMs(), a_responseTTL, timer.handshakeMs())
+
+
+def buildSkippedResult(query):
+    """Create the queryRecord for a query that was skipped because the circuit of its nameserver was tripped."""
+    queryType, queryName = list(query.items())[0]
+    return queryRecord.queryRecord(queryType, queryName, queryRecord.errResponse, statusSkipped, 0.0, 0.0, 0.0, -1)
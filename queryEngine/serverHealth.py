@@ -0,0 +1,166 @@
+import time
+from collections import deque
+
+from queryEngine import responseParser, timedQuery
+
+
+# Network times kept per nameserver for the adaptive timeout.
+rttWindow = 200
+
+# Responses needed before the timeout of a nameserver is derived from them.
+minSamples = 20
+
+# Lowest adaptive timeout per attempt in seconds.
+minTimeout = 0.1
+
+# New network times before the adaptive timeout is derived again.
+recomputeAfter = 10
+
+# The token of shouldQuery for a query that is not a probe.
+regularQuery = 0
+
+
+def percentile(sortedValues, fraction):
+    """Return the nearest-rank percentile of the sorted values."""
+    return sortedValues[min(int(fraction * len(sortedValues)), len(sortedValues) - 1)]
+
+
+class nameserverState:
+    """nameserverState class. The health of a single nameserver."""
+
+    __slots__ = ('networkTimes', 'newTimes', 'consecutiveTimeouts', 'tripped', 'probing', 'nextProbe', 'trips', 'probes', 'skipped', 'timeouts')
+
+    def __init__(self):
+        """Initialize a healthy nameserver with the default timeouts."""
+        self.networkTimes = deque(maxlen=rttWindow)
+        self.newTimes = 0
+        self.consecutiveTimeouts = 0
+        self.tripped = False
+        # The token of the probe in flight, regularQuery when there is none.
+        self.probing = regularQuery
+        self.nextProbe = 0.0
+        self.trips = 0
+        self.probes = 0
+        self.skipped = 0
+        self.timeouts = None
+
+
+class serverHealth:
+    """
+    serverHealth class.
+    Tracks every nameserver over a run and the runs after it (--iterations,
+    --daemon). After tripAfter consecutive timeouts the circuit of a nameserver
+    trips: its queries are skipped instead of each waiting out the lifetime,
+    except for a probe query every probeInterval seconds. A probe that gets a
+    response closes the circuit again. With a timeoutFactor the timeout of an
+    attempt is timeoutFactor x the p99 of the recent network times of the
+    nameserver (between minTimeout and the default 2 seconds) instead of the
+    default. A tripAfter or timeoutFactor of 0 disables that part.
+    """
+
+    def state(self, server):
+        """Return the state of server, added on first use."""
+        serverState = self.servers.get(server)
+        if serverState is None:
+            serverState = self.servers[server] = nameserverState()
+        return serverState
+
+    def shouldQuery(self, server):
+        """
+        Return None when the query to server is skipped because its circuit is
+        tripped. Otherwise return the token of the query, which is passed to
+        addResult with its result: regularQuery, or the number of the probe.
+        """
+        serverState = self.state(server)
+        if not serverState.tripped:
+            return regularQuery
+        if serverState.probing or time.monotonic() < serverState.nextProbe:
+            serverState.skipped += 1
+            return None
+        # Only one probe in flight, the other queries are still skipped.
+        serverState.probes += 1
+        serverState.probing = serverState.probes
+        return serverState.probing
+
+    def timeouts(self, server):
+        """Return the (timeout, lifetime) in seconds of the next query to server."""
+        serverState = self.state(server)
+        if not self.timeoutFactor or len(serverState.networkTimes) < minSamples:
+            return timedQuery.defaultTimeout, timedQuery.defaultLifetime
+        # Sorting the window on every query is too slow, it is only done after recomputeAfter new times.
+        if serverState.timeouts is None or serverState.newTimes >= recomputeAfter:
+            serverState.newTimes = 0
+            p99 = percentile(sorted(serverState.networkTimes), 0.99)
+            timeout = min(max(self.timeoutFactor * p99 / 1000, minTimeout), timedQuery.defaultTimeout)
+            # The same number of attempts as the defaults.
+            lifetime = timeout * timedQuery.defaultLifetime / timedQuery.defaultTimeout
+            serverState.timeouts = (timeout, lifetime)
+        return serverState.timeouts
+
+    def addResult(self, server, queryResult, token=regularQuery):
+        """
+        Update the health of server with a completed (not skipped) query. Only a
+        timeout or a response counts, not a local error. token is
+        the one shouldQuery returned for the query, so a query that was already in
+        flight when the circuit tripped is not taken for the probe.
+        """
+        serverState = self.state(server)
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+        isProbe = token != regularQuery and token == serverState.probing
+
+        if status == responseParser.statusTimeout:
+            serverState.consecutiveTimeouts += 1
+            if serverState.tripped:
+                if isProbe:
+                    serverState.probing = regularQuery
+                    serverState.nextProbe = time.monotonic() + self.probeInterval
+            elif self.tripAfter and serverState.consecutiveTimeouts >= self.tripAfter:
+                serverState.tripped = True
+                serverState.trips += 1
+                serverState.nextProbe = time.monotonic() + self.probeInterval
+                print('Circuit tripped @' + server + ' after ' + str(serverState.consecutiveTimeouts) +
+                      ' consecutive timeouts, skipping its queries.')
+            return
+
+        # A local error (an invalid query or a failed send) got no response, it says nothing about the nameserver.
+        if not float(queryResult.get('networkTime', 0)) > 0:
+            if isProbe:
+                serverState.probing = regularQuery
+                serverState.nextProbe = time.monotonic() + self.probeInterval
+            return
+
+        # Any response shows the nameserver is reachable.
+        serverState.consecutiveTimeouts = 0
+        serverState.networkTimes.append(float(queryResult['networkTime']))
+        serverState.newTimes += 1
+        if serverState.tripped:
+            serverState.tripped = False
+            serverState.probing = regularQuery
+            print('Circuit closed @' + server + (', the probe query got a response.' if isProbe else ', a query got a response.'))
+
+    def healthResults(self):
+        """Return the healthResults section of the json data."""
+        nameservers = {}
+        for server, serverState in self.servers.items():
+            timeout, lifetime = self.timeouts(server)
+            nameservers[server] = {
+                "tripped": serverState.tripped,
+                "trips": serverState.trips,
+                "probes": serverState.probes,
+                "skipped": serverState.skipped,
+                "timeout": round(timeout, 3),
+                "lifetime": round(lifetime, 3)
+            }
+        return {
+            "tripAfter": self.tripAfter,
+            "probeInterval": self.probeInterval,
+            "timeoutFactor": self.timeoutFactor,
+            "nameservers": nameservers
+        }
+
+    def __init__(self, tripAfter=0, probeInterval=30.0, timeoutFactor=0.0):
+        """Initialize the class variables."""
+        self.tripAfter = tripAfter
+        self.probeInterval = probeInterval
+        self.timeoutFactor = timeoutFactor
+        self.servers = {}
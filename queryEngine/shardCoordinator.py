@@ -0,0 +1,343 @@
+import json
+import statistics
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from queryEngine import queryRecord
+
+
+# Seconds an idle worker waits before asking for a shard again.
+waitInterval = 1.0
+
+# A running shard gets a backup copy on an idle worker when it runs this many
+# times longer than the median shard.
+backupFactor = 2.0
+
+# Retries of a coordinator request that could not connect, with backoff.
+clientRetries = 5
+
+
+class shard:
+    """shard class. The queries start..start+len(queries) of one nameserver."""
+
+    __slots__ = ('shardId', 'server', 'start', 'queries', 'leases', 'result', 'deviceUuid')
+
+    def __init__(self, shardId, server, start, queries):
+        """Initialize the shard."""
+        self.shardId = shardId
+        self.server = server
+        self.start = start
+        self.queries = queries
+        # leaseId -> (deviceUuid, monotonic time of the lease)
+        self.leases = {}
+        self.result = None
+        self.deviceUuid = ''
+
+
+class shardCoordinator:
+    """
+    shardCoordinator class.
+    Splits the nameserver x query matrix into shards of up to shardSize queries
+    of one nameserver and hands them out to the workers, which are identified by
+    their deviceUuid. A lease that is not completed within leaseTimeout seconds
+    is given to the next worker that asks, and when there is nothing left to hand
+    out, an idle worker gets a backup copy of a shard that runs much longer than
+    the others. The first result of a shard is kept, later copies are ignored.
+    """
+
+    def workerEntry(self, worker):
+        """Return the entry of worker (its gatherData identity), added on first contact."""
+        deviceUuid = str(worker.get('deviceUuid', ''))
+        entry = self.workers.get(deviceUuid)
+        if entry is None:
+            entry = self.workers[deviceUuid] = {
+                "deviceUuid": deviceUuid,
+                "deviceTag": str(worker.get('deviceTag', '')),
+                "hostName": str(worker.get('hostName', '')),
+                "leases": 0,
+                "shards": 0,
+                "queries": 0
+            }
+        return entry
+
+    def expireLeases(self, now):
+        """Put the shards whose leases all expired back in front of the pending shards."""
+        for shardId in list(self.running):
+            runningShard = self.shards[shardId]
+            for leaseId, (_, leaseTime) in list(runningShard.leases.items()):
+                if now - leaseTime > self.leaseTimeout:
+                    del runningShard.leases[leaseId]
+            if not runningShard.leases:
+                del self.running[shardId]
+                self.pending.appendleft(runningShard)
+                self.reassignedShards += 1
+
+    def backupShard(self, now, deviceUuid):
+        """Return the running shard that most needs a backup copy on deviceUuid, or None."""
+        if not self.shardDurations:
+            return None
+        slowAfter = backupFactor * statistics.median(self.shardDurations)
+
+        slowest = None
+        for runningShard in self.running.values():
+            if len(runningShard.leases) > 1:
+                continue
+            owner, leaseTime = next(iter(runningShard.leases.values()))
+            if owner == deviceUuid or now - leaseTime <= slowAfter:
+                continue
+            if slowest is None or leaseTime < next(iter(slowest.leases.values()))[1]:
+                slowest = runningShard
+        return slowest
+
+    def lease(self, worker):
+        """Return the next shard for worker as a dict, {"wait": seconds} or {"done": true}."""
+        with self.lock:
+            entry = self.workerEntry(worker)
+            if self.finished.is_set():
+                entry["done"] = True
+                return {"done": True}
+
+            now = time.monotonic()
+            self.expireLeases(now)
+
+            if self.pending:
+                nextShard = self.pending.popleft()
+            else:
+                nextShard = self.backupShard(now, entry["deviceUuid"])
+                if nextShard is None:
+                    return {"wait": waitInterval}
+                self.backupShards += 1
+
+            leaseId = uuid.uuid4().hex
+            nextShard.leases[leaseId] = (entry["deviceUuid"], now)
+            self.running[nextShard.shardId] = nextShard
+            entry["leases"] += 1
+
+            return {
+                "shard": nextShard.shardId,
+                "lease": leaseId,
+                "nameservers": [nextShard.server],
+                "queries": nextShard.queries
+            }
+
+    def complete(self, myData):
+        """
+        Add the gatherData json of a completed shard (with its shard and lease).
+        Returns a dict with accepted, and the reason when it is not accepted.
+        """
+        with self.lock:
+            entry = self.workerEntry(myData)
+            shardId = myData.get('shard')
+            if not isinstance(shardId, int) or not 0 <= shardId < len(self.shards):
+                return {"accepted": False, "reason": "unknown shard"}
+
+            doneShard = self.shards[shardId]
+            if doneShard.result is not None:
+                self.duplicateResults += 1
+                return {"accepted": False, "reason": "duplicate"}
+
+            result = myData.get('queryResults', {}).get(doneShard.server)
+            if not isinstance(result, list) or len(result) != len(doneShard.queries):
+                return {"accepted": False, "reason": "incomplete"}
+
+            # An expired lease is still accepted, the work is done.
+            lease = doneShard.leases.get(myData.get('lease'))
+            if lease is not None:
+                self.shardDurations.append(time.monotonic() - lease[1])
+
+            doneShard.result = result
+            doneShard.deviceUuid = entry["deviceUuid"]
+            doneShard.leases.clear()
+            self.running.pop(shardId, None)
+            if doneShard in self.pending:
+                self.pending.remove(doneShard)
+
+            entry["shards"] += 1
+            entry["queries"] += len(result)
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.finished.set()
+            return {"accepted": True}
+
+    def status(self):
+        """Return the progress of the shards and the workers."""
+        with self.lock:
+            return {
+                "shards": len(self.shards),
+                "remaining": self.remaining,
+                "pending": len(self.pending),
+                "running": len(self.running),
+                "workers": len(self.workers)
+            }
+
+    def allWorkersDone(self):
+        """Return True when every worker has been told that the run is done."""
+        with self.lock:
+            return all(entry.get("done") for entry in self.workers.values())
+
+    def mergedResults(self):
+        """Return the queryResults of the completed shards in the nameserver and query order."""
+        results = {}
+        for doneShard in self.shards:
+            if doneShard.result is not None:
+                results.setdefault(doneShard.server, []).extend(doneShard.result)
+        return results
+
+    def shardResults(self):
+        """Return the shardResults section of the json data."""
+        with self.lock:
+            workers = []
+            for entry in self.workers.values():
+                workers.append({key: entry[key] for key in ("deviceUuid", "deviceTag", "hostName", "leases", "shards", "queries")})
+            # The worker that measured every shard, the results come from different hosts.
+            shards = []
+            for doneShard in self.shards:
+                shards.append({"nameserver": doneShard.server, "start": doneShard.start, "queries": len(doneShard.queries),
+                               "deviceUuid": doneShard.deviceUuid})
+            return {
+                "shardSize": self.shardSize,
+                "shards": len(self.shards),
+                "completedShards": len(self.shards) - self.remaining,
+                "reassignedShards": self.reassignedShards,
+                "backupShards": self.backupShards,
+                "duplicateResults": self.duplicateResults,
+                "workers": workers,
+                "shardWorkers": shards
+            }
+
+    def __init__(self, nameservers, queries, shardSize=100, leaseTimeout=60.0):
+        """Split the matrix into the shards."""
+        self.shardSize = shardSize
+        self.leaseTimeout = leaseTimeout
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+        self.shards = []
+        queries = list(queries)
+
+        for server in nameservers:
+            for start in range(0, len(queries), shardSize):
+                self.shards.append(shard(len(self.shards), server, start, queries[start:start + shardSize]))
+
+        self.pending = deque(self.shards)
+        self.running = {}
+        self.workers = {}
+        self.shardDurations = []
+        self.remaining = len(self.shards)
+        self.reassignedShards = 0
+        self.backupShards = 0
+        self.duplicateResults = 0
+
+        if not self.shards:
+            self.finished.set()
+
+
+class coordinatorHandler(BaseHTTPRequestHandler):
+    """coordinatorHandler class. Serves POST /lease, POST /result and GET /status."""
+
+    def sendJson(self, data, status=200):
+        """Send data as the json response."""
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Return the progress, or 404 for any other path."""
+        if self.path.split('?')[0] != '/status':
+            self.send_error(404)
+            return
+        self.sendJson(self.server.coordinator.status())
+
+    def do_POST(self):
+        """Lease a shard or add the result of a shard."""
+        path = self.path.split('?')[0]
+        if path not in ('/lease', '/result'):
+            self.send_error(404)
+            return
+
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except ValueError:
+            self.send_error(400)
+            return
+        if not isinstance(data, dict):
+            self.send_error(400)
+            return
+
+        if path == '/lease':
+            self.sendJson(self.server.coordinator.lease(data))
+        else:
+            self.sendJson(self.server.coordinator.complete(data))
+
+    def log_message(self, format, *args):
+        """Do not log every request to stderr."""
+
+
+class coordinatorServer:
+    """coordinatorServer class. The HTTP endpoint of a shardCoordinator, in a background thread."""
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def __init__(self, coordinator, address='127.0.0.1', port=8953):
+        """Listen on address and port (0 picks a free port)."""
+        self.httpServer = ThreadingHTTPServer((address, port), coordinatorHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.coordinator = coordinator
+        self.port = self.httpServer.server_address[1]
+        self.thread = None
+
+
+class coordinatorClient:
+    """
+    coordinatorClient class.
+    The worker side: leases shards from the coordinator at url and sends back
+    their results, over a keep-alive requests.Session.
+    """
+
+    def post(self, path, data):
+        """POST data as json and return the json response. Raises OSError when the coordinator can not be reached."""
+        body = json.dumps(data, default=queryRecord.toJson).encode('utf-8')
+        for attempt in range(clientRetries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 10))
+            try:
+                response = self.session.post(self.url + path, data=body, headers={'Content-Type': 'application/json'}, timeout=self.timeout)
+            except requests.exceptions.ConnectionError as err:
+                error = err
+                continue
+            except requests.exceptions.RequestException as err:
+                raise OSError(str(err))
+            if response.status_code != 200:
+                raise OSError('HTTP ' + str(response.status_code) + ' from ' + self.url + path)
+            return response.json()
+        raise OSError('Could not connect to the coordinator ' + self.url + ': ' + str(error))
+
+    def lease(self, identity):
+        """Lease the next shard for the worker identity (deviceUuid, deviceTag, hostName)."""
+        return self.post('/lease', identity)
+
+    def complete(self, myData):
+        """Send the gatherData json of a completed shard, with its shard and lease."""
+        return self.post('/result', myData)
+
+    def __init__(self, url, timeout=30):
+        """Initialize the client for the coordinator at url (http://host:port)."""
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
@@ -0,0 +1,319 @@
+import asyncio
+import select
+import socket
+import struct
+import time
+
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.reversename
+
+
+# Same defaults as dns.resolver.Resolver: 2 seconds per attempt, 5 seconds overall.
+defaultTimeout = 2.0
+defaultLifetime = 5.0
+
+
+class queryTimer:
+    """
+    queryTimer class.
+    Measures a single query with the monotonic time.perf_counter_ns clock.
+    The network time is from sending the query until the first byte of the
+    response arrives. Connection transports (--transport) also record the
+    time to set up the connection, which is kept out of the network time.
+    Everything else (building, parsing and interpreting the message) is
+    processing time.
+    """
+
+    __slots__ = ('startNs', 'endNs', 'networkNs', 'handshakeNs')
+
+    def start(self):
+        """Start the timer."""
+        self.startNs = time.perf_counter_ns()
+        self.endNs = self.startNs
+        self.networkNs = 0
+        self.handshakeNs = None
+
+    def stop(self):
+        """Stop the timer."""
+        self.endNs = time.perf_counter_ns()
+
+    def addNetworkTime(self, sendNs, firstByteNs):
+        """Add the time between sending a query and the first byte of its response."""
+        self.networkNs += firstByteNs - sendNs
+
+    def addHandshakeTime(self, handshakeNs):
+        """Add the time spent opening a connection (0 when an open connection was reused)."""
+        self.handshakeNs = (self.handshakeNs or 0) + handshakeNs
+
+    def totalMs(self):
+        """Return the total time in milliseconds."""
+        return (self.endNs - self.startNs) / 1000000
+
+    def networkMs(self):
+        """Return the network round trip time in milliseconds."""
+        return self.networkNs / 1000000
+
+    def handshakeMs(self):
+        """Return the connection setup time in milliseconds, None for UDP."""
+        if self.handshakeNs is None:
+            return None
+        return self.handshakeNs / 1000000
+
+    def processingMs(self):
+        """Return the time spent on the client side in milliseconds."""
+        return max(self.endNs - self.startNs - self.networkNs - (self.handshakeNs or 0), 0) / 1000000
+
+    def __init__(self):
+        """Initialize and start the timer."""
+        self.start()
+
+
+def parseNameserver(server, defaultPort=53):
+    """
+    Split a nameserver entry into (address, port).
+    Accepts 'address', 'ipv4:port' and '[ipv6]:port'. A plain IPv6 address uses defaultPort.
+    """
+    if server.startswith('['):
+        address, _, port = server[1:].partition(']')
+        return address, int(port[1:]) if port.startswith(':') else defaultPort
+
+    if server.count(':') == 1:
+        address, port = server.split(':')
+        return address, int(port)
+
+    return server, defaultPort
+
+
+def makeQuery(queryType, queryName):
+    """Create the dns.message for queryType and queryName. Returns (qname, rdtype, message)."""
+    if queryType == "ptr":
+        qname = dns.reversename.from_address(queryName)
+    else:
+        qname = dns.name.from_text(queryName)
+
+    rdtype = dns.rdatatype.from_text(queryType)
+    message = dns.message.make_query(qname, rdtype, dns.rdataclass.IN)
+
+    return qname, rdtype, message
+
+
+def makeAnswer(server, port, qname, rdtype, message, response):
+    """
+    Interpret the response the same way dns.resolver.Resolver does for a single nameserver.
+    Returns a dns.resolver.Answer or raises NXDOMAIN, NoAnswer or NoNameservers.
+    """
+    rcode = response.rcode()
+
+    if rcode == dns.rcode.NXDOMAIN:
+        raise dns.resolver.NXDOMAIN(qnames=[qname], responses={qname: response})
+
+    if rcode != dns.rcode.NOERROR:
+        raise dns.resolver.NoNameservers(request=message, errors=[(server, False, port, dns.rcode.to_text(rcode), response)])
+
+    answer = dns.resolver.Answer(qname, rdtype, dns.rdataclass.IN, response, server, port)
+
+    if answer.rrset is None:
+        raise dns.resolver.NoAnswer(response=response)
+
+    return answer
+
+
+def parseResponse(message, wire):
+    """Parse wire into a dns.message. Returns None if it is not the response to message."""
+    try:
+        response = dns.message.from_wire(wire)
+    except dns.exception.DNSException:
+        return None
+
+    if not message.is_response(response):
+        return None
+
+    return response
+
+
+def receiveExactly(sock, count, deadline):
+    """Read count bytes from the TCP socket sock. Returns the data and when the first byte arrived."""
+    data = b''
+    firstByteNs = 0
+    while len(data) < count:
+        remaining = (deadline - time.perf_counter_ns()) / 1000000000
+        if remaining <= 0:
+            raise dns.exception.Timeout
+        sock.settimeout(remaining)
+        try:
+            chunk = sock.recv(count - len(data))
+        except socket.timeout:
+            raise dns.exception.Timeout
+        if not chunk:
+            raise EOFError
+        if not firstByteNs:
+            firstByteNs = time.perf_counter_ns()
+        data += chunk
+    return data, firstByteNs
+
+
+def queryTcp(server, port, message, wire, timer, deadline):
+    """Perform the query over TCP. Used when the UDP response is truncated."""
+    af = dns.inet.af_for_address(server)
+    with socket.socket(af, socket.SOCK_STREAM) as sock:
+        sock.settimeout(max((deadline - time.perf_counter_ns()) / 1000000000, 0.001))
+        sendNs = time.perf_counter_ns()
+        try:
+            sock.connect((server, port))
+            sock.sendall(struct.pack('!H', len(wire)) + wire)
+        except socket.timeout:
+            raise dns.exception.Timeout
+        except OSError as err:
+            raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, err, None)])
+
+        try:
+            lengthBytes, firstByteNs = receiveExactly(sock, 2, deadline)
+            timer.addNetworkTime(sendNs, firstByteNs)
+            responseWire = receiveExactly(sock, struct.unpack('!H', lengthBytes)[0], deadline)[0]
+        except (EOFError, ConnectionError) as err:
+            raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, err, None)])
+
+    response = parseResponse(message, responseWire)
+    if response is None:
+        raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, 'bad response', None)])
+    return response
+
+
+def resolve(server, queryType, queryName, timer, port=53, timeout=defaultTimeout, lifetime=defaultLifetime):
+    """
+    Resolve queryName against the single nameserver server and record the
+    network time in timer.
+    UDP attempts are retried every timeout seconds until lifetime has passed.
+    """
+    server, port = parseNameserver(server, port)
+    qname, rdtype, message = makeQuery(queryType, queryName)
+    wire = message.to_wire()
+    deadline = timer.startNs + int(lifetime * 1000000000)
+    af = dns.inet.af_for_address(server)
+
+    with socket.socket(af, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        response = None
+
+        while response is None:
+            now = time.perf_counter_ns()
+            if now >= deadline:
+                raise dns.exception.Timeout
+
+            sendNs = now
+            try:
+                sock.sendto(wire, (server, port))
+            except OSError as err:
+                # No route, or not allowed to send there: retrying will not help.
+                raise dns.resolver.NoNameservers(request=message, errors=[(server, False, port, err, None)])
+            attemptDeadline = min(sendNs + int(timeout * 1000000000), deadline)
+
+            # Wait for the response, ignoring anything that does not belong to our query.
+            while response is None:
+                remaining = (attemptDeadline - time.perf_counter_ns()) / 1000000000
+                if remaining <= 0:
+                    timer.addNetworkTime(sendNs, time.perf_counter_ns())
+                    break
+                if not select.select([sock], [], [], remaining)[0]:
+                    continue
+                try:
+                    responseWire = sock.recv(65535)
+                except OSError:
+                    # ICMP port unreachable and similar errors.
+                    continue
+                firstByteNs = time.perf_counter_ns()
+                response = parseResponse(message, responseWire)
+                if response is not None:
+                    timer.addNetworkTime(sendNs, firstByteNs)
+
+    if response.flags & dns.flags.TC:
+        response = queryTcp(server, port, message, wire, timer, deadline)
+
+    return makeAnswer(server, port, qname, rdtype, message, response)
+
+
+async def queryTcpAsync(server, port, message, wire, timer, deadline):
+    """Perform the query over TCP with asyncio. Used when the UDP response is truncated."""
+    remaining = max((deadline - time.perf_counter_ns()) / 1000000000, 0.001)
+    sendNs = time.perf_counter_ns()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(server, port), remaining)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout
+    except OSError as err:
+        raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, err, None)])
+
+    try:
+        writer.write(struct.pack('!H', len(wire)) + wire)
+        remaining = max((deadline - time.perf_counter_ns()) / 1000000000, 0.001)
+        lengthBytes = await asyncio.wait_for(reader.readexactly(2), remaining)
+        timer.addNetworkTime(sendNs, time.perf_counter_ns())
+        remaining = max((deadline - time.perf_counter_ns()) / 1000000000, 0.001)
+        responseWire = await asyncio.wait_for(reader.readexactly(struct.unpack('!H', lengthBytes)[0]), remaining)
+    except asyncio.TimeoutError:
+        raise dns.exception.Timeout
+    except (asyncio.IncompleteReadError, ConnectionError) as err:
+        raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, err, None)])
+    finally:
+        writer.close()
+
+    response = parseResponse(message, responseWire)
+    if response is None:
+        raise dns.resolver.NoNameservers(request=message, errors=[(server, True, port, 'bad response', None)])
+    return response
+
+
+async def resolveAsync(server, queryType, queryName, timer, port=53, timeout=defaultTimeout, lifetime=defaultLifetime):
+    """The asyncio version of resolve."""
+    server, port = parseNameserver(server, port)
+    loop = asyncio.get_running_loop()
+    qname, rdtype, message = makeQuery(queryType, queryName)
+    wire = message.to_wire()
+    deadline = timer.startNs + int(lifetime * 1000000000)
+    af = dns.inet.af_for_address(server)
+
+    with socket.socket(af, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        response = None
+
+        while response is None:
+            now = time.perf_counter_ns()
+            if now >= deadline:
+                raise dns.exception.Timeout
+
+            sendNs = now
+            try:
+                await loop.sock_sendto(sock, wire, (server, port))
+            except OSError as err:
+                raise dns.resolver.NoNameservers(request=message, errors=[(server, False, port, err, None)])
+            attemptDeadline = min(sendNs + int(timeout * 1000000000), deadline)
+
+            while response is None:
+                remaining = (attemptDeadline - time.perf_counter_ns()) / 1000000000
+                if remaining <= 0:
+                    timer.addNetworkTime(sendNs, time.perf_counter_ns())
+                    break
+                try:
+                    responseWire = await asyncio.wait_for(loop.sock_recv(sock, 65535), remaining)
+                except asyncio.TimeoutError:
+                    continue
+                except OSError:
+                    continue
+                # The first byte time includes any event loop scheduling delay.
+                firstByteNs = time.perf_counter_ns()
+                response = parseResponse(message, responseWire)
+                if response is not None:
+                    timer.addNetworkTime(sendNs, firstByteNs)
+
+    if response.flags & dns.flags.TC:
+        response = await queryTcpAsync(server, port, message, wire, timer, deadline)
+
+    return makeAnswer(server, port, qname, rdtype, message, response)
@@ -0,0 +1,169 @@
+import random
+import time
+
+import dns.exception
+import dns.resolver
+
+from queryEngine import responseParser, timedQuery
+
+
+class transportEngine:
+    """
+    transportEngine class.
+    Performs the queries over the persistent tcp, dot or doh connections of a
+    connectionPool, one nameserver after the other. With a pipeline depth
+    above 1 (tcp and dot) several queries are sent on the connection before
+    the responses are read, and responses are matched by message ID.
+    """
+
+    def finishQuery(self, server, index, answer, timer, error=None):
+        """Create the json dict for a completed query and hand it on."""
+        query = self.queries[index]
+        if error is not None:
+            print(responseParser.queryErrorText(error) + str(query) + ' @' + server)
+        if error is None or isinstance(error, (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer)):
+            # Only queries that got a response count for the connection statistics.
+            self.pool.recordQuery(server, timer)
+
+        queryResult = responseParser.buildResult(query, answer, timer, error)
+        if self.resultCallback is not None:
+            self.resultCallback(server, queryResult)
+        if self.keepResults:
+            self.results[server][index] = queryResult
+
+        self.counter += 1
+        if self.verbose:
+            print('Query = ' + str(query) + ' @' + server)
+            print('Query count = ' + str(self.counter) + ' of ' + str(self.totalQueries))
+
+    def queryServer(self, server):
+        """Perform the queries one at a time over the connection to server."""
+        for index, query in enumerate(self.queries):
+            queryType, queryName = responseParser.getQueryParts(query)
+            timer = timedQuery.queryTimer()
+            error = None
+
+            try:
+                answer = self.pool.resolve(server, queryType, queryName, timer)
+            except responseParser.queryErrors as err:
+                answer = []
+                error = err
+
+            timer.stop()
+            self.finishQuery(server, index, answer, timer, error)
+
+    def connectionError(self, server, message, err):
+        """Return the query error for a query whose connection failed with err."""
+        if isinstance(err, dns.exception.Timeout):
+            return err
+        return dns.resolver.NoNameservers(request=message, errors=[(server, True, self.pool.connection(server).port, err, None)])
+
+    def failInFlight(self, server, inFlight, err):
+        """Fail all the queries that are waiting for a response on a connection that is gone."""
+        for index, message, timer, sendNs in inFlight.values():
+            timer.stop()
+            self.finishQuery(server, index, [], timer, self.connectionError(server, message, err))
+        inFlight.clear()
+
+    def pipelineServer(self, server):
+        """Keep up to pipeline queries in flight on the connection to server."""
+        connection = self.pool.connection(server)
+        timeoutNs = int(timedQuery.defaultTimeout * 1000000000)
+        pending = iter(range(len(self.queries)))
+        inFlight = {}
+        exhausted = False
+
+        while not exhausted or inFlight:
+            # Fill the pipeline.
+            while not exhausted and len(inFlight) < self.pipeline:
+                index = next(pending, None)
+                if index is None:
+                    exhausted = True
+                    break
+
+                queryType, queryName = responseParser.getQueryParts(self.queries[index])
+                timer = timedQuery.queryTimer()
+                try:
+                    qname, rdtype, message = timedQuery.makeQuery(queryType, queryName)
+                    while message.id in inFlight:
+                        message.id = random.getrandbits(16)
+                    timer.addHandshakeTime(connection.open(timer.startNs + timeoutNs))
+                    sendNs = time.perf_counter_ns()
+                    connection.send(message.to_wire())
+                except responseParser.queryErrors as err:
+                    timer.stop()
+                    self.finishQuery(server, index, [], timer, err)
+                    continue
+                except (OSError, EOFError) as err:
+                    connection.close()
+                    timer.stop()
+                    self.finishQuery(server, index, [], timer, self.connectionError(server, message, err))
+                    self.failInFlight(server, inFlight, err)
+                    continue
+
+                inFlight[message.id] = (index, message, timer, sendNs)
+
+            if not inFlight:
+                continue
+
+            # Read the next response. The oldest query in flight sets the deadline.
+            deadline = min(sendNs for _, _, _, sendNs in inFlight.values()) + timeoutNs
+            try:
+                responseWire, firstByteNs = connection.receive(deadline)
+            except (dns.exception.Timeout, OSError, EOFError, ValueError) as err:
+                # Late responses would be mixed up with the next queries, start over on a new connection.
+                connection.close()
+                self.failInFlight(server, inFlight, err)
+                continue
+
+            if len(responseWire) < 12:
+                continue
+            entry = inFlight.pop((responseWire[0] << 8) | responseWire[1], None)
+            if entry is None:
+                continue
+
+            index, message, timer, sendNs = entry
+            timer.addNetworkTime(sendNs, firstByteNs)
+            response = timedQuery.parseResponse(message, responseWire)
+            try:
+                if response is None:
+                    raise dns.resolver.NoNameservers(request=message, errors=[(server, True, connection.port, 'bad response', None)])
+                question = message.question[0]
+                answer = timedQuery.makeAnswer(connection.address, connection.port, question.name, question.rdtype, message, response)
+            except responseParser.queryErrors as err:
+                timer.stop()
+                self.finishQuery(server, index, [], timer, err)
+            else:
+                timer.stop()
+                self.finishQuery(server, index, answer, timer)
+
+    def performQueries(self):
+        """Perform all the queries against each nameserver and return the results."""
+        for server in self.nameservers:
+            if self.keepResults:
+                self.results[server] = [None] * len(self.queries)
+
+            if self.pipeline > 1 and self.pool.transport in ('tcp', 'dot'):
+                self.pipelineServer(server)
+            else:
+                self.queryServer(server)
+
+        return self.results
+
+    def __init__(self, nameservers, queries, pool, pipeline=1, verbose=False, resultCallback=None, keepResults=True):
+        """
+        Initialize the class variables. pool is the connectionPool, so the
+        connections stay open between runs (for example with --iterations).
+        resultCallback(server, queryResult) is called as soon as each query completes.
+        When keepResults is False the results are only passed to resultCallback.
+        """
+        self.nameservers = nameservers
+        self.queries = queries
+        self.pool = pool
+        self.pipeline = max(pipeline, 1)
+        self.verbose = verbose
+        self.resultCallback = resultCallback
+        self.keepResults = keepResults
+        self.results = {}
+        self.counter = 0
+        self.totalQueries = len(nameservers) * len(queries)
@@ -0,0 +1,164 @@
+import random
+import time
+
+from queryEngine import responseParser
+from queryStats import latencyHistogram
+
+
+# Cache classification of the answers to the real names.
+cacheHit = 'hit'
+cacheMiss = 'miss'
+cacheUnknown = 'unknown'
+
+# Allowed difference in seconds between the TTL decrement and the time that has
+# passed, TTLs only have a resolution of one second.
+ttlTolerance = 1.5
+
+
+def makeBustQuery(query):
+    """
+    Return the cache-busting query for query: the same record type for a random
+    label in front of the name, which no resolver can have cached.
+    PTR queries are not busted (the name is an address), None is returned.
+    """
+    queryType, queryName = responseParser.getQueryParts(query)
+    if queryType == 'ptr':
+        return None
+    return {queryType: 'cb-' + '%012x' % random.getrandbits(48) + '.' + queryName}
+
+
+def pairedQueryCount(queries):
+    """Return the number of queries per nameserver in one repeat of the paired query list."""
+    return sum(2 if responseParser.getQueryParts(query)[0] != 'ptr' else 1 for query in queries)
+
+
+def classifyObservations(observations):
+    """
+    Classify the answers to one name from one nameserver, in the order they were received.
+    observations is a list of (seconds, ttl). An answer with a TTL below the highest TTL
+    that was seen came from the cache. An answer at the highest TTL is a miss (a fresh
+    copy), unless its TTL counted down from the previous answer by the time that has
+    passed, which means it is the same cached copy.
+    """
+    ttls = [ttl for _, ttl in observations if ttl >= 0]
+    maxTtl = max(ttls) if ttls else -1
+    classifications = []
+    previous = None
+
+    for seconds, ttl in observations:
+        if ttl < 0:
+            classifications.append(cacheUnknown)
+            continue
+
+        if previous is not None and ttl <= previous[1] and abs((previous[1] - ttl) - (seconds - previous[0])) <= ttlTolerance:
+            classifications.append(cacheHit)
+        elif ttl < maxTtl:
+            classifications.append(cacheHit)
+        else:
+            classifications.append(cacheMiss)
+        previous = (seconds, ttl)
+
+    return classifications
+
+
+class cacheAnalyzer:
+    """
+    cacheAnalyzer class.
+    Builds the paired query list (a cache-busting name followed by the real name)
+    for every repeat, collects the answers, classifies the answers to the real
+    names as cache hits or misses from their TTLs and reports the cached and
+    uncached latency as separate distributions per nameserver.
+    """
+
+    def pairedQueries(self):
+        """Return the query list for one repeat, with new cache-busting names."""
+        paired = []
+        self.bustQueries.clear()
+        for query in self.queries:
+            bustQuery = makeBustQuery(query)
+            if bustQuery is not None:
+                self.bustQueries.add(responseParser.getQueryParts(bustQuery))
+                paired.append(bustQuery)
+            paired.append(query)
+        return paired
+
+    def addResult(self, server, queryResult):
+        """Add the result of a query from the paired query list."""
+        key = responseParser.getQueryParts(queryResult['query'])
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+        lost = status in responseParser.lossStatuses
+
+        if key in self.bustQueries:
+            self.bustCounts[server] = self.bustCounts.get(server, 0) + 1
+            if not lost:
+                # A forced recursion. NXDOMAIN is the usual answer for the made up name.
+                histogram = self.bustLatency.get(server)
+                if histogram is None:
+                    histogram = self.bustLatency[server] = latencyHistogram.latencyHistogram()
+                histogram.add(float(queryResult['responseTime']))
+            return
+
+        index = self.realQueries.get(key)
+        if index is None:
+            return
+
+        if lost:
+            ttl = -1
+        else:
+            ttl = queryResult.get('responseTTL', -1)
+        observations = self.observations.setdefault((server, index), [])
+        observations.append((time.monotonic() - self.startTime, ttl, float(queryResult['responseTime'])))
+
+    def cacheResults(self):
+        """Return the cacheResults section of the json data."""
+        servers = {}
+        cached = {}
+        uncached = {}
+        for server, histogram in self.bustLatency.items():
+            uncached[server] = latencyHistogram.latencyHistogram()
+            uncached[server].merge(histogram)
+
+        for (server, index), observations in sorted(self.observations.items(), key=lambda item: item[0][1]):
+            classifications = classifyObservations([(seconds, ttl) for seconds, ttl, _ in observations])
+            entry = servers.setdefault(server, {"hits": 0, "misses": 0, "unknown": 0, "queries": []})
+
+            for (_, ttl, responseTime), classification in zip(observations, classifications):
+                if classification == cacheHit:
+                    entry["hits"] += 1
+                    cached.setdefault(server, latencyHistogram.latencyHistogram()).add(responseTime)
+                elif classification == cacheMiss:
+                    entry["misses"] += 1
+                    uncached.setdefault(server, latencyHistogram.latencyHistogram()).add(responseTime)
+                else:
+                    entry["unknown"] += 1
+
+            entry["queries"].append({
+                "query": self.queries[index],
+                "ttls": [ttl for _, ttl, _ in observations],
+                "cache": classifications
+            })
+
+        for server, entry in servers.items():
+            entry["cacheBustingQueries"] = self.bustCounts.get(server, 0)
+            entry["cached"] = cached.get(server, latencyHistogram.latencyHistogram()).summary()
+            entry["uncached"] = uncached.get(server, latencyHistogram.latencyHistogram()).summary()
+
+        return {
+            "repeats": self.repeats,
+            "nameservers": servers
+        }
+
+    def __init__(self, queries, repeats):
+        """Initialize with the queries from the queries file and the number of repeats."""
+        self.queries = queries
+        self.repeats = repeats
+        self.startTime = time.monotonic()
+        # (queryType, queryName) of the cache-busting queries of the current repeat,
+        # and of the real queries with their position in queries.
+        self.bustQueries = set()
+        self.realQueries = {}
+        for index, query in enumerate(queries):
+            self.realQueries.setdefault(responseParser.getQueryParts(query), index)
+        self.observations = {}
+        self.bustCounts = {}
+        self.bustLatency = {}
@@ -0,0 +1,106 @@
+import math
+
+
+class latencyHistogram:
+    """
+    latencyHistogram class.
+    Streaming latency distribution with logarithmic buckets. Every bucket is
+    (1 + precision) times wider than the one before it, so any quantile is
+    within precision (relative) of the real value while the memory used only
+    depends on the range of the samples, not on the number of samples.
+    Latencies are in milliseconds.
+    """
+
+    # Everything below minValue ends up in the first bucket.
+    minValue = 0.001
+
+    def bucketIndex(self, value):
+        """Return the bucket number for value."""
+        if value <= self.minValue:
+            return 0
+        return int(math.log(value / self.minValue) / self.logBase) + 1
+
+    def bucketValue(self, index):
+        """Return the representative (geometric middle) value of bucket index."""
+        if index == 0:
+            return self.minValue
+        lower = self.minValue * math.exp((index - 1) * self.logBase)
+        return lower * math.sqrt(1 + self.precision)
+
+    def add(self, value, count=1):
+        """Add a latency sample."""
+        index = self.bucketIndex(value)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.total += value * count
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add all the samples of the latencyHistogram other to this one."""
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge histograms with a different precision.')
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        """Return the mean latency."""
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def quantile(self, q):
+        """Return the latency at quantile q (0.0 - 1.0)."""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # The extremes are known exactly.
+                return min(max(self.bucketValue(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        """Return the statistics that are used in the json results."""
+        if not self.count:
+            return {"samples": 0, "min": 0.0, "mean": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+
+        return {
+            "samples": self.count,
+            "min": round(self.min, 3),
+            "mean": round(self.mean(), 3),
+            "p50": round(self.quantile(0.50), 3),
+            "p90": round(self.quantile(0.90), 3),
+            "p99": round(self.quantile(0.99), 3),
+            "max": round(self.max, 3)
+        }
+
+    @classmethod
+    def fromDict(cls, data):
+        """Create a latencyHistogram from a dict with the precision, count, total, min, max and the counts of the buckets by index."""
+        histogram = cls(data['precision'])
+        histogram.buckets = {int(index): count for index, count in data['buckets'].items()}
+        histogram.count = data['count']
+        histogram.total = data['total']
+        if histogram.count:
+            histogram.min = data['min']
+            histogram.max = data['max']
+        return histogram
+
+    def __init__(self, precision=0.02):
+        """Initialize an empty histogram. precision is the relative bucket width."""
+        self.precision = precision
+        self.logBase = math.log(1 + precision)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
@@ -0,0 +1,159 @@
+import shutil
+import statistics
+import sys
+import textwrap
+import time
+from collections import deque
+
+from queryEngine import responseParser
+
+
+# Column widths of the results table, the DNS Response column width is set by --responseWidth.
+columnHeaders = ['DNS Server', 'DNS Type', 'DNS Query', 'DNS Response', 'Response Time (ms)', 'Network (ms)', 'Processing (ms)', 'DNS TTL']
+columnWidths = [18, 15, 30, 0, 20, 14, 17, 8]
+responseColumn = 3
+
+# Number of recent response times per nameserver for the rolling latency.
+rollingSize = 50
+
+# Seconds over which the query rate is measured.
+rateWindow = 5.0
+
+
+def formatColumns(values, responseWidth):
+    """Return the table line for the column values."""
+    filler = ' '
+    line = ''
+    for column, (value, width) in enumerate(zip(values, columnWidths)):
+        if column == responseColumn:
+            width = responseWidth + 2
+        line += f'{str(value):{filler}<{width}}'
+    return line.rstrip()
+
+
+def headerLine(responseWidth):
+    """Return the header line of the results table."""
+    return formatColumns(columnHeaders, responseWidth)
+
+
+def formatResult(server, queryResult, responseWidth, wrap=False):
+    """
+    Return the table lines for a query result. A response that is longer than
+    responseWidth is cut off with ..., or wrapped on the next lines with wrap.
+    """
+    queryType, queryName = list(queryResult['query'].items())[0]
+    responseText = ','.join(queryResult['response'])
+
+    if wrap:
+        # Break the lines after the commas between the responses where possible.
+        responseLines = textwrap.wrap(', '.join(queryResult['response']), responseWidth, break_on_hyphens=False) or ['']
+    elif len(responseText) > responseWidth:
+        responseLines = [responseText[:max(responseWidth - 3, 0)] + '...']
+    else:
+        responseLines = [responseText]
+
+    lines = [formatColumns([server, queryType, queryName, responseLines[0], f"{float(queryResult['responseTime']):.1f}",
+                            f"{float(queryResult['networkTime']):.3f}", f"{float(queryResult['processingTime']):.3f}",
+                            queryResult['responseTTL']], responseWidth)]
+    for responseLine in responseLines[1:]:
+        lines.append(formatColumns(['', '', '', responseLine], responseWidth))
+    return lines
+
+
+class liveDisplay:
+    """
+    liveDisplay class.
+    Prints the row of every query result as it completes, with a progress line:
+    queries done, the query rate over the last seconds, the ETA and the rolling
+    median latency per nameserver. On a terminal the progress line stays at the
+    bottom and is redrawn, otherwise it is printed every progressInterval seconds.
+    """
+
+    def progressLine(self, now):
+        """Return the progress line."""
+        while self.completionTimes and now - self.completionTimes[0] > rateWindow:
+            self.completionTimes.popleft()
+        window = min(now - self.startTime, rateWindow)
+        rate = len(self.completionTimes) / window if window > 0 else 0.0
+
+        totalQueries = self.totalQueries() if callable(self.totalQueries) else self.totalQueries
+        done = str(self.completed)
+        eta = '-'
+        if totalQueries:
+            done += '/' + str(totalQueries) + ' (' + str(round(self.completed * 100 / totalQueries)) + '%)'
+            if rate > 0:
+                eta = time.strftime('%H:%M:%S', time.gmtime(max(totalQueries - self.completed, 0) / rate))
+
+        line = 'Queries ' + done + '  ' + str(round(rate, 1)) + ' q/s  ETA ' + eta + '  lost ' + str(self.lost)
+        for server, responseTimes in self.latency.items():
+            if responseTimes:
+                line += '  ' + server + ' ' + str(round(statistics.median(responseTimes), 1)) + ' ms'
+        return line
+
+    def showProgress(self, now):
+        """Print or redraw the progress line."""
+        line = self.progressLine(now)
+        if self.isTerminal:
+            width = shutil.get_terminal_size().columns - 1
+            self.outputFile.write('\r\x1b[K' + line[:width])
+            self.outputFile.flush()
+        else:
+            print(line, file=self.outputFile)
+        self.lastProgress = now
+
+    def addResult(self, server, queryResult):
+        """Print the row of a completed query and update the progress."""
+        now = time.monotonic()
+        self.completed += 1
+        self.completionTimes.append(now)
+
+        if queryResult.get('responseStatus', responseParser.statusOk) in responseParser.lossStatuses:
+            self.lost += 1
+        else:
+            responseTimes = self.latency.get(server)
+            if responseTimes is None:
+                responseTimes = self.latency[server] = deque(maxlen=rollingSize)
+            responseTimes.append(float(queryResult['responseTime']))
+
+        if self.showRows:
+            lines = formatResult(server, queryResult, self.responseWidth, self.wrap)
+            if self.isTerminal:
+                # Clear the progress line, it is redrawn under the row.
+                self.outputFile.write('\r\x1b[K')
+            print('\n'.join(lines), file=self.outputFile)
+            if self.isTerminal:
+                self.showProgress(now)
+                return
+
+        if now - self.lastProgress >= self.progressInterval:
+            self.showProgress(now)
+
+    def close(self):
+        """Print the final progress line."""
+        if self.completed:
+            self.showProgress(time.monotonic())
+            if self.isTerminal:
+                print(file=self.outputFile)
+
+    def __init__(self, totalQueries=0, responseWidth=40, wrap=False, showRows=True, outputFile=sys.stdout):
+        """
+        Initialize the display. totalQueries is used for the ETA, 0 when it is not
+        known, or a function that returns it (0 while it is not known yet).
+        Without showRows only the progress line is shown.
+        """
+        self.totalQueries = totalQueries
+        self.responseWidth = responseWidth
+        self.wrap = wrap
+        self.showRows = showRows
+        self.outputFile = outputFile
+        self.isTerminal = outputFile.isatty()
+        self.progressInterval = 0.25 if self.isTerminal else 5.0
+        self.startTime = time.monotonic()
+        self.lastProgress = self.startTime
+        self.completed = 0
+        self.lost = 0
+        self.completionTimes = deque()
+        self.latency = {}
+
+        if showRows:
+            print(headerLine(responseWidth), file=outputFile)
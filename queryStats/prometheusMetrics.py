@@ -0,0 +1,160 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from queryEngine import responseParser
+
+
+# Upper bounds of the latency histogram buckets in seconds (Prometheus convention).
+latencyBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def labelValue(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class queryHistogram:
+    """queryHistogram class. A cumulative Prometheus histogram of the query latency of one nameserver and record type."""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def add(self, seconds):
+        """Add a query latency in seconds."""
+        for index, bound in enumerate(latencyBuckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+    def __init__(self):
+        """Initialize the buckets."""
+        self.counts = [0] * len(latencyBuckets)
+        self.total = 0.0
+        self.count = 0
+
+
+class prometheusMetrics:
+    """
+    prometheusMetrics class.
+    Live metrics of a long-running (--daemon) process: a latency histogram and
+    response status counters per nameserver and record type, and the run
+    counters of the scheduler. render() returns the Prometheus text format.
+    The metrics are updated by the query thread and read by the HTTP server thread.
+    """
+
+    def addResult(self, server, queryResult):
+        """Add a completed query result for server."""
+        queryType = responseParser.getQueryParts(queryResult['query'])[0]
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+
+        with self.lock:
+            statusKey = (server, queryType, status)
+            self.statusCounts[statusKey] = self.statusCounts.get(statusKey, 0) + 1
+
+            if status in responseParser.lossStatuses:
+                return
+
+            histogram = self.histograms.get((server, queryType))
+            if histogram is None:
+                histogram = self.histograms[(server, queryType)] = queryHistogram()
+            histogram.add(float(queryResult['responseTime']) / 1000)
+
+    def runCompleted(self, durationSeconds, finishedAt, missedRuns=0):
+        """Record a completed run of the query matrix and any scheduled runs that were skipped because it overran."""
+        with self.lock:
+            self.runs += 1
+            self.missedRuns += missedRuns
+            self.lastRunDuration = durationSeconds
+            self.lastRunTime = finishedAt
+
+    def render(self):
+        """Return all the metrics in the Prometheus text exposition format."""
+        lines = []
+
+        with self.lock:
+            lines.append('# HELP dns_query_duration_seconds Response time of the DNS queries.')
+            lines.append('# TYPE dns_query_duration_seconds histogram')
+            for (server, queryType), histogram in self.histograms.items():
+                labels = 'nameserver="' + labelValue(server) + '",type="' + labelValue(queryType) + '"'
+                cumulative = 0
+                for bound, count in zip(latencyBuckets, histogram.counts):
+                    cumulative += count
+                    lines.append('dns_query_duration_seconds_bucket{' + labels + ',le="' + repr(bound) + '"} ' + str(cumulative))
+                lines.append('dns_query_duration_seconds_bucket{' + labels + ',le="+Inf"} ' + str(histogram.count))
+                lines.append('dns_query_duration_seconds_sum{' + labels + '} ' + repr(histogram.total))
+                lines.append('dns_query_duration_seconds_count{' + labels + '} ' + str(histogram.count))
+
+            lines.append('# HELP dns_queries_total DNS queries by response status.')
+            lines.append('# TYPE dns_queries_total counter')
+            for (server, queryType, status), count in self.statusCounts.items():
+                lines.append('dns_queries_total{nameserver="' + labelValue(server) + '",type="' + labelValue(queryType) +
+                             '",status="' + labelValue(status) + '"} ' + str(count))
+
+            lines.append('# HELP dns_runs_total Completed runs of the query matrix.')
+            lines.append('# TYPE dns_runs_total counter')
+            lines.append('dns_runs_total ' + str(self.runs))
+            lines.append('# HELP dns_missed_runs_total Scheduled runs that were skipped because the previous run took longer than the interval.')
+            lines.append('# TYPE dns_missed_runs_total counter')
+            lines.append('dns_missed_runs_total ' + str(self.missedRuns))
+            lines.append('# HELP dns_last_run_duration_seconds Duration of the last run of the query matrix.')
+            lines.append('# TYPE dns_last_run_duration_seconds gauge')
+            lines.append('dns_last_run_duration_seconds ' + repr(self.lastRunDuration))
+            lines.append('# HELP dns_last_run_timestamp_seconds Unix time when the last run finished.')
+            lines.append('# TYPE dns_last_run_timestamp_seconds gauge')
+            lines.append('dns_last_run_timestamp_seconds ' + repr(self.lastRunTime))
+
+        return '\n'.join(lines) + '\n'
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.statusCounts = {}
+        self.runs = 0
+        self.missedRuns = 0
+        self.lastRunDuration = 0.0
+        self.lastRunTime = 0.0
+
+
+class metricsHandler(BaseHTTPRequestHandler):
+    """metricsHandler class. Serves GET /metrics."""
+
+    def do_GET(self):
+        """Return the metrics, or 404 for any other path."""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Do not log every scrape to stderr."""
+
+
+class metricsServer:
+    """metricsServer class. The /metrics HTTP endpoint, in a background thread."""
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def __init__(self, metrics, address='127.0.0.1', port=9153):
+        """Listen on address and port (0 picks a free port)."""
+        self.httpServer = ThreadingHTTPServer((address, port), metricsHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.metrics = metrics
+        self.port = self.httpServer.server_address[1]
+        self.thread = None
@@ -0,0 +1,246 @@
+import math
+import random
+import statistics
+from collections import Counter
+
+from queryEngine import responseParser, timedQuery
+from queryStats import latencyHistogram
+
+
+# Rounds that are always run before the ranking can be stable.
+minRounds = 4
+
+# The score is in milliseconds: the median response time, plus jitterWeight x the
+# jitter, plus failurePenalty for every failed query (a client waits out a
+# timeout before it asks the next resolver) and inconsistencyPenalty for every
+# answer no other nameserver agrees with.
+jitterWeight = 0.5
+failurePenalty = timedQuery.defaultTimeout * 1000
+inconsistencyPenalty = 1000.0
+
+# Nameservers that fail more queries, or agree with the others on fewer, are not recommended.
+maxFailureRate = 0.1
+minConsistency = 0.9
+
+# resolv.conf only uses the first 3 nameservers.
+maxRecommended = 3
+
+# Statuses of a query the nameserver answered. Every other status counts as a failed query:
+# no response, a local or connection error, or an error rcode such as SERVFAIL.
+answeredStatuses = (responseParser.statusOk, responseParser.statusNxdomain, responseParser.statusNoAnswer, responseParser.statusBadType)
+
+
+def tQuantile(degrees):
+    """Return the 0.975 quantile of Student's t distribution (Cornish-Fisher expansion, within 0.1 from 3 degrees of freedom)."""
+    z = 1.959964
+    return (z + (z ** 3 + z) / (4 * degrees) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * degrees ** 2) +
+            (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * degrees ** 3))
+
+
+def score(p50, jitter, failureRate, inconsistentRate):
+    """Return the score in milliseconds, lower is better."""
+    return p50 + jitterWeight * jitter + failureRate * failurePenalty + inconsistentRate * inconsistencyPenalty
+
+
+class sampleCounts:
+    """sampleCounts class. The samples of one nameserver, for a round or for the whole ranking."""
+
+    __slots__ = ('samples', 'failures', 'checks', 'agreements', 'jitterTotal', 'jitterCount', 'lastTime')
+
+    def addTime(self, responseTime):
+        """Add the jitter between responseTime and the previous response time."""
+        if self.lastTime is not None:
+            self.jitterTotal += abs(responseTime - self.lastTime)
+            self.jitterCount += 1
+        self.lastTime = responseTime
+
+    def jitter(self):
+        """Return the mean difference between consecutive response times (as in RFC 3550)."""
+        return self.jitterTotal / self.jitterCount if self.jitterCount else 0.0
+
+    def failureRate(self):
+        """Return the share of failed queries."""
+        return self.failures / self.samples if self.samples else 0.0
+
+    def consistency(self):
+        """Return the share of the answers another nameserver agreed with."""
+        return self.agreements / self.checks if self.checks else 1.0
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.samples = 0
+        self.failures = 0
+        self.checks = 0
+        self.agreements = 0
+        self.jitterTotal = 0.0
+        self.jitterCount = 0
+        self.lastTime = None
+
+
+class resolverRanking:
+    """
+    resolverRanking class.
+    Ranks the nameservers over rounds of queries. Every round sends the same
+    random sample of the query list to every nameserver, and each nameserver
+    gets a score per round from its median response time, jitter, failed
+    queries and the answers no other nameserver agreed with. The ranking is
+    stable when the rounds show, for every pair of neighbours in the ranking,
+    that one is better (the 95% confidence interval of the paired difference
+    of their round scores is above 0) or that they are equivalent (the
+    interval is within tolerance milliseconds).
+    """
+
+    def sampleQueries(self, queries, sampleSize):
+        """Return the queries of the next round, a random sample of sampleSize queries."""
+        count = len(queries)
+        return [queries[index] for index in random.sample(range(count), min(sampleSize, count))]
+
+    def addResult(self, server, queryResult):
+        """Add a single query result for server."""
+        queryType, queryName = responseParser.getQueryParts(queryResult['query'])
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+        roundCounts = self.roundCounts.setdefault(server, sampleCounts())
+        roundCounts.samples += 1
+
+        if status not in answeredStatuses:
+            roundCounts.failures += 1
+            return
+
+        responseTime = float(queryResult['responseTime'])
+        self.roundTimes.setdefault(server, []).append(responseTime)
+        self.histograms[server].add(responseTime)
+        roundCounts.addTime(responseTime)
+        self.roundAnswers.setdefault((queryType, queryName), {})[server] = (status, frozenset(queryResult['response']))
+
+    def checkAnswers(self):
+        """Count, for every answer of the round, whether another nameserver gave the same status and a common record."""
+        for answers in self.roundAnswers.values():
+            if len(answers) < 2:
+                continue
+            statusCounts = Counter(status for status, _ in answers.values())
+            for server, (status, records) in answers.items():
+                agrees = statusCounts[status] > 1
+                if agrees and status == responseParser.statusOk:
+                    agrees = any(other != server and otherStatus == status and records & otherRecords
+                                 for other, (otherStatus, otherRecords) in answers.items())
+                self.roundCounts[server].checks += 1
+                self.roundCounts[server].agreements += agrees
+
+    def endRound(self):
+        """Score every nameserver on the round that was just completed."""
+        self.checkAnswers()
+
+        for server in self.nameservers:
+            roundCounts = self.roundCounts.get(server, sampleCounts())
+            times = sorted(self.roundTimes.get(server, []))
+            p50 = times[len(times) // 2] if times else 0.0
+            self.roundScores[server].append(score(p50, roundCounts.jitter(), roundCounts.failureRate(), 1 - roundCounts.consistency()))
+
+            totals = self.totals[server]
+            totals.samples += roundCounts.samples
+            totals.failures += roundCounts.failures
+            totals.checks += roundCounts.checks
+            totals.agreements += roundCounts.agreements
+            totals.jitterTotal += roundCounts.jitterTotal
+            totals.jitterCount += roundCounts.jitterCount
+
+        self.rounds += 1
+        self.roundCounts = {}
+        self.roundTimes = {}
+        self.roundAnswers = {}
+
+    def serverScore(self, server):
+        """Return the score of server over all the rounds."""
+        totals = self.totals[server]
+        return score(self.histograms[server].quantile(0.5), totals.jitter(), totals.failureRate(), 1 - totals.consistency())
+
+    def ranking(self):
+        """Return the nameservers from the best to the worst score."""
+        return sorted(self.nameservers, key=self.serverScore)
+
+    def isStable(self):
+        """Return True when every pair of neighbours in the ranking is either separated or equivalent."""
+        if self.rounds < minRounds:
+            return False
+
+        order = self.ranking()
+        margin = tQuantile(self.rounds - 1) / math.sqrt(self.rounds)
+        for better, worse in zip(order, order[1:]):
+            differences = [worseScore - betterScore for betterScore, worseScore in zip(self.roundScores[better], self.roundScores[worse])]
+            mean = statistics.fmean(differences)
+            halfWidth = margin * statistics.stdev(differences)
+            if mean - halfWidth > 0:
+                continue
+            if -self.tolerance < mean - halfWidth and mean + halfWidth < self.tolerance:
+                continue
+            return False
+        return True
+
+    def rankResults(self):
+        """Return the rankResults section of the json data."""
+        entries = []
+        recommended = []
+
+        for rank, server in enumerate(self.ranking(), 1):
+            totals = self.totals[server]
+            histogram = self.histograms[server]
+            failureRate = totals.failureRate()
+            consistency = totals.consistency()
+            isRecommended = (histogram.count > 0 and failureRate <= maxFailureRate and consistency >= minConsistency and
+                             len(recommended) < maxRecommended)
+            if isRecommended:
+                recommended.append(server)
+
+            # Without responses there is no latency, and without another nameserver to compare with no consistency.
+            entries.append({
+                "rank": rank,
+                "nameserver": server,
+                "score": round(self.serverScore(server), 3),
+                "p50": round(histogram.quantile(0.5), 3) if histogram.count else None,
+                "p90": round(histogram.quantile(0.9), 3) if histogram.count else None,
+                "p99": round(histogram.quantile(0.99), 3) if histogram.count else None,
+                "jitter": round(totals.jitter(), 3),
+                "samples": totals.samples,
+                "failures": totals.failures,
+                "failureRate": round(failureRate, 4),
+                "consistency": round(consistency, 4) if totals.checks else None,
+                "recommended": isRecommended
+            })
+
+        return {
+            "rounds": self.rounds,
+            "stable": self.isStable(),
+            "tolerance": self.tolerance,
+            "nameservers": entries,
+            "recommended": recommended
+        }
+
+    def __init__(self, nameservers, tolerance=1.0):
+        """Initialize the class variables. tolerance is the score difference in milliseconds that counts as equivalent."""
+        self.nameservers = list(dict.fromkeys(nameservers))
+        self.tolerance = tolerance
+        self.rounds = 0
+        self.histograms = {server: latencyHistogram.latencyHistogram() for server in self.nameservers}
+        self.totals = {server: sampleCounts() for server in self.nameservers}
+        self.roundScores = {server: [] for server in self.nameservers}
+        self.roundCounts = {}
+        self.roundTimes = {}
+        self.roundAnswers = {}
+
+
+def resolvConf(rankResults, comment=''):
+    """
+    Return a resolv.conf fragment with the recommended nameservers of rankResults
+    in order. resolv.conf has no ports, nameservers on another port than 53 are
+    commented out.
+    """
+    lines = ['# Recommended nameservers' + (' - ' + comment if comment else '')]
+    for server in rankResults['recommended']:
+        address, port = timedQuery.parseNameserver(server)
+        if port == 53:
+            lines.append('nameserver ' + address)
+        else:
+            lines.append('# nameserver ' + address + '  (port ' + str(port) + ' can not be set in resolv.conf)')
+    if not rankResults['recommended']:
+        lines.append('# No nameserver met the failure rate and consistency limits.')
+    return '\n'.join(lines) + '\n'
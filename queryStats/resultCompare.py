@@ -0,0 +1,380 @@
+# DNS result comparison
+# Compares the latency and error rate of the current results of
+# dns-resolution-test.py with a baseline, per nameserver and query, and exits
+# with code 1 when there is a significant regression, for CI and alerting.
+#
+# Run from the repository directory:
+#   python3 -m queryStats.resultCompare --baseline history.jsonl --current output.json
+
+import argparse
+import json
+import math
+import os
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from queryEngine import responseParser
+from resultStore import resultArchive
+
+# The query of the row that has all the queries of a nameserver.
+allQueries = '*'
+
+
+class sampleSet:
+    """sampleSet class. The response times and the failures (lost queries and error responses) of one query against one nameserver."""
+
+    __slots__ = ('latencies', 'total', 'failures')
+
+    def add(self, queryResult):
+        """Add a query result."""
+        self.total += 1
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+        if status != responseParser.statusOk:
+            self.failures += 1
+        # Lost queries have no latency, as in aggregatedResults.
+        if status not in responseParser.lossStatuses:
+            self.latencies.append(float(queryResult['responseTime']))
+
+    def merge(self, other):
+        """Add the samples of other."""
+        self.latencies.extend(other.latencies)
+        self.total += other.total
+        self.failures += other.failures
+
+    def __init__(self):
+        """Initialize an empty set."""
+        self.latencies = array('d')
+        self.total = 0
+        self.failures = 0
+
+
+def readRuns(source):
+    """Return the runs of a json or json lines file or of a result archive directory, one at a time."""
+    if os.path.isdir(source):
+        return resultArchive.readArchive(source)
+    return resultArchive.readJsonFile(source)
+
+
+def addRun(samples, myData, keys=None):
+    """
+    Add the query results of a run to samples, per (nameserver, type, query) and
+    per nameserver. With keys only the samples of those keys are kept.
+    """
+    for server, serverResults in myData.get('queryResults', {}).items():
+        serverKey = (server, allQueries, allQueries)
+        serverSamples = None
+        if keys is None or serverKey in keys:
+            serverSamples = samples.get(serverKey)
+            if serverSamples is None:
+                serverSamples = samples[serverKey] = sampleSet()
+
+        for queryResult in serverResults:
+            queryType, queryName = responseParser.getQueryParts(queryResult['query'])
+            key = (server, queryType, queryName)
+            if keys is None or key in keys:
+                querySamples = samples.get(key)
+                if querySamples is None:
+                    querySamples = samples[key] = sampleSet()
+                querySamples.add(queryResult)
+            if serverSamples is not None:
+                serverSamples.add(queryResult)
+
+
+def loadSamples(source, window=0, deviceTag=None, keys=None):
+    """
+    Stream the runs of source and return their samples and the number of runs.
+    A run is identified by its deviceUuid and start time, so the lines of an
+    --ofstream file are one run. With window only the last window runs are kept.
+    deviceTag only keeps the runs of that tag, keys only the samples of those
+    (nameserver, type, query) keys, so a large baseline is reduced to the
+    queries of the current results while it is read.
+    """
+    if not window:
+        samples = {}
+        runIds = set()
+        for myData in readRuns(source):
+            if deviceTag is None or myData.get('deviceTag', '') == deviceTag:
+                runIds.add((myData.get('deviceUuid', ''), myData.get('scriptUTCStartTime', myData.get('scriptStartTime', ''))))
+                addRun(samples, myData, keys)
+        return samples, len(runIds)
+
+    runs = {}
+    for myData in readRuns(source):
+        if deviceTag is not None and myData.get('deviceTag', '') != deviceTag:
+            continue
+        runId = (myData.get('deviceUuid', ''), myData.get('scriptUTCStartTime', myData.get('scriptStartTime', '')))
+        runSamples = runs.pop(runId, None)
+        if runSamples is None:
+            runSamples = {}
+            if len(runs) >= window:
+                # Drop the oldest run, dicts keep the insertion order.
+                del runs[next(iter(runs))]
+        runs[runId] = runSamples
+        addRun(runSamples, myData, keys)
+
+    samples = {}
+    for runSamples in runs.values():
+        for key, runSet in runSamples.items():
+            if key in samples:
+                samples[key].merge(runSet)
+            else:
+                samples[key] = runSet
+    return samples, len(runs)
+
+
+def median(values):
+    """Return the median of the sorted sequence values."""
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def mannWhitney(baseline, current):
+    """
+    One-sided Mann-Whitney U test that current is slower than baseline (both
+    sorted). Returns the p-value (normal approximation with tie and continuity
+    correction) and Cliff's delta: the probability that a current sample is
+    slower than a baseline sample minus the probability that it is faster.
+    """
+    n1 = len(baseline)
+    n2 = len(current)
+    # U of current: the baseline samples below every current sample, ties count half.
+    u = 0.0
+    for value in current:
+        below = bisect_left(baseline, value)
+        u += below + (bisect_right(baseline, value, below) - below) / 2
+
+    n = n1 + n2
+    tieTerm = sum(count ** 3 - count for count in Counter(baseline + current).values() if count > 1)
+    variance = n1 * n2 / 12 * ((n + 1) - tieTerm / (n * (n - 1)))
+    delta = 2 * u / (n1 * n2) - 1
+    if variance <= 0:
+        return 1.0, delta
+
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2)), delta
+
+
+def fisherGreater(baselineFailures, baselineTotal, currentFailures, currentTotal):
+    """One-sided Fisher exact test that the failure rate of current is higher than that of baseline. Returns the p-value."""
+    failures = baselineFailures + currentFailures
+    total = baselineTotal + currentTotal
+    if not failures or currentFailures * baselineTotal <= baselineFailures * currentTotal:
+        return 1.0
+
+    def logProbability(count):
+        """Log of the hypergeometric probability of count failures in current."""
+        return (math.lgamma(failures + 1) - math.lgamma(count + 1) - math.lgamma(failures - count + 1) +
+                math.lgamma(total - failures + 1) - math.lgamma(currentTotal - count + 1) -
+                math.lgamma(total - failures - currentTotal + count + 1) -
+                math.lgamma(total + 1) + math.lgamma(currentTotal + 1) + math.lgamma(total - currentTotal + 1))
+
+    # Past the mode the terms get smaller, stop when they no longer change the p-value.
+    pValue = 0.0
+    for count in range(currentFailures, min(failures, currentTotal) + 1):
+        term = math.exp(logProbability(count))
+        pValue += term
+        if term < pValue * 1e-12:
+            break
+    return min(pValue, 1.0)
+
+
+def adjustPValues(pValues):
+    """Return the Benjamini-Hochberg adjusted p-values (false discovery rate) of pValues, in the same order."""
+    order = sorted(range(len(pValues)), key=pValues.__getitem__, reverse=True)
+    adjusted = [1.0] * len(pValues)
+    smallest = 1.0
+    for rank, index in zip(range(len(pValues), 0, -1), order):
+        smallest = min(smallest, pValues[index] * len(pValues) / rank)
+        adjusted[index] = smallest
+    return adjusted
+
+
+def compareSamples(baseline, current, minSamples=5):
+    """Return the comparison entries of every (nameserver, type, query) that is in both baseline and current."""
+    entries = []
+    for key, currentSet in current.items():
+        baselineSet = baseline.get(key)
+        if baselineSet is None:
+            continue
+
+        server, queryType, queryName = key
+        baselineTimes = sorted(baselineSet.latencies)
+        currentTimes = sorted(currentSet.latencies)
+        entry = {
+            "nameserver": server,
+            "query": {queryType: queryName},
+            "baselineSamples": baselineSet.total,
+            "currentSamples": currentSet.total,
+            "baselineMedian": round(median(baselineTimes), 3) if baselineTimes else None,
+            "currentMedian": round(median(currentTimes), 3) if currentTimes else None,
+            "latencyPValue": None,
+            "cliffsDelta": None,
+            "baselineErrorRate": round(baselineSet.failures / baselineSet.total, 4),
+            "currentErrorRate": round(currentSet.failures / currentSet.total, 4),
+            "errorPValue": fisherGreater(baselineSet.failures, baselineSet.total, currentSet.failures, currentSet.total)
+        }
+        if len(baselineTimes) >= minSamples and len(currentTimes) >= minSamples:
+            entry["latencyPValue"], entry["cliffsDelta"] = mannWhitney(baselineTimes, currentTimes)
+            entry["cliffsDelta"] = round(entry["cliffsDelta"], 3)
+        entries.append(entry)
+
+    return entries
+
+
+def flagRegressions(entries, alpha=0.01, minEffect=0.33, minErrorIncrease=0.01, minSamples=5):
+    """
+    Adjust the p-values of all the tests together and set the verdict of every
+    entry: latency and/or errors for a regression, ok, or insufficient when there
+    are fewer than minSamples samples on either side.
+    """
+    tests = []
+    for entry in entries:
+        if entry["latencyPValue"] is not None:
+            tests.append((entry, "latencyPValue"))
+        if min(entry["baselineSamples"], entry["currentSamples"]) >= minSamples:
+            tests.append((entry, "errorPValue"))
+        else:
+            entry["errorPValue"] = None
+
+    for (entry, name), adjusted in zip(tests, adjustPValues([entry[name] for entry, name in tests])):
+        entry[name] = adjusted
+
+    regressions = 0
+    for entry in entries:
+        verdict = []
+        if entry["latencyPValue"] is not None and entry["latencyPValue"] < alpha and entry["cliffsDelta"] >= minEffect:
+            verdict.append('latency')
+        if (entry["errorPValue"] is not None and entry["errorPValue"] < alpha and
+                entry["currentErrorRate"] - entry["baselineErrorRate"] >= minErrorIncrease):
+            verdict.append('errors')
+
+        if verdict:
+            entry["verdict"] = '+'.join(verdict)
+            regressions += 1
+        elif entry["latencyPValue"] is None and entry["errorPValue"] is None:
+            entry["verdict"] = 'insufficient'
+        else:
+            entry["verdict"] = 'ok'
+
+        for name in ("latencyPValue", "errorPValue"):
+            if entry[name] is not None:
+                entry[name] = float(f'{entry[name]:.3g}')
+
+    return regressions
+
+
+def displayComparison(entries, showAll=False):
+    """Display the regressions and the per nameserver rows, or every row with showAll."""
+    filler = ' '
+    headers = ['DNS Server', 'DNS Type', 'DNS Query', 'Samples', 'Median (ms)', 'Change', 'Delta', 'p', 'Errors', 'p', 'Verdict']
+    widths = [18, 10, 30, 14, 18, 9, 8, 10, 15, 10, 12]
+
+    print()
+    for item, width in zip(headers, widths):
+        print(f'{item:{filler}<{width}}', end='')
+    print()
+
+    for entry in entries:
+        queryType, queryName = list(entry['query'].items())[0]
+        if not showAll and entry['verdict'] in ('ok', 'insufficient') and queryType != allQueries:
+            continue
+
+        change = '-'
+        if entry['baselineMedian'] and entry['currentMedian'] is not None:
+            change = f"{(entry['currentMedian'] - entry['baselineMedian']) * 100 / entry['baselineMedian']:+.0f}%"
+        row = [entry['nameserver'], queryType, queryName, str(entry['baselineSamples']) + '/' + str(entry['currentSamples']),
+               str(entry['baselineMedian']) + '/' + str(entry['currentMedian']), change,
+               '-' if entry['cliffsDelta'] is None else entry['cliffsDelta'], '-' if entry['latencyPValue'] is None else entry['latencyPValue'],
+               f"{entry['baselineErrorRate']:.1%}/{entry['currentErrorRate']:.1%}", '-' if entry['errorPValue'] is None else entry['errorPValue'],
+               entry['verdict']]
+        for item, width in zip(row, widths):
+            print(f'{str(item):{filler}<{width}}', end='')
+        print()
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Compare dns-resolution-test results with a baseline and flag latency and error rate regressions')
+
+    parser.add_argument('--baseline', required=True,
+                        help='baseline results: a json or json lines file (for example --ofstream output) or a --ofarchive directory')
+
+    parser.add_argument('--current', default='output.json',
+                        help='current results, in the same formats. Default output.json.')
+
+    parser.add_argument('--window', type=int, default=0,
+                        help='only use the last WINDOW runs of the baseline. Default all the runs.')
+
+    parser.add_argument('--deviceTag', default=None,
+                        help='only use the runs with this deviceTag')
+
+    parser.add_argument('--alpha', type=float, default=0.01,
+                        help='significance level, after the false discovery rate correction over all the tests. Default 0.01.')
+
+    parser.add_argument('--minEffect', type=float, default=0.33,
+                        help="smallest Cliff's delta that is a latency regression (0.33 is a medium effect). Default 0.33.")
+
+    parser.add_argument('--minErrorIncrease', type=float, default=0.01,
+                        help='smallest increase of the error rate that is a regression, as a fraction. Default 0.01.')
+
+    parser.add_argument('--minSamples', type=int, default=5,
+                        help='samples needed on both sides to test a query. Default 5.')
+
+    parser.add_argument('--all', action='store_true',
+                        help='display every query, not only the regressions and the nameservers')
+
+    parser.add_argument('--output', default='',
+                        help='write the comparison as json to this file')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    try:
+        current, currentRuns = loadSamples(args.current, 0, args.deviceTag)
+        baseline, baselineRuns = loadSamples(args.baseline, args.window, args.deviceTag, current.keys())
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        print('Unable to read the results: ' + str(err))
+        sys.exit(2)
+
+    if not baselineRuns or not currentRuns:
+        print('No ' + ('baseline' if not baselineRuns else 'current') + ' runs to compare.')
+        sys.exit(2)
+
+    entries = compareSamples(baseline, current, max(args.minSamples, 2))
+    regressions = flagRegressions(entries, args.alpha, args.minEffect, args.minErrorIncrease, max(args.minSamples, 2))
+
+    print('Baseline: ' + str(baselineRuns) + ' runs  Current: ' + str(currentRuns) + ' runs  Compared: ' + str(len(entries)))
+    displayComparison(entries, args.all)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as outputFile:
+            json.dump({"baselineRuns": baselineRuns, "currentRuns": currentRuns, "regressions": regressions, "entries": entries}, outputFile)
+
+    print()
+    if not regressions:
+        print('No regressions')
+        return
+
+    print(str(regressions) + ' regression(s)')
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
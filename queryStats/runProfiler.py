@@ -0,0 +1,164 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+class profileSpan:
+    """
+    profileSpan class. A timed phase of a run, used as a context manager.
+    When it ends, its record is added to the runProfiler and passed to the hooks.
+    """
+
+    __slots__ = ('profiler', 'name', 'details', 'startNs', 'startBlocks', 'startBytes')
+
+    def __enter__(self):
+        """Start the span."""
+        self.startBlocks = sys.getallocatedblocks()
+        if self.profiler.trackMemory:
+            self.startBytes = tracemalloc.get_traced_memory()[0]
+        self.startNs = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """End the span and record it."""
+        endNs = time.perf_counter_ns()
+        record = {
+            "name": self.name,
+            "startNs": self.startNs,
+            "durationNs": endNs - self.startNs,
+            "blocks": sys.getallocatedblocks() - self.startBlocks,
+            "thread": threading.get_ident()
+        }
+        if self.profiler.trackMemory:
+            record["bytes"] = tracemalloc.get_traced_memory()[0] - self.startBytes
+        if self.details:
+            record["details"] = self.details
+        self.profiler.addSpan(record)
+        return False
+
+    def __init__(self, profiler, name, details):
+        """Initialize the span of profiler."""
+        self.profiler = profiler
+        self.name = name
+        self.details = details
+        self.startNs = 0
+        self.startBlocks = 0
+        self.startBytes = 0
+
+
+class runProfiler:
+    """
+    runProfiler class.
+    Records a span (duration and allocation count) for every phase of a run,
+    and optionally for every query. Hooks are called with the record of every
+    completed span, so embedding code can attach its own collectors:
+
+        o_runProfiler.addHook(lambda record: print(record["name"], record["durationNs"]))
+
+    A record has name, startNs (time.perf_counter_ns), durationNs, blocks (the
+    change of sys.getallocatedblocks), thread, bytes (the change of the traced
+    memory, with trackMemory) and details (the keyword arguments of the span).
+    """
+
+    def span(self, name, **details):
+        """Return a context manager that records the span name."""
+        return profileSpan(self, name, details)
+
+    def addSpan(self, record):
+        """Add a completed span record, for example for a query that was timed by an engine, and call the hooks."""
+        with self.lock:
+            self.spans.append(record)
+        for hook in self.hooks:
+            hook(record)
+
+    def addHook(self, hook):
+        """Call hook(record) for every completed span."""
+        self.hooks.append(hook)
+
+    def removeHook(self, hook):
+        """Stop calling hook."""
+        self.hooks.remove(hook)
+
+    def summary(self):
+        """Return the spans grouped by name: [name, count, total ms, mean ms, max ms, blocks, bytes], in the order they first ended."""
+        groups = {}
+        for record in self.spans:
+            group = groups.get(record["name"])
+            if group is None:
+                group = groups[record["name"]] = [record["name"], 0, 0, 0, 0, 0, 0]
+            group[1] += 1
+            group[2] += record["durationNs"]
+            group[4] = max(group[4], record["durationNs"])
+            group[5] += record["blocks"]
+            group[6] += record.get("bytes", 0)
+
+        rows = []
+        for name, count, totalNs, _, maxNs, blocks, allocated in groups.values():
+            rows.append([name, count, round(totalNs / 1000000, 3), round(totalNs / count / 1000000, 3),
+                         round(maxNs / 1000000, 3), blocks, allocated])
+        return rows
+
+    def displaySummary(self, outputFile=sys.stderr):
+        """Display the summary of the spans, and the top allocation sites with trackMemory."""
+        filler = ' '
+        headers = ['Span', 'Count', 'Total (ms)', 'Mean (ms)', 'Max (ms)', 'Blocks']
+        widths = [22, 9, 14, 12, 12, 10]
+        if self.trackMemory:
+            headers.append('Bytes')
+            widths.append(12)
+
+        print(file=outputFile)
+        for item, width in zip(headers, widths):
+            print(f'{item:{filler}<{width}}', end='', file=outputFile)
+        print(file=outputFile)
+
+        for row in self.summary():
+            for item, width in zip(row, widths):
+                print(f'{str(item):{filler}<{width}}', end='', file=outputFile)
+            print(file=outputFile)
+
+        if self.trackMemory and tracemalloc.is_tracing():
+            print('\nTop allocation sites:', file=outputFile)
+            for statistic in tracemalloc.take_snapshot().statistics('lineno')[:10]:
+                print('  ' + str(statistic), file=outputFile)
+
+    def writeTrace(self, fileName):
+        """Write the spans as a Chrome trace (chrome://tracing, Perfetto) json file."""
+        events = []
+        pid = os.getpid()
+        for record in self.spans:
+            spanArgs = {"blocks": record["blocks"]}
+            if "bytes" in record:
+                spanArgs["bytes"] = record["bytes"]
+            spanArgs.update(record.get("details", {}))
+            events.append({
+                "name": record["name"],
+                "ph": "X",
+                "ts": (record["startNs"] - self.startNs) / 1000,
+                "dur": record["durationNs"] / 1000,
+                "pid": pid,
+                "tid": record["thread"],
+                "args": spanArgs
+            })
+
+        with open(fileName, 'w', encoding='utf-8') as traceFile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile, default=str)
+
+    def __init__(self, perQuery=False, trackMemory=False):
+        """
+        Initialize the profiler. With perQuery the engines also record a span for
+        every query. With trackMemory tracemalloc is started, so the spans have
+        the bytes they allocated.
+        """
+        self.perQuery = perQuery
+        self.trackMemory = trackMemory
+        self.spans = []
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.startNs = time.perf_counter_ns()
+
+        if trackMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
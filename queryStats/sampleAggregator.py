@@ -0,0 +1,69 @@
+from queryEngine import responseParser
+from queryStats import latencyHistogram
+
+
+class querySamples:
+    """querySamples class. The samples of one query against one nameserver."""
+
+    __slots__ = ('histogram', 'lost', 'errors')
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.histogram = latencyHistogram.latencyHistogram()
+        self.lost = 0
+        self.errors = 0
+
+
+class sampleAggregator:
+    """
+    sampleAggregator class.
+    Collects the results of repeated runs of the query matrix into a
+    latencyHistogram per (nameserver, record type, query), so memory does not
+    grow with the number of iterations.
+    Lost queries (timeouts) are counted but not added to the latency samples.
+    """
+
+    def endIteration(self):
+        """Count a completed run of the query matrix, after its results were added with addResult."""
+        self.iterations += 1
+
+    def addResult(self, server, queryResult):
+        """Add a single query result for server."""
+        queryType, queryName = responseParser.getQueryParts(queryResult['query'])
+        key = (server, queryType, queryName)
+
+        samples = self.samples.get(key)
+        if samples is None:
+            samples = self.samples[key] = querySamples()
+
+        status = queryResult.get('responseStatus', responseParser.statusOk)
+        if status in responseParser.lossStatuses:
+            samples.lost += 1
+            return
+
+        if status != responseParser.statusOk:
+            samples.errors += 1
+
+        samples.histogram.add(float(queryResult['responseTime']))
+
+    def aggregatedResults(self, durationSeconds):
+        """Return the aggregated section of the json data."""
+        servers = {}
+
+        for (server, queryType, queryName), samples in self.samples.items():
+            entry = {"query": {queryType: queryName}}
+            entry.update(samples.histogram.summary())
+            entry["lost"] = samples.lost
+            entry["errors"] = samples.errors
+            servers.setdefault(server, []).append(entry)
+
+        return {
+            "iterations": self.iterations,
+            "durationSeconds": round(durationSeconds, 3),
+            "nameservers": servers
+        }
+
+    def __init__(self):
+        """Initialize the class variables."""
+        self.samples = {}
+        self.iterations = 0
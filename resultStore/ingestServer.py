@@ -0,0 +1,602 @@
+# DNS result ingestion server
+# Collector for the --httpPOST uploads of dns-resolution-test.py. The runs are
+# stored in SQLite, indexed by time, nameserver, deviceTag and record type, with
+# hourly and daily latency rollups for fast percentile queries.
+#
+# Run from the repository directory:
+#   python3 -m resultStore.ingestServer --database results.db --port 8080
+
+import argparse
+import io
+import json
+import math
+import operator
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from queryEngine import responseParser
+from queryStats import latencyHistogram
+
+schemaVersion = 1
+
+# Rollup periods in seconds. A query range uses the daily rollups for its whole
+# days and the hourly rollups for the hours before and after them.
+hourSeconds = 3600
+daySeconds = 86400
+
+# Columns the query API can filter and group on.
+dimensionColumns = ('nameserver', 'deviceTag', 'recordType')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    runId INTEGER PRIMARY KEY,
+    deviceUuid TEXT,
+    deviceTag TEXT,
+    hostName TEXT,
+    startTime REAL,
+    endTime REAL,
+    dataFormatVersion INTEGER,
+    receivedTime REAL,
+    UNIQUE (deviceUuid, startTime)
+);
+CREATE TABLE IF NOT EXISTS results (
+    runId INTEGER,
+    time REAL,
+    nameserver TEXT,
+    deviceTag TEXT,
+    recordType TEXT,
+    queryName TEXT,
+    status TEXT,
+    responseTime REAL,
+    networkTime REAL,
+    processingTime REAL,
+    responseTTL INTEGER
+);
+CREATE INDEX IF NOT EXISTS resultsTime ON results (time);
+CREATE INDEX IF NOT EXISTS resultsNameserver ON results (nameserver, time);
+CREATE INDEX IF NOT EXISTS resultsDeviceTag ON results (deviceTag, time);
+CREATE INDEX IF NOT EXISTS resultsRecordType ON results (recordType, time);
+CREATE TABLE IF NOT EXISTS rollups (
+    span INTEGER,
+    period INTEGER,
+    nameserver TEXT,
+    deviceTag TEXT,
+    recordType TEXT,
+    samples INTEGER,
+    lost INTEGER,
+    errors INTEGER,
+    total REAL,
+    min REAL,
+    max REAL,
+    firstBucket INTEGER,
+    buckets BLOB,
+    PRIMARY KEY (span, period, nameserver, deviceTag, recordType)
+) WITHOUT ROWID;
+'''
+
+
+def parseTime(value):
+    """
+    Return the unix time of value: seconds, or a UTC date or date and time
+    (2026-10-18, 2026-10-18 09:00 or the scriptUTCStartTime of the json data).
+    Raises ValueError when it can not be parsed.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parsed = datetime.fromisoformat(str(value).strip())
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def optionalFloat(value):
+    """Return value as a float, None when the data format version does not have it."""
+    if value is None:
+        return None
+    return float(value)
+
+
+def rollupRanges(start, end):
+    """Return the (span, first period, end period) ranges of rollups that cover start..end, extended to whole hours."""
+    startHour = math.floor(start / hourSeconds) * hourSeconds
+    endHour = math.ceil(end / hourSeconds) * hourSeconds
+    firstDay = math.ceil(startHour / daySeconds) * daySeconds
+    lastDay = math.floor(endHour / daySeconds) * daySeconds
+
+    if firstDay >= lastDay:
+        return [(hourSeconds, startHour, endHour)]
+    return [(hourSeconds, startHour, firstDay), (daySeconds, firstDay, lastDay), (hourSeconds, lastDay, endHour)]
+
+
+def newRollup():
+    """Return an empty rollup: [samples, lost, errors, total, min, max, bucket counts]."""
+    return [0, 0, 0, 0.0, None, None, []]
+
+
+def addCounts(counts, firstBucket, bucketBytes):
+    """Add the packed bucket counts, starting at bucket firstBucket, to the list counts."""
+    packed = array('I')
+    packed.frombytes(bucketBytes)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    end = firstBucket + len(packed)
+    if len(counts) < end:
+        counts.extend([0] * (end - len(counts)))
+    counts[firstBucket:end] = map(operator.add, counts[firstBucket:end], packed)
+
+
+def packCounts(counts):
+    """Return the first non-empty bucket and the packed (little endian) counts from it to the last non-empty bucket."""
+    firstBucket = 0
+    while firstBucket < len(counts) and not counts[firstBucket]:
+        firstBucket += 1
+    lastBucket = len(counts)
+    while lastBucket > firstBucket and not counts[lastBucket - 1]:
+        lastBucket -= 1
+
+    packed = array('I', counts[firstBucket:lastBucket])
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return firstBucket, packed.tobytes()
+
+
+def mergeRollup(rollup, row):
+    """Add a row of the rollups table (samples, lost, errors, total, min, max, firstBucket, buckets) to rollup."""
+    samples, lost, errors, total, minimum, maximum, firstBucket, bucketBytes = row
+    rollup[0] += samples
+    rollup[1] += lost
+    rollup[2] += errors
+    rollup[3] += total
+    if samples:
+        rollup[4] = minimum if rollup[4] is None else min(rollup[4], minimum)
+        rollup[5] = maximum if rollup[5] is None else max(rollup[5], maximum)
+    if bucketBytes:
+        addCounts(rollup[6], firstBucket, bucketBytes)
+
+
+def inflateLimited(body, wbits, maxSize):
+    """Return the zlib or gzip (wbits) compressed body, or None as soon as it gets larger than maxSize."""
+    parts = []
+    size = 0
+    while body:
+        decompressor = zlib.decompressobj(wbits)
+        data = decompressor.decompress(body, maxSize + 1 - size)
+        size += len(data)
+        if size > maxSize or decompressor.unconsumed_tail:
+            return None
+        parts.append(data)
+        if not decompressor.eof:
+            raise zlib.error('incomplete or truncated stream')
+        # Concatenated gzip members, as gzip.decompress accepts them.
+        body = decompressor.unused_data if wbits > 15 else b''
+    return b''.join(parts)
+
+
+def decodeBody(body, encoding, maxSize):
+    """
+    Return the body without its Content-Encoding, or None when the decoded body
+    is larger than maxSize bytes. The body is decompressed in chunks and stops
+    at maxSize, so a small compressed upload can not expand in memory.
+    Raises ValueError for an unsupported or corrupt encoding.
+    """
+    encoding = (encoding or 'identity').strip().lower()
+    try:
+        if encoding == 'gzip':
+            return inflateLimited(body, 31, maxSize)
+        if encoding == 'deflate':
+            return inflateLimited(body, 15, maxSize)
+    except zlib.error as err:
+        raise ValueError('Invalid ' + encoding + ' body: ' + str(err))
+
+    if encoding == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError('zstd bodies need the zstandard package')
+        parts = []
+        size = 0
+        try:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+                while True:
+                    data = reader.read(min(maxSize + 1 - size, 1 << 20))
+                    if not data:
+                        break
+                    size += len(data)
+                    if size > maxSize:
+                        return None
+                    parts.append(data)
+        except zstandard.ZstdError as err:
+            raise ValueError('Invalid zstd body: ' + str(err))
+        return b''.join(parts)
+
+    if encoding != 'identity':
+        raise ValueError('Unsupported Content-Encoding ' + encoding)
+    return body if len(body) <= maxSize else None
+
+
+def parsePayload(body, contentType):
+    """Return the runs of an upload: one json object, a json list or json lines (application/x-ndjson)."""
+    if 'ndjson' in (contentType or '') or 'jsonl' in (contentType or ''):
+        runs = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        runs = json.loads(body)
+        if isinstance(runs, dict):
+            runs = [runs]
+
+    if not isinstance(runs, list) or not all(isinstance(run, dict) for run in runs):
+        raise ValueError('The body is not the json data of dns-resolution-test runs')
+    return runs
+
+
+class resultDatabase:
+    """
+    resultDatabase class.
+    The SQLite store of the uploaded runs. Every query result is a row of the
+    results table, and its response time is also added to the latency rollups:
+    one row per hour and per day, nameserver, deviceTag and record type with the
+    totals and the packed latencyHistogram bucket counts, so percentiles over
+    weeks only read a few thousand rows.
+    The results of a run are stored at the start time of the run. A run that is
+    uploaded again (the same deviceUuid and start time) is ignored.
+    """
+
+    def addRun(self, cursor, myData, receivedTime, rollups):
+        """Add one run, collecting its rollups in rollups. Returns the number of results, None for a duplicate."""
+        startTime = parseTime(myData.get('scriptUTCStartTime', myData.get('scriptStartTime')))
+        endTime = myData.get('scriptUTCEndTime', myData.get('scriptEndTime'))
+        endTime = parseTime(endTime) if endTime else startTime
+        deviceTag = str(myData.get('deviceTag', ''))
+        queryResults = myData.get('queryResults', {})
+        if not isinstance(queryResults, dict):
+            raise ValueError('queryResults is not an object')
+
+        cursor.execute('INSERT OR IGNORE INTO runs (deviceUuid, deviceTag, hostName, startTime, endTime, dataFormatVersion, receivedTime) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (str(myData.get('deviceUuid', '')), deviceTag, str(myData.get('hostName', '')), startTime, endTime,
+                        int(myData.get('dataFormatVersion', 0)), receivedTime))
+        if not cursor.rowcount:
+            return None
+        runId = cursor.lastrowid
+
+        periods = [(span, int(startTime // span) * span) for span in (hourSeconds, daySeconds)]
+        rows = []
+
+        for server, serverResults in queryResults.items():
+            for queryResult in serverResults:
+                queryType, queryName = responseParser.getQueryParts(queryResult['query'])
+                status = queryResult.get('responseStatus', responseParser.statusOk)
+                responseTime = float(queryResult['responseTime'])
+                rows.append((runId, startTime, server, deviceTag, queryType, queryName, status, responseTime,
+                             optionalFloat(queryResult.get('networkTime')), optionalFloat(queryResult.get('processingTime')),
+                             queryResult.get('responseTTL')))
+
+                # Lost queries (timeouts) are counted but not added to the latency, as in aggregatedResults.
+                lost = status in responseParser.lossStatuses
+                bucket = self.histogram.bucketIndex(responseTime)
+                for span, period in periods:
+                    key = (span, period, server, deviceTag, queryType)
+                    rollup = rollups.get(key)
+                    if rollup is None:
+                        rollup = rollups[key] = newRollup()
+                    if lost:
+                        rollup[1] += 1
+                        continue
+                    rollup[0] += 1
+                    rollup[2] += status != responseParser.statusOk
+                    rollup[3] += responseTime
+                    rollup[4] = responseTime if rollup[4] is None else min(rollup[4], responseTime)
+                    rollup[5] = responseTime if rollup[5] is None else max(rollup[5], responseTime)
+                    counts = rollup[6]
+                    if bucket >= len(counts):
+                        counts.extend([0] * (bucket + 1 - len(counts)))
+                    counts[bucket] += 1
+
+        cursor.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def ingest(self, runs):
+        """Store the runs of an upload in one transaction. Returns the numbers of runs, duplicate runs and results."""
+        receivedTime = time.time()
+        rollups = {}
+        added = duplicates = results = 0
+
+        with self.lock, self.connection:
+            cursor = self.connection.cursor()
+            for myData in runs:
+                count = self.addRun(cursor, myData, receivedTime, rollups)
+                if count is None:
+                    duplicates += 1
+                    continue
+                added += 1
+                results += count
+
+            for key, rollup in rollups.items():
+                row = cursor.execute('SELECT samples, lost, errors, total, min, max, firstBucket, buckets FROM rollups '
+                                     'WHERE span = ? AND period = ? AND nameserver = ? AND deviceTag = ? AND recordType = ?', key).fetchone()
+                if row is not None:
+                    mergeRollup(rollup, row)
+                cursor.execute('INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               key + tuple(rollup[:6]) + packCounts(rollup[6]))
+
+        return {"runs": added, "duplicates": duplicates, "results": results}
+
+    @staticmethod
+    def whereClause(filters):
+        """Return the SQL conditions and parameters for the nameserver, deviceTag and recordType filters."""
+        conditions = []
+        parameters = []
+        for column in dimensionColumns:
+            if filters.get(column) is not None:
+                conditions.append(column + ' = ?')
+                parameters.append(filters[column])
+        return conditions, parameters
+
+    def percentiles(self, start, end, filters, groupBy=(), quantiles=(0.5, 0.9, 0.99)):
+        """
+        Return the latency statistics from the rollups between start and end
+        (unix times, extended to whole hours), per combination of the groupBy
+        columns, for the results that match filters.
+        """
+        conditions, parameters = self.whereClause(filters)
+        groupColumns = ''.join(column + ', ' for column in groupBy)
+        groups = {}
+
+        with self.lock:
+            for span, firstPeriod, endPeriod in rollupRanges(start, end):
+                where = ' AND '.join(['span = ?', 'period >= ?', 'period < ?'] + conditions)
+                for row in self.connection.execute('SELECT ' + groupColumns + 'samples, lost, errors, total, min, max, firstBucket, buckets '
+                                                   'FROM rollups WHERE ' + where, [span, firstPeriod, endPeriod] + parameters):
+                    key = row[:len(groupBy)]
+                    rollup = groups.get(key)
+                    if rollup is None:
+                        rollup = groups[key] = newRollup()
+                    mergeRollup(rollup, row[len(groupBy):])
+
+        entries = []
+        for key, (samples, lost, errors, total, minimum, maximum, counts) in groups.items():
+            histogram = latencyHistogram.latencyHistogram.fromDict({
+                "precision": self.histogram.precision,
+                "count": samples,
+                "total": total,
+                "min": minimum,
+                "max": maximum or 0.0,
+                "buckets": {index: count for index, count in enumerate(counts) if count}
+            })
+            entry = dict(zip(groupBy, key))
+            entry.update({
+                "samples": histogram.count,
+                "lost": lost,
+                "errors": errors,
+                "min": round(histogram.min, 3) if histogram.count else 0.0,
+                "mean": round(histogram.mean(), 3)
+            })
+            for quantile in quantiles:
+                entry['p' + format(quantile * 100, 'g')] = round(histogram.quantile(quantile), 3)
+            entry["max"] = round(histogram.max, 3)
+            entries.append(entry)
+
+        return entries
+
+    def results(self, start, end, filters, limit=1000):
+        """Return up to limit query results between start and end that match filters, newest first."""
+        conditions, parameters = self.whereClause(filters)
+        where = ' AND '.join(['time >= ?', 'time < ?'] + ['results.' + condition for condition in conditions])
+
+        with self.lock:
+            cursor = self.connection.execute('SELECT deviceUuid, hostName, results.deviceTag, time, nameserver, recordType, queryName, status, '
+                                             'responseTime, networkTime, processingTime, responseTTL FROM results JOIN runs USING (runId) '
+                                             'WHERE ' + where + ' ORDER BY time DESC LIMIT ?', [start, end] + parameters + [limit])
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor]
+
+    def status(self):
+        """Return the number of runs and results and the time range of the runs."""
+        with self.lock:
+            runs, firstTime, lastTime = self.connection.execute('SELECT COUNT(*), MIN(startTime), MAX(startTime) FROM runs').fetchone()
+            results = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {"runs": runs, "results": results, "firstRun": firstTime, "lastRun": lastTime}
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.connection.close()
+
+    def __init__(self, fileName, precision=0.02):
+        """
+        Open or create the database. precision is the relative bucket width of the
+        latency rollups, it is fixed when the database is created.
+        """
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(fileName, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.executescript(schema)
+            self.connection.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('schemaVersion', str(schemaVersion)))
+            self.connection.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('precision', repr(precision)))
+
+        storedVersion = int(self.connection.execute("SELECT value FROM meta WHERE key = 'schemaVersion'").fetchone()[0])
+        if storedVersion != schemaVersion:
+            raise ValueError(fileName + ' has schema version ' + str(storedVersion) + ', expected ' + str(schemaVersion))
+        precision = float(self.connection.execute("SELECT value FROM meta WHERE key = 'precision'").fetchone()[0])
+        self.histogram = latencyHistogram.latencyHistogram(precision)
+
+
+class ingestHandler(BaseHTTPRequestHandler):
+    """
+    ingestHandler class.
+    POST / or /ingest stores an upload. GET /percentiles, /results and /status
+    query the database.
+    """
+
+    def sendJson(self, data, status=200):
+        """Send data as the json response."""
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        """Store the runs of an upload."""
+        if urlsplit(self.path).path not in ('/', '/ingest'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.server.maxBodyBytes:
+            self.send_error(413)
+            return
+
+        try:
+            body = decodeBody(self.rfile.read(length), self.headers.get('Content-Encoding'), self.server.maxBodyBytes * 10)
+            if body is None:
+                self.send_error(413)
+                return
+            reply = self.server.database.ingest(parsePayload(body, self.headers.get('Content-Type')))
+        except (ValueError, KeyError, TypeError, AttributeError, IndexError) as err:
+            self.sendJson({"error": str(err)}, 400)
+            return
+        except sqlite3.Error as err:
+            # For example a locked database or a full disk. The transaction is rolled back and the client retries later.
+            print('Unable to store the upload from ' + self.client_address[0] + ': ' + str(err))
+            self.sendJson({"error": 'Database error: ' + str(err)}, 503)
+            return
+
+        if self.server.verbose:
+            print('Stored ' + str(reply['runs']) + ' runs, ' + str(reply['results']) + ' results from ' + self.client_address[0])
+        self.sendJson(reply)
+
+    def do_GET(self):
+        """Answer a query of the database."""
+        url = urlsplit(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/status':
+            self.sendJson(self.server.database.status())
+            return
+        if url.path not in ('/percentiles', '/results'):
+            self.send_error(404)
+            return
+
+        try:
+            end = parseTime(query['end']) if 'end' in query else time.time()
+            start = parseTime(query['start']) if 'start' in query else end - 7 * daySeconds
+            filters = {column: query.get(column) for column in dimensionColumns}
+            if filters['recordType'] is not None:
+                filters['recordType'] = filters['recordType'].lower()
+
+            if url.path == '/percentiles':
+                groupBy = [column for column in query.get('groupBy', '').split(',') if column]
+                if any(column not in dimensionColumns for column in groupBy):
+                    raise ValueError('groupBy can only have ' + ', '.join(dimensionColumns))
+                quantiles = [float(value) / 100 for value in query.get('p', '50,90,99').split(',')]
+                if any(not 0 <= quantile <= 1 for quantile in quantiles):
+                    raise ValueError('p must be between 0 and 100')
+                self.sendJson(self.server.database.percentiles(start, end, filters, groupBy, quantiles))
+            else:
+                limit = min(max(int(query.get('limit', 1000)), 1), 100000)
+                self.sendJson(self.server.database.results(start, end, filters, limit))
+        except ValueError as err:
+            self.sendJson({"error": str(err)}, 400)
+        except sqlite3.Error as err:
+            self.sendJson({"error": 'Database error: ' + str(err)}, 503)
+
+    def log_message(self, format, *args):
+        """Only log the requests with --verbose."""
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ingestServer:
+    """ingestServer class. The HTTP endpoint of a resultDatabase, in a background thread."""
+
+    def start(self):
+        """Start serving in a background thread."""
+        self.thread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+    def __init__(self, database, address='127.0.0.1', port=8080, maxBodyBytes=64 << 20, verbose=False):
+        """Listen on address and port (0 picks a free port)."""
+        self.httpServer = ThreadingHTTPServer((address, port), ingestHandler)
+        self.httpServer.daemon_threads = True
+        self.httpServer.database = database
+        self.httpServer.maxBodyBytes = maxBodyBytes
+        self.httpServer.verbose = verbose
+        self.port = self.httpServer.server_address[1]
+        self.thread = None
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Ingestion server for the --httpPOST uploads of dns-resolution-test')
+
+    parser.add_argument('--database', default='results.db',
+                        help='SQLite database file. Default results.db.')
+
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='Address to listen on. Default 127.0.0.1.')
+
+    parser.add_argument('--port', type=int, default=8080,
+                        help='Port to listen on. Default 8080.')
+
+    parser.add_argument('--maxBody', type=float, default=64.0,
+                        help='Maximum size of an upload in MB. Default 64.')
+
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every request.')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    try:
+        database = resultDatabase(args.database)
+    except (sqlite3.Error, ValueError) as err:
+        print('Unable to open the database: ' + str(err))
+        sys.exit(1)
+
+    server = ingestServer(database, args.address, args.port, int(args.maxBody * (1 << 20)), args.verbose)
+    print('Storing uploads in ' + args.database + ' on http://' + args.address + ':' + str(server.port))
+    try:
+        server.httpServer.serve_forever()
+    finally:
+        server.httpServer.server_close()
+        database.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
@@ -0,0 +1,408 @@
+# DNS result archive
+# Compact columnar storage for the json results of dns-resolution-test.py
+
+from array import array
+import argparse
+import glob
+import json
+import math
+import os
+import struct
+import sys
+import time
+import zlib
+
+archiveMagic = b'DNSA'
+archiveFormatVersion = 1
+archiveExtension = '.dnsa'
+
+# Column name -> array typecode. All the strings are dictionary encoded ('I').
+runColumns = [
+    ('run.deviceUuid', 'I'),
+    ('run.deviceTag', 'I'),
+    ('run.hostName', 'I'),
+    ('run.scriptUTCStartTime', 'I'),
+    ('run.scriptUTCEndTime', 'I'),
+    ('run.dataFormatVersion', 'H'),
+    ('run.streamRecord', 'I')
+]
+
+recordColumns = [
+    ('record.run', 'I'),
+    ('record.nameserver', 'I'),
+    ('record.queryType', 'I'),
+    ('record.queryName', 'I'),
+    ('record.response', 'I'),
+    ('record.responseStatus', 'I'),
+    ('record.responseTime', 'f'),
+    ('record.networkTime', 'f'),
+    ('record.processingTime', 'f'),
+    ('record.responseTTL', 'i'),
+    ('record.handshakeTime', 'f')
+]
+
+
+def partitionKey(scriptStartTime, partition):
+    """Return the name of the time partition for a run, by 'day' (YYYY-MM-DD) or 'hour' (YYYY-MM-DDTHH)."""
+    if partition == 'hour':
+        return scriptStartTime[:13].replace(' ', 'T')
+    return scriptStartTime[:10]
+
+
+def optionalTime(value):
+    """Convert a time from the json data to a float, NaN when the data format version does not have it."""
+    if value is None:
+        return math.nan
+    return float(value)
+
+
+class archiveSegment:
+    """
+    archiveSegment class.
+    The runs and query results of one archive file. Every string (nameservers,
+    queries, responses, tags, ...) is stored once in a dictionary and the
+    columns only hold the dictionary codes. Latencies are float32.
+    """
+
+    def encode(self, value):
+        """Return the dictionary code for the string value."""
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def addRun(self, myData):
+        """Add the gatherData json data of one run (or one streamed line)."""
+        run = len(self.columns['run.deviceUuid'])
+        self.columns['run.deviceUuid'].append(self.encode(myData.get('deviceUuid', '')))
+        self.columns['run.deviceTag'].append(self.encode(myData.get('deviceTag', '')))
+        self.columns['run.hostName'].append(self.encode(myData.get('hostName', '')))
+        self.columns['run.scriptUTCStartTime'].append(self.encode(myData.get('scriptUTCStartTime', '')))
+        self.columns['run.scriptUTCEndTime'].append(self.encode(myData.get('scriptUTCEndTime', '')))
+        self.columns['run.dataFormatVersion'].append(myData.get('dataFormatVersion', 0))
+        self.columns['run.streamRecord'].append(self.encode(myData.get('streamRecord', '')))
+
+        for nameserver, serverResults in myData.get('queryResults', {}).items():
+            nameserverCode = self.encode(nameserver)
+            for queryResult in serverResults:
+                queryType, queryName = list(queryResult['query'].items())[0]
+                self.columns['record.run'].append(run)
+                self.columns['record.nameserver'].append(nameserverCode)
+                self.columns['record.queryType'].append(self.encode(queryType))
+                self.columns['record.queryName'].append(self.encode(queryName))
+                self.columns['record.response'].append(self.encode('\n'.join(queryResult['response'])))
+                self.columns['record.responseStatus'].append(self.encode(queryResult.get('responseStatus', '')))
+                self.columns['record.responseTime'].append(float(queryResult['responseTime']))
+                self.columns['record.networkTime'].append(optionalTime(queryResult.get('networkTime')))
+                self.columns['record.processingTime'].append(optionalTime(queryResult.get('processingTime')))
+                self.columns['record.responseTTL'].append(queryResult.get('responseTTL', -1))
+                self.columns['record.handshakeTime'].append(optionalTime(queryResult.get('handshakeTime')))
+
+    def runs(self):
+        """Return the number of runs in the segment."""
+        return len(self.columns['run.deviceUuid'])
+
+    def records(self):
+        """Return the number of query results in the segment."""
+        return len(self.columns['record.run'])
+
+    def toBytes(self):
+        """Return the segment in the archive file format."""
+        stringBytes = [value.encode('utf-8') for value in self.strings]
+        columns = dict(self.columns)
+        columns['strings.length'] = array('I', (len(value) for value in stringBytes))
+
+        data = [archiveMagic, struct.pack('<HIII', archiveFormatVersion, self.runs(), self.records(), len(columns) + 1)]
+
+        for name, column in columns.items():
+            if sys.byteorder == 'big':
+                column = array(column.typecode, column)
+                column.byteswap()
+            data.append(self.columnBytes(name, column.typecode, column.tobytes()))
+
+        data.append(self.columnBytes('strings.data', 'B', b''.join(stringBytes)))
+
+        return b''.join(data)
+
+    @staticmethod
+    def columnBytes(name, typecode, rawBytes):
+        """Return a single compressed column."""
+        compressed = zlib.compress(rawBytes, 6)
+        nameBytes = name.encode('ascii')
+        return struct.pack('<B', len(nameBytes)) + nameBytes + typecode.encode('ascii') + struct.pack('<I', len(compressed)) + compressed
+
+    @classmethod
+    def fromBytes(cls, data):
+        """Load a segment from the archive file format."""
+        if data[:4] != archiveMagic:
+            raise ValueError('Not a DNS result archive file.')
+        formatVersion, _, _, columnCount = struct.unpack_from('<HIII', data, 4)
+        if formatVersion > archiveFormatVersion:
+            raise ValueError('Archive format version ' + str(formatVersion) + ' is not supported.')
+
+        offset = 18
+        columns = {}
+        stringData = b''
+        for _ in range(columnCount):
+            nameLength = data[offset]
+            name = data[offset + 1:offset + 1 + nameLength].decode('ascii')
+            typecode = chr(data[offset + 1 + nameLength])
+            offset += 2 + nameLength
+            compressedLength = struct.unpack_from('<I', data, offset)[0]
+            offset += 4
+            rawBytes = zlib.decompress(data[offset:offset + compressedLength])
+            offset += compressedLength
+
+            if name == 'strings.data':
+                stringData = rawBytes
+                continue
+
+            column = array(typecode)
+            column.frombytes(rawBytes)
+            if sys.byteorder == 'big':
+                column.byteswap()
+            columns[name] = column
+
+        segment = cls()
+        position = 0
+        for length in columns.pop('strings.length'):
+            segment.strings.append(stringData[position:position + length].decode('utf-8'))
+            position += length
+        segment.codes = {value: code for code, value in enumerate(segment.strings)}
+        segment.columns.update(columns)
+        return segment
+
+    def iterRuns(self):
+        """Return the runs as gatherData json data, in the order they were added."""
+        strings = self.strings
+        columns = self.columns
+        record = 0
+        recordCount = self.records()
+
+        for run in range(self.runs()):
+            myData = {
+                "deviceUuid": strings[columns['run.deviceUuid'][run]],
+                "deviceTag": strings[columns['run.deviceTag'][run]],
+                "hostName": strings[columns['run.hostName'][run]],
+                "scriptUTCStartTime": strings[columns['run.scriptUTCStartTime'][run]],
+                "scriptUTCEndTime": strings[columns['run.scriptUTCEndTime'][run]],
+                "dataFormatVersion": columns['run.dataFormatVersion'][run]
+            }
+            streamRecord = strings[columns['run.streamRecord'][run]]
+            if streamRecord:
+                myData["streamRecord"] = streamRecord
+
+            queryResults = {}
+            while record < recordCount and columns['record.run'][record] == run:
+                queryResults.setdefault(strings[columns['record.nameserver'][record]], []).append(self.queryResult(record))
+                record += 1
+
+            myData["queryResults"] = queryResults
+            yield myData
+
+    def queryResult(self, record):
+        """Return a single query result in the json layout."""
+        strings = self.strings
+        columns = self.columns
+
+        response = strings[columns['record.response'][record]]
+        queryResult = {
+            "query": {strings[columns['record.queryType'][record]]: strings[columns['record.queryName'][record]]},
+            "response": response.split('\n') if response else []
+        }
+
+        status = strings[columns['record.responseStatus'][record]]
+        if status:
+            queryResult["responseStatus"] = status
+
+        # The times are float32, rounded to a microsecond.
+        queryResult["responseTime"] = round(columns['record.responseTime'][record], 3)
+
+        networkTime = columns['record.networkTime'][record]
+        if not math.isnan(networkTime):
+            queryResult["networkTime"] = round(networkTime, 3)
+            queryResult["processingTime"] = round(columns['record.processingTime'][record], 3)
+
+        queryResult["responseTTL"] = columns['record.responseTTL'][record]
+
+        # Archives written before the handshake time was added do not have the column.
+        handshakeTimes = columns['record.handshakeTime']
+        if record < len(handshakeTimes) and not math.isnan(handshakeTimes[record]):
+            queryResult["handshakeTime"] = round(handshakeTimes[record], 3)
+        return queryResult
+
+    def __init__(self):
+        """Initialize an empty segment."""
+        self.strings = []
+        self.codes = {}
+        self.columns = {name: array(typecode) for name, typecode in runColumns + recordColumns}
+
+
+def writeSegment(segment, archiveDir, key):
+    """Write segment as a new file in the directory of partition key. Returns the file name."""
+    partitionDir = os.path.join(archiveDir, key)
+    os.makedirs(partitionDir, exist_ok=True)
+    fileName = os.path.join(partitionDir, 'part-' + str(time.time_ns()) + '-' + str(os.getpid()) + archiveExtension)
+
+    # Write to a temporary file first so readers never see a partial segment.
+    with open(fileName + '.tmp', 'wb') as archiveFile:
+        archiveFile.write(segment.toBytes())
+    os.replace(fileName + '.tmp', fileName)
+    return fileName
+
+
+def writeArchive(runs, archiveDir, partition='day'):
+    """
+    Write the gatherData json data in runs to archiveDir.
+    Every time partition gets a new segment file in its own directory, so
+    existing files are never rewritten. Returns the list of files written.
+    """
+    segments = {}
+    for myData in runs:
+        key = partitionKey(myData.get('scriptUTCStartTime', ''), partition)
+        segments.setdefault(key, archiveSegment()).addRun(myData)
+
+    return [writeSegment(segment, archiveDir, key) for key, segment in segments.items()]
+
+
+class archiveWriter:
+    """
+    archiveWriter class.
+    Adds the runs of a --daemon to the archive one at a time. The runs are
+    kept in a single segment until the time partition changes or batchSize
+    runs are in it, so a long history has a few large segments, each with one
+    string dictionary, instead of a small segment per run.
+    """
+
+    def addRun(self, myData):
+        """Add the gatherData json data of one run, writing the segment when it is complete."""
+        key = partitionKey(myData.get('scriptUTCStartTime', ''), self.partition)
+        if key != self.key:
+            self.flush()
+            self.key = key
+        self.segment.addRun(myData)
+        if self.segment.runs() >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        """Write the runs that were added as one segment. Returns the file name, None when there were no runs."""
+        if not self.segment.runs():
+            return None
+        fileName = writeSegment(self.segment, self.archiveDir, self.key)
+        self.segment = archiveSegment()
+        return fileName
+
+    def __init__(self, archiveDir, partition='day', batchSize=60):
+        """Initialize the class variables."""
+        self.archiveDir = archiveDir
+        self.partition = partition
+        self.batchSize = max(batchSize, 1)
+        self.key = None
+        self.segment = archiveSegment()
+
+
+def archiveFiles(archiveDir, start='', end=''):
+    """Return the segment files of archiveDir, optionally only the partitions between start and end."""
+    files = []
+    for partitionDir in sorted(glob.glob(os.path.join(archiveDir, '*'))):
+        key = os.path.basename(partitionDir)
+        if start and key < start[:len(key)]:
+            continue
+        if end and key > end[:len(key)]:
+            continue
+        files.extend(sorted(glob.glob(os.path.join(partitionDir, '*' + archiveExtension))))
+    return files
+
+
+def readArchive(archiveDir, start='', end=''):
+    """Return every run in archiveDir as gatherData json data, one segment file at a time."""
+    for fileName in archiveFiles(archiveDir, start, end):
+        with open(fileName, 'rb') as archiveFile:
+            segment = archiveSegment.fromBytes(archiveFile.read())
+        yield from segment.iterRuns()
+
+
+def readJsonFile(jsonFile):
+    """Return the json data from a json file or json lines file, one line at a time."""
+    with open(jsonFile, 'r', encoding='utf-8') as jf:
+        for jf_line in jf:
+            if jf_line.strip():
+                yield json.loads(jf_line)
+
+
+def exportJson(jsonFile, archiveDir, partition, batchSize=1000):
+    """Copy a json (lines) results file into the archive, batchSize runs per segment."""
+    batch = []
+    files = 0
+    runs = 0
+    for myData in readJsonFile(jsonFile):
+        batch.append(myData)
+        runs += 1
+        if len(batch) >= batchSize:
+            files += len(writeArchive(batch, archiveDir, partition))
+            batch = []
+    if batch:
+        files += len(writeArchive(batch, archiveDir, partition))
+    print('Archived ' + str(runs) + ' runs into ' + str(files) + ' files.')
+
+
+def importJson(archiveDir, jsonFile, start, end):
+    """Write the runs in the archive to a json lines file that json2excel can read."""
+    runs = 0
+    with open(jsonFile, 'w', encoding='utf-8') as outputFile:
+        for myData in readArchive(archiveDir, start, end):
+            outputFile.write(json.dumps(myData) + '\n')
+            runs += 1
+    print('Exported ' + str(runs) + ' runs.')
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Compact columnar archive for dns-resolution-test results')
+
+    parser.add_argument('action', choices=['export', 'import'],
+                        help='export: json file to archive. import: archive to json lines file.')
+
+    parser.add_argument('--jsonfile', default='output.json',
+                        help='json (lines) formatted results from dns-resolution-test script')
+
+    parser.add_argument('--archive', default='archive',
+                        help='archive directory')
+
+    parser.add_argument('--partition', default='day', choices=['day', 'hour'],
+                        help='time partition of the archive files when exporting. Default day.')
+
+    parser.add_argument('--start', default='',
+                        help='first partition to import, for example 2026-10-01')
+
+    parser.add_argument('--end', default='',
+                        help='last partition to import, for example 2026-10-31')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    if args.action == 'export':
+        if not os.path.exists(args.jsonfile):
+            print('json file does not exist!')
+            sys.exit(1)
+        exportJson(args.jsonfile, args.archive, args.partition)
+    else:
+        importJson(args.archive, args.jsonfile, args.start, args.end)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from queryEngine import queryRecord
+
+
+class resultSink:
+    """
+    resultSink class.
+    Appends the results to a json lines file while the queries are running,
+    instead of keeping everything in memory until the end of the run.
+
+    Every line has the same layout as the gatherData json data, with
+    queryResults holding either a single query result (granularity 'query')
+    or all the results of one nameserver (granularity 'nameserver'), so the
+    file can be read by json2excel and is usable even if the run is interrupted.
+    A nameserver is written once all its queries of the pass over the query
+    matrix (startPass) are done, and the incomplete ones at the end of the
+    pass (endPass). Lines are buffered up to bufferSize bytes or fsyncInterval
+    seconds, then written and synced to disk.
+    """
+
+    def add(self, server, queryResult):
+        """Add a completed query result for server."""
+        if self.granularity == 'query':
+            self.writeRecord({server: [queryResult]})
+            return
+
+        serverResults = self.pending.setdefault(server, [])
+        serverResults.append(queryResult)
+
+        # All the queries of this nameserver in the pass are done.
+        if self.queriesPerServer and len(serverResults) >= self.queriesPerServer:
+            self.writeRecord({server: serverResults})
+            del self.pending[server]
+
+    def startPass(self, queries):
+        """Start a pass over the query matrix, every nameserver is queried for queries."""
+        self.endPass()
+        if self.granularity == 'nameserver':
+            self.queriesPerServer = len(queries)
+
+    def endPass(self):
+        """Write the nameservers that are not complete at the end of a pass, for example after skipped or interrupted queries."""
+        for server in list(self.pending):
+            self.writeRecord({server: self.pending.pop(server)})
+        self.queriesPerServer = 0
+
+    def writeRecord(self, queryResults):
+        """Buffer a single json line."""
+        record = dict(self.header)
+        record["scriptUTCEndTime"] = str(datetime.utcnow())
+        record["streamRecord"] = self.granularity
+        record["queryResults"] = queryResults
+
+        line = json.dumps(record, default=queryRecord.toJson) + '\n'
+        self.buffer.append(line)
+        self.bufferedBytes += len(line)
+        self.records += 1
+
+        # A slow run still reaches the disk every fsyncInterval seconds.
+        if self.bufferedBytes >= self.bufferSize or time.monotonic() - self.lastSync >= self.fsyncInterval:
+            self.flush()
+
+    def flush(self, sync=False):
+        """Write the buffered lines to the file and sync it if the interval has passed."""
+        if self.buffer:
+            self.outputFile.write(''.join(self.buffer))
+            self.buffer = []
+            self.bufferedBytes = 0
+            self.outputFile.flush()
+
+        now = time.monotonic()
+        if sync or now - self.lastSync >= self.fsyncInterval:
+            os.fsync(self.outputFile.fileno())
+            self.lastSync = now
+
+    def close(self):
+        """Write any incomplete nameservers and close the file."""
+        if self.outputFile.closed:
+            return
+        self.endPass()
+        self.flush(sync=True)
+        self.outputFile.close()
+
+    def __enter__(self):
+        """Use the sink as a context manager so it is closed on errors and Ctrl-C."""
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        """Close the sink."""
+        self.close()
+
+    def __init__(self, fileName, header, granularity='query', bufferSize=1 << 20, fsyncInterval=5.0):
+        """
+        Open fileName in append mode.
+        header is the gatherData json data without queryResults.
+        """
+        if granularity not in ('query', 'nameserver'):
+            raise ValueError('granularity must be query or nameserver')
+        self.header = header
+        self.granularity = granularity
+        self.queriesPerServer = 0
+        self.bufferSize = bufferSize
+        self.fsyncInterval = fsyncInterval
+        self.buffer = []
+        self.bufferedBytes = 0
+        self.pending = {}
+        self.records = 0
+        self.lastSync = time.monotonic()
+        self.outputFile = open(fileName, 'a', encoding='utf-8')
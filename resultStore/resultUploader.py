@@ -0,0 +1,208 @@
+import glob
+import gzip
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+
+from queryEngine import queryRecord
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+spoolExtension = '.json.gz'
+
+
+class resultUploader:
+    """
+    resultUploader class.
+    Uploads the json data of the runs with a pooled keep-alive requests.Session,
+    an optional gzip or zstd compressed body, and retries with exponential
+    backoff and jitter on connection errors, 429 and 5xx responses.
+
+    With a spool directory every run is first written to the spool (gzip
+    compressed). Once batchSize runs are waiting, or the oldest run has waited
+    batchInterval seconds, the runs are sent oldest first in batches of up to
+    batchSize runs as one json lines POST, in a background thread with
+    background set (--daemon). Runs that could not be sent stay in the spool
+    for the next upload, and the oldest runs are dropped when the spool would
+    grow beyond maxSpoolBytes.
+    """
+
+    def compress(self, body):
+        """Return the body and the Content-Encoding for the compression setting."""
+        if self.compression == 'gzip':
+            return gzip.compress(body, 6), 'gzip'
+        if self.compression == 'zstd':
+            return self.zstdCompressor.compress(body), 'zstd'
+        return body, None
+
+    def post(self, body, contentType):
+        """
+        POST body with retries. Returns the response, or None when the upload failed
+        after all the retries. A 4xx response other than 429 is not retried.
+        """
+        data, encoding = self.compress(body)
+        headers = {'Content-Type': contentType}
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Exponential backoff with full jitter, so many agents do not retry at the same time.
+                time.sleep(random.uniform(0, min(self.backoffMax, self.backoffBase * 2 ** (attempt - 1))))
+
+            try:
+                response = self.session.post(self.url, data=data, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as err:
+                print('Upload to ' + self.url + ' failed: ' + str(err))
+                continue
+
+            if response.status_code < 300:
+                return response
+            if response.status_code != 429 and response.status_code < 500:
+                print('Upload to ' + self.url + ' was rejected: HTTP ' + str(response.status_code))
+                return None
+            print('Upload to ' + self.url + ' failed: HTTP ' + str(response.status_code))
+
+        return None
+
+    def spoolFiles(self):
+        """Return the spooled runs, oldest first."""
+        return sorted(glob.glob(os.path.join(self.spoolDir, '*' + spoolExtension)))
+
+    def spoolRun(self, myData):
+        """Write a run to the spool, dropping the oldest runs to stay within maxSpoolBytes."""
+        data = gzip.compress(json.dumps(myData, default=queryRecord.toJson).encode('utf-8'), 6)
+
+        # The background sender removes the runs it has sent.
+        with self.spoolLock:
+            spooled = self.spoolFiles()
+            spoolBytes = sum(os.path.getsize(fileName) for fileName in spooled)
+            while spooled and spoolBytes + len(data) > self.maxSpoolBytes:
+                oldest = spooled.pop(0)
+                spoolBytes -= os.path.getsize(oldest)
+                os.remove(oldest)
+                print('Upload spool is full, dropped ' + os.path.basename(oldest))
+
+            # The file name starts with the spool time, which sorts the runs oldest first.
+            fileName = os.path.join(self.spoolDir, str(time.time_ns()) + '-' + str(os.getpid()) + spoolExtension)
+            with open(fileName + '.tmp', 'wb') as spoolFile:
+                spoolFile.write(data)
+            os.replace(fileName + '.tmp', fileName)
+
+    def isDue(self):
+        """Check whether batchSize runs are waiting in the spool, or the oldest run has waited batchInterval seconds."""
+        spooled = self.spoolFiles()
+        if len(spooled) >= self.batchSize:
+            return True
+        return bool(spooled) and time.time_ns() - int(os.path.basename(spooled[0]).split('-')[0]) >= self.batchInterval * 1000000000
+
+    def sendSpool(self):
+        """Send the spooled runs in batches, oldest first. Returns the last response, None if nothing was sent."""
+        lastResponse = None
+
+        with open(os.path.join(self.spoolDir, 'spool.lock'), 'w') as lockFile:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Another process is sending the spool.
+                    return None
+
+            spooled = self.spoolFiles()
+            while spooled:
+                batch = spooled[:self.batchSize]
+                lines = []
+                with self.spoolLock:
+                    for fileName in batch:
+                        try:
+                            with gzip.open(fileName, 'rb') as spoolFile:
+                                lines.append(spoolFile.read().rstrip(b'\n'))
+                        except FileNotFoundError:
+                            # Dropped because the spool was full.
+                            pass
+                        except (OSError, EOFError):
+                            print('Dropped unreadable spool file ' + os.path.basename(fileName))
+                            os.remove(fileName)
+
+                if lines:
+                    response = self.post(b'\n'.join(lines) + b'\n', 'application/x-ndjson')
+                    if response is None:
+                        # Keep the runs for the next upload.
+                        break
+                    lastResponse = response
+
+                with self.spoolLock:
+                    for fileName in batch:
+                        if os.path.exists(fileName):
+                            os.remove(fileName)
+                spooled = self.spoolFiles()
+
+        return lastResponse
+
+    def upload(self, myData):
+        """
+        Upload the json data of a run. Returns the last response, None when nothing
+        was accepted, or when the run is spooled until the spool is due or sent in
+        the background.
+        """
+        if not self.spoolDir:
+            return self.post(json.dumps(myData, default=queryRecord.toJson).encode('utf-8'), 'application/json')
+
+        self.spoolRun(myData)
+        if not self.isDue():
+            return None
+        if not self.background:
+            return self.sendSpool()
+        # A sender that is still retrying also sends the new run.
+        if self.sender is None or not self.sender.is_alive():
+            self.sender = threading.Thread(target=self.sendSpool, name='resultUploader', daemon=True)
+            self.sender.start()
+        return None
+
+    def close(self):
+        """Wait for the background upload in progress. Runs that are not sent stay in the spool."""
+        if self.sender is not None:
+            self.sender.join()
+            self.sender = None
+
+    def __init__(self, url, spoolDir='', batchSize=10, compression='none', retries=5, maxSpoolBytes=100 << 20,
+                 backoffBase=1.0, backoffMax=60.0, timeout=30.0, batchInterval=0.0, background=False):
+        """
+        Initialize the session. compression is none, gzip or zstd (zstd needs the
+        zstandard package). Without spoolDir every run is sent on its own as json.
+        """
+        self.url = url
+        self.spoolDir = spoolDir
+        self.batchSize = max(batchSize, 1)
+        self.batchInterval = batchInterval
+        self.background = background
+        self.spoolLock = threading.Lock()
+        self.sender = None
+        self.compression = compression
+        self.retries = max(retries, 0)
+        self.maxSpoolBytes = maxSpoolBytes
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.timeout = timeout
+
+        if compression == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                print('zstandard is required for zstd compression. Install it with: pip install zstandard')
+                raise SystemExit(1)
+            self.zstdCompressor = zstandard.ZstdCompressor()
+
+        if spoolDir:
+            os.makedirs(spoolDir, exist_ok=True)
+
+        self.session = requests.Session()
+        self.session.mount(url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1))
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import time
+
+from queryEngine import queryRecord, responseParser
+
+
+checkpointVersion = 1
+
+
+def matrixFingerprint(nameservers, queries):
+    """
+    Return a fingerprint of the query matrix, so a checkpoint is only resumed by the same run.
+    The queries are hashed one at a time, the result is the sha1 of json.dumps([nameservers, queries]).
+    """
+    fingerprint = hashlib.sha1(('[' + json.dumps(nameservers, sort_keys=True) + ', [').encode('utf-8'))
+    separator = ''
+    for query in queries:
+        fingerprint.update((separator + json.dumps(query, sort_keys=True)).encode('utf-8'))
+        separator = ', '
+    fingerprint.update(b']]')
+    return fingerprint.hexdigest()
+
+
+class runCheckpoint:
+    """
+    runCheckpoint class.
+    Records every completed (nameserver, query) result in a json lines file, so an
+    interrupted run can be resumed. The first line is a header with the start time
+    of the original run and a fingerprint of the query matrix, every other line is
+    [nameserver, queryResult]. Lines are written in batches (at most flushInterval
+    seconds apart), a torn last line after a crash is ignored when loading.
+    """
+
+    def load(self):
+        """Read the completed results of an earlier, interrupted run from the checkpoint file."""
+        with open(self.fileName, 'r', encoding='utf-8') as checkpointFile:
+            header = None
+            for line in checkpointFile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+
+                if header is None:
+                    header = record
+                    if header.get('matrix') != self.fingerprint:
+                        raise ValueError('The checkpoint ' + self.fileName + ' is for different nameservers or queries.')
+                    self.scriptStartTime = header['scriptUTCStartTime']
+                    continue
+
+                server, queryResult = record
+                queryType, queryName = list(queryResult['query'].items())[0]
+                self.completed.setdefault((server, queryType.lower(), queryName.lower()), []).append(queryResult)
+                self.completedCount += 1
+
+    def takeCompleted(self, server, queryType, queryName):
+        """Return a completed result for the query against server and remove it, None when there is none."""
+        results = self.completed.get((server, queryType, queryName))
+        if not results:
+            return None
+        return results.pop(0)
+
+    def add(self, server, queryResult):
+        """Record a completed query result for server. Skipped queries are performed again when the run is resumed."""
+        if queryResult.get('responseStatus') == responseParser.statusSkipped:
+            return
+        self.buffer.append(json.dumps([server, queryResult], separators=(',', ':'), default=queryRecord.toJson) + '\n')
+        if time.monotonic() - self.lastFlush >= self.flushInterval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered lines to the file."""
+        if self.buffer:
+            self.checkpointFile.write(''.join(self.buffer))
+            self.checkpointFile.flush()
+            self.buffer = []
+        self.lastFlush = time.monotonic()
+
+    def close(self):
+        """Write the buffered lines and close the file. Called when the run ends, completed or not."""
+        if self.checkpointFile.closed:
+            return
+        self.flush()
+        self.checkpointFile.close()
+
+    def remove(self):
+        """Delete the checkpoint file once the results of the completed run have been written."""
+        self.close()
+        if os.path.exists(self.fileName):
+            os.remove(self.fileName)
+
+    def __init__(self, fileName, nameservers, queries, scriptStartTime, flushInterval=1.0):
+        """
+        Open the checkpoint fileName. If it exists, the completed results are loaded
+        and scriptStartTime is replaced by the start time of the original run.
+        """
+        self.fileName = fileName
+        self.fingerprint = matrixFingerprint(nameservers, queries)
+        self.scriptStartTime = scriptStartTime
+        self.flushInterval = flushInterval
+        self.completed = {}
+        self.completedCount = 0
+        self.buffer = []
+        self.lastFlush = time.monotonic()
+
+        resuming = os.path.exists(self.fileName) and os.path.getsize(self.fileName) > 0
+        if resuming:
+            self.load()
+
+        self.checkpointFile = open(self.fileName, 'a', encoding='utf-8')
+        if resuming:
+            # Start on a new line after a torn last line.
+            with open(self.fileName, 'rb') as existingFile:
+                existingFile.seek(-1, os.SEEK_END)
+                if existingFile.read(1) != b'\n':
+                    self.checkpointFile.write('\n')
+        else:
+            header = {"checkpointVersion": checkpointVersion, "scriptUTCStartTime": scriptStartTime, "matrix": self.fingerprint}
+            self.checkpointFile.write(json.dumps(header) + '\n')
+            self.checkpointFile.flush()
@@ -0,0 +1,545 @@
+# DNS stand-in server
+# A local UDP/TCP (and optionally DNS-over-TLS and DNS-over-HTTPS) DNS responder
+# for testing and benchmarking dns-resolution-test.py without real resolvers.
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import random
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+
+
+def loadZoneFile(zoneFile, defaultTtl=300):
+    """
+    Load the records from zoneFile into a dict of {(name, rdtype): rrset}.
+    Each line is 'name [ttl] [IN] type rdata', names are absolute and ';' starts a comment.
+    """
+    records = {}
+    with open(zoneFile, 'r', encoding='utf-8') as f_zone:
+        for lineNumber, line in enumerate(f_zone, start=1):
+            line = line.split(';', 1)[0].strip()
+            if not line:
+                continue
+
+            tokens = line.split()
+            name = dns.name.from_text(tokens[0])
+            position = 1
+            ttl = defaultTtl
+            if tokens[position].isdigit():
+                ttl = int(tokens[position])
+                position += 1
+            if tokens[position].upper() == 'IN':
+                position += 1
+
+            try:
+                rdtype = dns.rdatatype.from_text(tokens[position])
+                rdata = dns.rdata.from_text(dns.rdataclass.IN, rdtype, ' '.join(tokens[position + 1:]))
+            except (dns.exception.DNSException, IndexError) as err:
+                raise ValueError(zoneFile + ':' + str(lineNumber) + ': ' + str(err))
+
+            rrset = records.get((name, rdtype))
+            if rrset is None:
+                rrset = records[(name, rdtype)] = dns.rrset.RRset(name, dns.rdataclass.IN, rdtype)
+            rrset.add(rdata, ttl)
+
+    return records
+
+
+def synthesizeRrset(qname, rdtype, ttl):
+    """Create a made up, but always the same, record for any name. Used with --synthesize."""
+    digest = hashlib.sha1(qname.to_text().encode('utf-8')).digest()
+    name = qname.to_text()
+
+    if rdtype == dns.rdatatype.A:
+        text = '198.51.100.' + str(digest[0] % 254 + 1)
+    elif rdtype == dns.rdatatype.AAAA:
+        text = '2001:db8::' + digest[:2].hex()
+    elif rdtype == dns.rdatatype.MX:
+        text = '10 mail.' + name
+    elif rdtype == dns.rdatatype.NS:
+        text = 'ns1.' + name
+    elif rdtype == dns.rdatatype.CNAME:
+        text = 'alias.' + name
+    elif rdtype == dns.rdatatype.SOA:
+        text = 'ns1.' + name + ' hostmaster.' + name + ' 1 900 900 1800 60'
+    elif rdtype == dns.rdatatype.PTR:
+        text = 'host-' + digest[:4].hex() + '.example.'
+    elif rdtype == dns.rdatatype.TXT:
+        text = '"stand-in"'
+    else:
+        return None
+
+    return dns.rrset.from_text(qname, ttl, dns.rdataclass.IN, rdtype, text)
+
+
+def makeSelfSignedCertificate(certFile, keyFile, hostname='localhost'):
+    """
+    Create a self-signed certificate for hostname, 127.0.0.1 and ::1 with the openssl
+    command, for the DoT and DoH listeners. Clients trust it with --tlsCaFile certFile.
+    """
+    try:
+        subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30',
+                        '-keyout', keyFile, '-out', certFile, '-subj', '/CN=' + hostname,
+                        '-addext', 'subjectAltName=DNS:' + hostname + ',IP:127.0.0.1,IP:::1'],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        print('Unable to create a self-signed certificate, the openssl command is required. Use --certFile and --keyFile instead.')
+        sys.exit(1)
+
+
+class standInConfig:
+    """
+    standInConfig class.
+    The behaviour of the stand-in server. Latency and jitter are in milliseconds,
+    the rates are fractions of the queries (0.0 - 1.0).
+    With a recursionLatency the server acts like a caching resolver: the first
+    query for a name costs the recursionLatency (in milliseconds) on top of the
+    latency, later queries are answered from the cache with the remaining TTL.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, nxdomain=0.0, servfail=0.0, synthesize=False, ttl=300, seed=None,
+                 recursionLatency=0.0):
+        """Initialize the settings."""
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.nxdomain = nxdomain
+        self.servfail = servfail
+        self.synthesize = synthesize
+        self.ttl = ttl
+        self.seed = seed
+        self.recursionLatency = recursionLatency
+
+
+class udpProtocol(asyncio.DatagramProtocol):
+    """udpProtocol class. Receives the UDP queries for dnsStandIn."""
+
+    def connection_made(self, transport):
+        """Keep the transport to send the responses."""
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        """Answer a query, after the configured delay."""
+        responseWire, delay = self.server.handle(data, 512)
+        if responseWire is None:
+            return
+        if delay > 0:
+            self.server.loop.call_later(delay, self.transport.sendto, responseWire, addr)
+        else:
+            self.transport.sendto(responseWire, addr)
+
+    def __init__(self, server):
+        """Initialize the protocol."""
+        super().__init__()
+        self.server = server
+        self.transport = None
+
+
+class dnsStandIn:
+    """
+    dnsStandIn class.
+    A local DNS responder that answers from a zone file (and optionally
+    synthesized records for any other name) over UDP and TCP, with artificial
+    latency, jitter, loss, NXDOMAIN and SERVFAIL rates.
+    Can run in the foreground (serveForever) or in a background thread (start/stop).
+    """
+
+    def lookup(self, request):
+        """Build the response message for request."""
+        response = dns.message.make_response(request)
+        response.flags |= dns.flags.AA
+
+        if len(request.question) != 1:
+            response.set_rcode(dns.rcode.FORMERR)
+            return response
+
+        question = request.question[0]
+        qname = question.name
+        rdtype = question.rdtype
+
+        # Follow CNAMEs inside the zone data.
+        for _ in range(8):
+            rrset = self.records.get((qname, rdtype))
+            if rrset is not None:
+                response.answer.append(rrset)
+                return response
+
+            cname = self.records.get((qname, dns.rdatatype.CNAME))
+            if cname is None or rdtype == dns.rdatatype.CNAME:
+                break
+            response.answer.append(cname)
+            qname = cname[0].target
+
+        if response.answer:
+            return response
+
+        if qname in self.names:
+            # The name exists, but not with this type (NoAnswer).
+            return response
+
+        if self.config.synthesize:
+            rrset = synthesizeRrset(qname, rdtype, self.config.ttl)
+            if rrset is not None:
+                response.answer.append(rrset)
+            return response
+
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        return response
+
+    def handle(self, data, maxSize):
+        """
+        Handle a query in wire format. Returns (responseWire, delaySeconds),
+        responseWire is None when the query is dropped.
+        """
+        try:
+            request = dns.message.from_wire(data)
+        except dns.exception.DNSException:
+            return None, 0
+
+        self.queries += 1
+        config = self.config
+        chance = self.random.random()
+
+        if chance < config.loss:
+            self.dropped += 1
+            return None, 0
+        chance -= config.loss
+
+        if chance < config.servfail:
+            response = dns.message.make_response(request)
+            response.set_rcode(dns.rcode.SERVFAIL)
+        elif chance - config.servfail < config.nxdomain:
+            response = dns.message.make_response(request)
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        else:
+            response = self.lookup(request)
+
+        delay = config.latency
+        if config.jitter:
+            delay += self.random.uniform(-config.jitter, config.jitter)
+        if config.recursionLatency:
+            delay += self.cacheLookup(request, response)
+
+        try:
+            responseWire = response.to_wire(max_size=maxSize)
+        except dns.exception.TooBig:
+            # Too large for UDP: an empty truncated response, so the client retries over TCP.
+            response.answer = []
+            response.authority = []
+            response.additional = []
+            response.flags |= dns.flags.TC
+            responseWire = response.to_wire(max_size=maxSize)
+
+        return responseWire, max(delay, 0) / 1000
+
+    def cacheLookup(self, request, response):
+        """
+        Simulate the cache of a resolver for --recursionLatency. Returns the extra
+        delay in milliseconds and counts the TTLs of a cached answer down.
+        """
+        if len(request.question) != 1:
+            return 0
+        question = request.question[0]
+        key = (question.name, question.rdtype)
+        now = time.monotonic()
+        expiry = self.cache.get(key)
+
+        if expiry is None or expiry <= now:
+            ttls = [rrset.ttl for rrset in response.answer]
+            self.cache[key] = now + (min(ttls) if ttls else self.config.ttl)
+            return self.config.recursionLatency
+
+        remaining = int(expiry - now)
+        response.answer = [dns.rrset.from_rdata_list(rrset.name, min(rrset.ttl, remaining), list(rrset)) for rrset in response.answer]
+        return 0
+
+    async def tcpConnection(self, reader, writer):
+        """Answer every query on a TCP connection. Responses may be sent out of order (pipelining)."""
+        lock = asyncio.Lock()
+
+        async def respond(data):
+            responseWire, delay = self.handle(data, 65535)
+            if responseWire is None:
+                return
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with lock:
+                writer.write(struct.pack('!H', len(responseWire)) + responseWire)
+                await writer.drain()
+
+        tasks = set()
+        try:
+            while True:
+                lengthBytes = await reader.readexactly(2)
+                data = await reader.readexactly(struct.unpack('!H', lengthBytes)[0])
+                task = asyncio.ensure_future(respond(data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def httpResponse(self, writer, status, body=b'', contentType='application/dns-message'):
+        """Write an HTTP/1.1 response with a keep-alive connection."""
+        header = ('HTTP/1.1 ' + status + '\r\n'
+                  'Content-Type: ' + contentType + '\r\n'
+                  'Content-Length: ' + str(len(body)) + '\r\n'
+                  'Cache-Control: max-age=0\r\n\r\n')
+        writer.write(header.encode('ascii') + body)
+        await writer.drain()
+
+    async def dohConnection(self, reader, writer):
+        """Answer the DNS-over-HTTPS (RFC 8484) GET and POST requests on a connection, in order."""
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                method, target = requestLine.decode('latin-1').split(' ')[:2]
+                path, _, queryString = target.partition('?')
+                data = b''
+                if method == 'POST':
+                    data = await reader.readexactly(int(headers.get('content-length', '0')))
+                elif method == 'GET':
+                    for parameter in queryString.split('&'):
+                        if parameter.startswith('dns='):
+                            encoded = parameter[4:]
+                            data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+
+                if path != self.dohPath:
+                    await self.httpResponse(writer, '404 Not Found', b'not found', 'text/plain')
+                    continue
+                if not data:
+                    await self.httpResponse(writer, '400 Bad Request', b'no dns message', 'text/plain')
+                    continue
+
+                responseWire, delay = self.handle(data, 65535)
+                if responseWire is None:
+                    # A lost query: HTTP/1.1 answers in order, so nothing more is answered on this connection.
+                    await reader.read()
+                    break
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.httpResponse(writer, '200 OK', responseWire)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def startServers(self):
+        """
+        Start listening on UDP and TCP. Port 0 picks a free port, which is the same for both.
+        The DoT and DoH listeners are started when their port is not None.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.tcpServer = await asyncio.start_server(self.tcpConnection, self.address, self.port, reuse_address=True)
+        self.port = self.tcpServer.sockets[0].getsockname()[1]
+        self.udpTransport, _ = await self.loop.create_datagram_endpoint(lambda: udpProtocol(self), local_addr=(self.address, self.port))
+
+        if self.dotPort is not None:
+            self.dotServer = await asyncio.start_server(self.tcpConnection, self.address, self.dotPort, ssl=self.sslContext, reuse_address=True)
+            self.dotPort = self.dotServer.sockets[0].getsockname()[1]
+
+        if self.dohPort is not None:
+            self.dohServer = await asyncio.start_server(self.dohConnection, self.address, self.dohPort, ssl=self.sslContext, reuse_address=True)
+            self.dohPort = self.dohServer.sockets[0].getsockname()[1]
+
+    async def stopServers(self):
+        """Stop listening."""
+        self.udpTransport.close()
+        for server in (self.tcpServer, self.dotServer, self.dohServer):
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+
+    def nameserver(self, transport='udp'):
+        """Return the nameserver entry of this server for transport (udp, tcp, dot or doh), for the nameservers file."""
+        port = {'dot': self.dotPort, 'doh': self.dohPort}.get(transport, self.port)
+        if ':' in self.address:
+            return '[' + self.address + ']:' + str(port)
+        return self.address + ':' + str(port)
+
+    def start(self):
+        """Run the server in a background thread. Returns once it is listening."""
+        ready = threading.Event()
+
+        def run():
+            """Event loop of the background thread."""
+            self.loop = asyncio.new_event_loop()
+            self.loop.run_until_complete(self.startServers())
+            ready.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.stopServers())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        """Stop the background thread started by start."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def serveForever(self):
+        """Run the server in the foreground until interrupted."""
+        async def run():
+            """Start the servers and wait forever."""
+            await self.startServers()
+            print('DNS stand-in listening on ' + self.nameserver() + ' (UDP and TCP)')
+            if self.dotPort is not None:
+                print('DNS-over-TLS on ' + self.nameserver('dot'))
+            if self.dohPort is not None:
+                print('DNS-over-HTTPS on ' + self.nameserver('doh') + ', path ' + self.dohPath)
+            await asyncio.Event().wait()
+
+        asyncio.run(run())
+
+    def __init__(self, zoneFile=None, config=None, address='127.0.0.1', port=0, dotPort=None, dohPort=None,
+                 certFile='', keyFile='', dohPath='/dns-query'):
+        """
+        Load the zone data. zoneFile None means no records (use config.synthesize).
+        dotPort and dohPort start the DNS-over-TLS and DNS-over-HTTPS listeners
+        (0 picks a free port) with the certificate in certFile and keyFile.
+        """
+        self.config = config or standInConfig()
+        self.records = loadZoneFile(zoneFile, self.config.ttl) if zoneFile else {}
+        self.names = {name for name, _ in self.records}
+        self.address = address
+        self.port = port
+        self.random = random.Random(self.config.seed)
+        self.queries = 0
+        self.dropped = 0
+        self.cache = {}
+        self.loop = None
+        self.thread = None
+        self.tcpServer = None
+        self.udpTransport = None
+        self.dotPort = dotPort
+        self.dohPort = dohPort
+        self.dohPath = dohPath
+        self.dotServer = None
+        self.dohServer = None
+        self.sslContext = None
+
+        if dotPort is not None or dohPort is not None:
+            self.sslContext = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.sslContext.load_cert_chain(certFile, keyFile)
+            self.sslContext.set_alpn_protocols(['dot', 'http/1.1'])
+
+
+def parseArguments():
+    """parseArguments definition."""
+    parser = argparse.ArgumentParser(description='Local DNS stand-in server for dns-resolution-test')
+
+    parser.add_argument('--zone', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standIn.zone'),
+                        help='zone file with the records to answer. Default standIn/standIn.zone')
+
+    parser.add_argument('--address', default='127.0.0.1',
+                        help='address to listen on. Default 127.0.0.1')
+
+    parser.add_argument('--port', type=int, default=5300,
+                        help='UDP and TCP port to listen on. Default 5300')
+
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='artificial latency in milliseconds')
+
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='random jitter (+/-) in milliseconds added to the latency')
+
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='fraction of queries that are dropped (0.0 - 1.0)')
+
+    parser.add_argument('--nxdomain', type=float, default=0.0,
+                        help='fraction of queries answered with NXDOMAIN (0.0 - 1.0)')
+
+    parser.add_argument('--servfail', type=float, default=0.0,
+                        help='fraction of queries answered with SERVFAIL (0.0 - 1.0)')
+
+    parser.add_argument('--synthesize', action='store_true',
+                        help='answer names that are not in the zone file with made up records')
+
+    parser.add_argument('--ttl', type=int, default=300,
+                        help='TTL of records without a TTL in the zone file and of synthesized records. Default 300')
+
+    parser.add_argument('--recursionLatency', type=float, default=0.0,
+                        help='act like a caching resolver: first queries for a name take this many milliseconds longer, later ones get the remaining TTL')
+
+    parser.add_argument('--dotPort', type=int, default=None,
+                        help='also answer DNS-over-TLS on this port')
+
+    parser.add_argument('--dohPort', type=int, default=None,
+                        help='also answer DNS-over-HTTPS on this port')
+
+    parser.add_argument('--dohPath', default='/dns-query',
+                        help='URL path of the DNS-over-HTTPS requests. Default /dns-query')
+
+    parser.add_argument('--certFile', default='',
+                        help='TLS certificate for --dotPort and --dohPort. Default: a new self-signed certificate')
+
+    parser.add_argument('--keyFile', default='',
+                        help='private key of --certFile')
+
+    global args
+    args = parser.parse_args()
+
+
+def main():
+    """Main definition."""
+    parseArguments()
+
+    config = standInConfig(args.latency, args.jitter, args.loss, args.nxdomain, args.servfail, args.synthesize, args.ttl,
+                           recursionLatency=args.recursionLatency)
+
+    certFile = args.certFile
+    keyFile = args.keyFile
+    if (args.dotPort is not None or args.dohPort is not None) and not certFile:
+        certDir = tempfile.mkdtemp(prefix='dnsStandIn-')
+        certFile = os.path.join(certDir, 'standIn.crt')
+        keyFile = os.path.join(certDir, 'standIn.key')
+        makeSelfSignedCertificate(certFile, keyFile)
+        print('Self-signed certificate (use with --tlsCaFile): ' + certFile)
+
+    dnsStandIn(args.zone, config, args.address, args.port, args.dotPort, args.dohPort, certFile, keyFile, args.dohPath).serveForever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+
+    except KeyboardInterrupt:
+        print('Interrupted')
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
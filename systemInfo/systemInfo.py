@@ -1,10 +1,15 @@
 import socket
 import os.path
 from os import path
+from functools import cached_property
 
 
 class systemInfo:
-    """systemInfo class."""
+    """
+    systemInfo class.
+    hostname, uuid and deviceTag are only read when they are first used, and
+    then kept.
+    """
 
     uuidFilename = 'uuid.cfg'
     tagFilename = 'tag.cfg'
@@ -34,8 +39,17 @@ class systemInfo:
 
         return myTag
 
-    def __init__(self):
-        """Initialize all the variables."""
-        self.hostname = self.getHostname()
-        self.uuid = self.getUuid()
-        self.deviceTag = self.getTag()
+    @cached_property
+    def hostname(self):
+        """The hostname, looked up on first use."""
+        return self.getHostname()
+
+    @cached_property
+    def uuid(self):
+        """The uuid from uuid.cfg, read on first use."""
+        return self.getUuid()
+
+    @cached_property
+    def deviceTag(self):
+        """The tag from tag.cfg, read on first use."""
+        return self.getTag()
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+# The packages are imported from the repository directory, as by the scripts.
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repoDir not in sys.path:
+    sys.path.insert(0, repoDir)
+
+from standIn import dnsStandIn  # noqa: E402
+
+
+@pytest.fixture
+def startStandIn():
+    """
+    Return a function that starts a stand-in on a free port, with the standInConfig
+    arguments, on address, optionally with a zone file and DoT and DoH listeners.
+    They are stopped after the test.
+    """
+    servers = []
+
+    def start(zoneFile=None, address='127.0.0.1', dotPort=None, dohPort=None, certFile='', keyFile='', **config):
+        config.setdefault('synthesize', True)
+        config.setdefault('seed', 1)
+        server = dnsStandIn.dnsStandIn(zoneFile, dnsStandIn.standInConfig(**config), address, dotPort=dotPort, dohPort=dohPort,
+                                       certFile=certFile, keyFile=keyFile).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture(scope='session')
+def certificate(tmp_path_factory):
+    """A self-signed (certFile, keyFile) for localhost, 127.0.0.1 and ::1."""
+    certDir = tmp_path_factory.mktemp('certificate')
+    certFile, keyFile = str(certDir / 'standIn.crt'), str(certDir / 'standIn.key')
+    dnsStandIn.makeSelfSignedCertificate(certFile, keyFile)
+    return certFile, keyFile
+
+
+@pytest.fixture
+def standIn(startStandIn):
+    """A stand-in that answers every name with synthesized records."""
+    return startStandIn()
+
+
+def makeRun(startTime, queryResults, deviceUuid='test-device', deviceTag='test'):
+    """Return the json data of a run with queryResults {server: [(queryType, queryName, responseTime, status), ...]}."""
+    return {
+        "deviceUuid": deviceUuid,
+        "deviceTag": deviceTag,
+        "hostName": "test-host",
+        "scriptUTCStartTime": startTime,
+        "scriptUTCEndTime": startTime,
+        "dataFormatVersion": 7,
+        "queryResults": {
+            server: [{"query": {queryType: queryName}, "response": ["192.0.2.1"], "responseStatus": status, "responseTime": responseTime,
+                      "networkTime": responseTime, "processingTime": 0.0, "responseTTL": 300}
+                     for queryType, queryName, responseTime, status in results]
+            for server, results in queryResults.items()
+        }
+    }
@@ -0,0 +1,80 @@
+import dns.resolver
+import pytest
+
+from queryEngine import connectionPool, responseParser, timedQuery, transportEngine
+
+
+@pytest.fixture
+def tlsStandIn(startStandIn, certificate):
+    """A stand-in with DoT and DoH listeners using the self-signed certificate."""
+    return startStandIn(dotPort=0, dohPort=0, certFile=certificate[0], keyFile=certificate[1])
+
+
+def resolve(pool, server):
+    """Resolve a name over pool and return the addresses."""
+    timer = timedQuery.queryTimer()
+    answer = pool.resolve(server, 'a', 'example.com', timer)
+    timer.stop()
+    pool.recordQuery(server, timer)
+    return [record.address for record in answer]
+
+
+@pytest.mark.parametrize('transport', ['tcp', 'dot', 'doh'])
+def test_connectionReuse(tlsStandIn, certificate, transport):
+    pool = connectionPool.connectionPool(transport, tlsCaFile=certificate[0])
+    server = tlsStandIn.nameserver('udp' if transport == 'tcp' else transport)
+    for _ in range(5):
+        assert resolve(pool, server)
+    pool.close()
+
+    results = pool.transportResults()['nameservers'][server]
+    assert len(results['connections']) == 1
+    assert results['newConnectionQueries'] == 1
+    assert results['reusedConnectionQueries'] == 4
+
+
+@pytest.mark.parametrize('transport', ['dot', 'doh'])
+def test_tlsHostname(tlsStandIn, certificate, transport):
+    pool = connectionPool.connectionPool(transport, tlsHostname='localhost', tlsCaFile=certificate[0])
+    assert resolve(pool, tlsStandIn.nameserver(transport))
+    pool.close()
+
+
+@pytest.mark.parametrize('transport', ['dot', 'doh'])
+def test_tlsHostnameMismatch(tlsStandIn, certificate, transport):
+    pool = connectionPool.connectionPool(transport, tlsHostname='dns.example.net', tlsCaFile=certificate[0])
+    with pytest.raises(dns.resolver.NoNameservers, match='certificate verify failed'):
+        resolve(pool, tlsStandIn.nameserver(transport))
+    pool.close()
+
+
+@pytest.mark.parametrize('transport', ['dot', 'doh'])
+def test_tlsAddressMismatch(startStandIn, certificate, transport):
+    # The certificate is only valid for 127.0.0.1 and ::1.
+    tlsStandIn = startStandIn(address='127.0.0.2', dotPort=0, dohPort=0, certFile=certificate[0], keyFile=certificate[1])
+    pool = connectionPool.connectionPool(transport, tlsCaFile=certificate[0])
+    with pytest.raises(dns.resolver.NoNameservers, match='certificate verify failed'):
+        resolve(pool, tlsStandIn.nameserver(transport))
+    pool.close()
+
+
+def test_tlsUntrusted(tlsStandIn):
+    pool = connectionPool.connectionPool('dot')
+    with pytest.raises(dns.resolver.NoNameservers, match='certificate verify failed'):
+        resolve(pool, tlsStandIn.nameserver('dot'))
+    pool.close()
+
+
+def test_tlsInsecure(tlsStandIn):
+    pool = connectionPool.connectionPool('dot', tlsHostname='dns.example.net', tlsInsecure=True)
+    assert resolve(pool, tlsStandIn.nameserver('dot'))
+    pool.close()
+
+
+def test_transportEnginePipeline(tlsStandIn, certificate):
+    server = tlsStandIn.nameserver('dot')
+    queries = [{'a': 'host' + str(index) + '.example.com'} for index in range(20)]
+    pool = connectionPool.connectionPool('dot', tlsCaFile=certificate[0])
+    results = transportEngine.transportEngine([server], queries, pool, pipeline=5).performQueries()
+    pool.close()
+    assert [result['responseStatus'] for result in results[server]] == [responseParser.statusOk] * 20
@@ -0,0 +1,115 @@
+import gzip
+import json
+import sqlite3
+import zlib
+
+import pytest
+import requests
+
+from conftest import makeRun
+from resultStore import ingestServer
+
+
+@pytest.fixture
+def database(tmp_path):
+    """An empty result database."""
+    database = ingestServer.resultDatabase(str(tmp_path / 'results.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def server(database):
+    """An ingestion server with a 64 KB body limit (640 KB decoded)."""
+    server = ingestServer.ingestServer(database, port=0, maxBodyBytes=64 << 10).start()
+    yield server
+    server.stop()
+
+
+def test_decodeBodyRoundTrip():
+    body = json.dumps({"a": list(range(1000))}).encode('utf-8')
+    assert ingestServer.decodeBody(gzip.compress(body), 'gzip', len(body)) == body
+    assert ingestServer.decodeBody(zlib.compress(body), 'deflate', len(body)) == body
+    assert ingestServer.decodeBody(gzip.compress(body[:10]) + gzip.compress(body[10:]), 'gzip', len(body)) == body
+    assert ingestServer.decodeBody(body, None, len(body)) == body
+
+
+def test_decodeBodyStopsAtTheLimit():
+    # 256 MB of zeros compresses to about 250 KB, only the first MB is ever decompressed.
+    bomb = gzip.compress(bytes(256 << 20), 9)
+    assert ingestServer.decodeBody(bomb, 'gzip', 1 << 20) is None
+    assert ingestServer.decodeBody(zlib.compress(bytes(4 << 20)), 'deflate', 1 << 20) is None
+    assert ingestServer.decodeBody(bytes(100), 'identity', 99) is None
+
+
+def test_decodeBodyErrors():
+    with pytest.raises(ValueError):
+        ingestServer.decodeBody(gzip.compress(b'{"a": 1}')[:-6], 'gzip', 1000)
+    with pytest.raises(ValueError):
+        ingestServer.decodeBody(b'not deflate', 'deflate', 1000)
+    with pytest.raises(ValueError):
+        ingestServer.decodeBody(b'{}', 'br', 1000)
+
+
+def test_compressedBombIsRejected(server):
+    bomb = gzip.compress(bytes(8 << 20), 9)
+    assert len(bomb) < 64 << 10
+    response = requests.post('http://127.0.0.1:' + str(server.port) + '/ingest', data=bomb,
+                             headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    assert response.status_code == 413
+
+
+def test_ingestAndDuplicates(server, database):
+    run = makeRun('2026-10-18 10:00:00', {'192.0.2.53': [('a', 'example.com', 10.0, 'NOERROR')]})
+    url = 'http://127.0.0.1:' + str(server.port) + '/ingest'
+    body = gzip.compress(json.dumps(run).encode('utf-8'))
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+
+    assert requests.post(url, data=body, headers=headers).json() == {"runs": 1, "duplicates": 0, "results": 1}
+    assert requests.post(url, data=body, headers=headers).json() == {"runs": 0, "duplicates": 1, "results": 0}
+    assert database.status()['results'] == 1
+
+
+def test_lockedDatabase(server, database, tmp_path):
+    run = makeRun('2026-10-18 10:00:00', {'192.0.2.53': [('a', 'example.com', 10.0, 'NOERROR')]})
+    url = 'http://127.0.0.1:' + str(server.port) + '/ingest'
+    database.connection.execute('PRAGMA busy_timeout = 0')
+    other = sqlite3.connect(str(tmp_path / 'results.db'), isolation_level=None)
+    other.execute('BEGIN EXCLUSIVE')
+
+    # A server error, which the uploader retries.
+    response = requests.post(url, json=run)
+    assert response.status_code == 503
+    assert 'locked' in response.json()['error']
+
+    other.execute('ROLLBACK')
+    other.close()
+    assert requests.post(url, json=run).json() == {"runs": 1, "duplicates": 0, "results": 1}
+
+
+def test_rollupPercentiles(database):
+    first = [('a', 'name' + str(index) + '.example', float(index), 'NOERROR') for index in range(1, 101)]
+    second = [('a', 'lost.example', 2000.0, 'TIMEOUT'), ('mx', 'example.com', 5.0, 'SERVFAIL')]
+    database.ingest([makeRun('2026-10-18 10:05:00', {'192.0.2.53': first}),
+                     makeRun('2026-10-18 10:40:00', {'192.0.2.53': second, '198.51.100.53': first[:10]})])
+    start = ingestServer.parseTime('2026-10-18 10:00:00')
+
+    entries = database.percentiles(start, start + 3600, {'nameserver': '192.0.2.53'})
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry['samples'] == 101
+    assert entry['lost'] == 1
+    assert entry['errors'] == 1
+    assert entry['min'] == 1.0
+    assert entry['max'] == 100.0
+    # The rollups keep the latency within the 2% bucket precision.
+    assert entry['p50'] == pytest.approx(50, rel=0.02)
+    assert entry['p99'] == pytest.approx(99, rel=0.02)
+
+    byType = {entry['recordType']: entry for entry in database.percentiles(start, start + 3600, {}, ['recordType'])}
+    assert byType['a']['samples'] == 110
+    assert byType['mx']['errors'] == 1
+
+    # A range of whole days is read from the daily rollups.
+    day = ingestServer.parseTime('2026-10-18')
+    assert database.percentiles(day, day + 86400, {})[0]['samples'] == 111
@@ -0,0 +1,132 @@
+import asyncio
+import socket
+
+import dns.resolver
+import pytest
+
+from queryEngine import loadGenerator, rawEngine, responseParser, timedQuery
+
+
+# Sending to the broadcast address without SO_BROADCAST fails with EACCES.
+unreachable = '255.255.255.255'
+
+
+def test_resolve(standIn):
+    timer = timedQuery.queryTimer()
+    answer = timedQuery.resolve(standIn.nameserver('udp'), 'a', 'example.com', timer)
+    timer.stop()
+    assert [record.address for record in answer]
+    assert timer.networkMs() > 0
+
+
+def test_resolveSendError():
+    with pytest.raises(dns.resolver.NoNameservers):
+        timedQuery.resolve(unreachable, 'a', 'example.com', timedQuery.queryTimer())
+
+
+def test_resolveAsyncSendError():
+    with pytest.raises(dns.resolver.NoNameservers):
+        asyncio.run(timedQuery.resolveAsync(unreachable, 'a', 'example.com', timedQuery.queryTimer()))
+
+
+def test_rawEngine(standIn):
+    queries = [{'a': 'host' + str(index) + '.example.com'} for index in range(50)]
+    results = rawEngine.rawEngine([standIn.nameserver('udp')], queries).performQueries()
+    statuses = [result['responseStatus'] for result in results[standIn.nameserver('udp')]]
+    assert statuses == [responseParser.statusOk] * 50
+
+
+def test_rawEngineConnectError():
+    queries = [{'a': 'example.com'}, {'aaaa': 'example.com'}]
+    results = rawEngine.rawEngine([unreachable], queries).performQueries()
+    assert [result['responseStatus'] for result in results[unreachable]] == [responseParser.statusError] * 2
+
+
+@pytest.mark.parametrize('engine', ['resolve', 'raw'])
+def test_servfailStatus(startStandIn, engine):
+    server = startStandIn(servfail=1.0).nameserver('udp')
+    if engine == 'raw':
+        result = rawEngine.rawEngine([server], [{'a': 'example.com'}]).performQueries()[server][0]
+        assert result['responseStatus'] == responseParser.statusServfail
+        return
+    with pytest.raises(dns.resolver.NoNameservers) as error:
+        timedQuery.resolve(server, 'a', 'example.com', timedQuery.queryTimer())
+    assert responseParser.queryErrorStatus(error.value) == responseParser.statusServfail
+
+
+def test_sendErrorStatus():
+    with pytest.raises(dns.resolver.NoNameservers) as error:
+        timedQuery.resolve(unreachable, 'a', 'example.com', timedQuery.queryTimer())
+    assert responseParser.queryErrorStatus(error.value) == responseParser.statusError
+
+
+def test_loadGeneratorConnectError():
+    generator = loadGenerator.loadGenerator([unreachable], [{'a': 'example.com'}], [100], stepDuration=0.2, timeout=0.2)
+    step = generator.run()['nameservers'][unreachable][0]
+    assert step['sent'] == 0
+    assert step['sendErrors'] == 20
+
+
+def test_parseRamp():
+    assert loadGenerator.parseRamp('100:300:100') == [100.0, 200.0, 300.0]
+    assert loadGenerator.parseRamp('50,200,1000') == [50.0, 200.0, 1000.0]
+
+
+@pytest.mark.parametrize('ramp', ['0,100', '100,-5', ',', '100:50:10', '0:100:10', '100:200:0', '100:200', 'fast'])
+def test_parseRampInvalid(ramp):
+    with pytest.raises(ValueError):
+        loadGenerator.parseRamp(ramp)
+
+
+def test_loadGeneratorNoQueries():
+    with pytest.raises(ValueError):
+        loadGenerator.loadGenerator(['127.0.0.1'], [{'nosuchtype': 'example.com'}], [100])
+
+
+def test_loadGenerator(standIn):
+    server = standIn.nameserver('udp')
+    generator = loadGenerator.loadGenerator([server], [{'a': 'example.com'}], [200], stepDuration=0.5, timeout=0.5)
+    step = generator.run()['nameservers'][server][0]
+    assert step['sent'] == 100
+    assert step['responses'] == 100
+    assert step['timeouts'] == step['sendErrors'] == 0
+    assert step['achievedQps'] == pytest.approx(200, rel=0.05)
+
+
+def test_loadGeneratorFallsBehind():
+    # A socket that never answers, so only the sending loop limits the rate.
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sink:
+        sink.bind(('127.0.0.1', 0))
+        generator = loadGenerator.loadGenerator(['127.0.0.1'], [{'a': 'example.com'}], [1000000], stepDuration=0.05, timeout=0.1,
+                                                port=sink.getsockname()[1])
+        step = generator.run()['nameservers']['127.0.0.1'][0]
+    # Every scheduled query is sent, late.
+    assert step['sent'] + step['sendErrors'] == 50000
+    assert 0 < step['achievedQps'] < 1000000 * 0.9
+    assert step['maxSendLagMs'] > 10
+
+
+@pytest.fixture
+def bigZone(tmp_path):
+    """A zone file with an answer that does not fit in a 512 byte UDP response."""
+    zoneFile = tmp_path / 'big.zone'
+    zoneFile.write_text(''.join('big.example. 300 IN A 192.0.2.' + str(index) + '\n' for index in range(1, 61)))
+    return str(zoneFile)
+
+
+def test_resolveTruncated(startStandIn, bigZone):
+    standIn = startStandIn(zoneFile=bigZone)
+    answer = timedQuery.resolve(standIn.nameserver('udp'), 'a', 'big.example', timedQuery.queryTimer())
+    assert len(answer) == 60
+
+
+def test_rawEngineTruncatedDoesNotBlock(startStandIn, bigZone):
+    # The TCP retry of slow runs from 500 to 1000 ms, while the responses of other arrive at 600 ms.
+    slow = startStandIn(zoneFile=bigZone, latency=500).nameserver('udp')
+    other = startStandIn(latency=600).nameserver('udp')
+    results = rawEngine.rawEngine([slow, other], [{'a': 'big.example'}]).performQueries()
+
+    assert len(results[slow][0]['response']) == 60
+    assert results[slow][0]['responseTime'] >= 1000
+    assert results[other][0]['responseStatus'] == responseParser.statusOk
+    assert results[other][0]['responseTime'] < 900
@@ -0,0 +1,48 @@
+import pytest
+
+from queryStats import latencyHistogram, sampleAggregator
+
+
+def makeResult(queryName, responseTime, status='NOERROR'):
+    """Return a query result."""
+    return {"query": {"a": queryName}, "response": [], "responseStatus": status, "responseTime": responseTime}
+
+
+def test_histogramQuantiles():
+    histogram = latencyHistogram.latencyHistogram()
+    for value in range(1, 1001):
+        histogram.add(float(value))
+    assert histogram.count == 1000
+    assert histogram.mean() == pytest.approx(500.5)
+    for q, exact in ((0.0, 1.0), (0.5, 500.5), (0.9, 900.1), (0.99, 990.01), (1.0, 1000.0)):
+        assert histogram.quantile(q) == pytest.approx(exact, rel=0.02)
+
+
+def test_histogramFromDict():
+    histogram = latencyHistogram.latencyHistogram.fromDict({"precision": 0.02, "count": 0, "total": 0.0, "min": 0.0, "max": 0.0, "buckets": {}})
+    assert histogram.summary()["samples"] == 0
+
+    other = latencyHistogram.latencyHistogram()
+    other.add(12.5, 3)
+    histogram.merge(other)
+    assert histogram.summary()["p50"] == pytest.approx(12.5, rel=0.02)
+
+    with pytest.raises(ValueError):
+        histogram.merge(latencyHistogram.latencyHistogram(0.05))
+
+
+def test_sampleAggregator():
+    aggregator = sampleAggregator.sampleAggregator()
+    for iteration in range(3):
+        aggregator.addResult('ns1', makeResult('example.com', 10.0 + iteration))
+        aggregator.addResult('ns1', makeResult('lost.example', 2000.0, 'TIMEOUT'))
+        aggregator.addResult('ns1', makeResult('missing.example', 5.0, 'NXDOMAIN'))
+        aggregator.endIteration()
+
+    aggregated = aggregator.aggregatedResults(1.5)
+    assert aggregated["iterations"] == 3
+    entries = {entry["query"]["a"]: entry for entry in aggregated["nameservers"]["ns1"]}
+    assert entries["example.com"]["samples"] == 3
+    assert entries["example.com"]["min"] == 10.0 and entries["example.com"]["max"] == 12.0
+    assert (entries["lost.example"]["samples"], entries["lost.example"]["lost"]) == (0, 3)
+    assert (entries["missing.example"]["samples"], entries["missing.example"]["errors"]) == (3, 3)
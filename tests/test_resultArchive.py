@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+from conftest import makeRun, repoDir
+from resultStore import resultArchive
+
+
+def makeRuns(day, count):
+    """Return count runs on day, one minute apart."""
+    return [makeRun(day + ' 10:' + str(minute).zfill(2) + ':00.000000',
+                    {'192.0.2.53': [('a', 'example.com', 12.5 + minute, 'NOERROR'), ('mx', 'example.com', 30.25, 'NXDOMAIN')]})
+            for minute in range(count)]
+
+
+def test_roundTrip(tmp_path):
+    runs = makeRuns('2026-10-17', 2) + makeRuns('2026-10-18', 1)
+    written = resultArchive.writeArchive(runs, str(tmp_path))
+    assert sorted(os.path.basename(os.path.dirname(fileName)) for fileName in written) == ['2026-10-17', '2026-10-18']
+
+    archived = list(resultArchive.readArchive(str(tmp_path)))
+    for run in runs:
+        del run['hostName'], run['deviceUuid'], run['deviceTag'], run['dataFormatVersion']
+    assert [run['queryResults'] for run in archived] == [run['queryResults'] for run in runs]
+    assert [run['scriptUTCStartTime'] for run in archived] == [run['scriptUTCStartTime'] for run in runs]
+    assert [run['scriptUTCStartTime'] for run in resultArchive.readArchive(str(tmp_path), start='2026-10-18')] == [runs[2]['scriptUTCStartTime']]
+
+
+def test_writerBatchesRuns(tmp_path):
+    writer = resultArchive.archiveWriter(str(tmp_path), batchSize=3)
+    for run in makeRuns('2026-10-17', 7):
+        writer.addRun(run)
+    assert len(resultArchive.archiveFiles(str(tmp_path))) == 2
+
+    writer.flush()
+    files = resultArchive.archiveFiles(str(tmp_path))
+    assert len(files) == 3
+    with open(files[0], 'rb') as archiveFile:
+        assert resultArchive.archiveSegment.fromBytes(archiveFile.read()).runs() == 3
+    assert len(list(resultArchive.readArchive(str(tmp_path)))) == 7
+    assert writer.flush() is None
+
+
+def test_writerStartsNewPartition(tmp_path):
+    writer = resultArchive.archiveWriter(str(tmp_path), partition='day')
+    for run in makeRuns('2026-10-17', 2) + makeRuns('2026-10-18', 2):
+        writer.addRun(run)
+    writer.flush()
+    assert sorted(os.listdir(str(tmp_path))) == ['2026-10-17', '2026-10-18']
+    assert [len(os.listdir(str(tmp_path / day))) for day in ('2026-10-17', '2026-10-18')] == [1, 1]
+
+
+def test_iterationsInOneSegment(standIn, tmp_path):
+    server = standIn.nameserver('udp')
+    (tmp_path / 'nameservers.txt').write_text(server + '\n')
+    (tmp_path / 'queries.txt').write_text('a.example.com\nb.example.com\n')
+    subprocess.run([sys.executable, os.path.join(repoDir, 'dns-resolution-test.py'), '--iterations', '3', '--ofarchive', 'archive'],
+                   cwd=str(tmp_path), capture_output=True, timeout=60, check=True)
+
+    assert len(resultArchive.archiveFiles(str(tmp_path / 'archive'))) == 1
+    runs = list(resultArchive.readArchive(str(tmp_path / 'archive')))
+    assert len(runs) == 3
+    assert len({run['scriptUTCStartTime'] for run in runs}) == 3
+    assert all(len(run['queryResults'][server]) == 2 for run in runs)
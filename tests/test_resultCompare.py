@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from conftest import makeRun, repoDir
+from queryStats import resultCompare
+
+
+def samplesOf(latencies, failures=0):
+    """Return a sampleSet with the latencies and failures more SERVFAIL responses."""
+    samples = resultCompare.sampleSet()
+    for latency in latencies:
+        samples.add({"responseStatus": "NOERROR", "responseTime": latency})
+    for _ in range(failures):
+        samples.add({"responseStatus": "SERVFAIL", "responseTime": 1.0})
+    return samples
+
+
+def test_mannWhitney():
+    # U = 25 of 25, z = 12 / sqrt(25 x 11 / 12): p = 0.006093 (normal approximation with continuity correction).
+    pValue, delta = resultCompare.mannWhitney([1.0, 2.0, 3.0, 4.0, 5.0], [6.0, 7.0, 8.0, 9.0, 10.0])
+    assert pValue == pytest.approx(0.006093, abs=1e-6)
+    assert delta == 1.0
+
+    pValue, delta = resultCompare.mannWhitney([6.0, 7.0, 8.0, 9.0, 10.0], [1.0, 2.0, 3.0, 4.0, 5.0])
+    assert pValue > 0.99
+    assert delta == -1.0
+
+
+def test_mannWhitneyTies():
+    # U = 18 + 4 x 0.5, the tie correction removes (3^3 - 3) + 2 x (2^3 - 2) = 36 from the variance.
+    baseline = [1.0, 2.0, 2.0, 3.0, 4.0]
+    current = [2.0, 3.0, 4.0, 5.0, 6.0]
+    variance = 25 / 12 * (11 - (24 + 6 + 6) / 90)
+    expected = 0.5 * math.erfc((20 - 12.5 - 0.5) / math.sqrt(variance) / math.sqrt(2))
+    pValue, delta = resultCompare.mannWhitney(baseline, current)
+    assert pValue == pytest.approx(expected)
+    assert delta == pytest.approx(0.6)
+
+    # Only ties: no variance and no evidence.
+    assert resultCompare.mannWhitney([2.0] * 5, [2.0] * 5) == (1.0, 0.0)
+
+
+def test_fisherGreater():
+    # P(5 of the 5 failures in current) = C(10, 5) / C(20, 5) = 252 / 15504.
+    assert resultCompare.fisherGreater(0, 10, 5, 10) == pytest.approx(0.016254, abs=1e-6)
+
+    expected = sum(math.comb(6, count) * math.comb(34, 20 - count) for count in range(5, 7)) / math.comb(40, 20)
+    assert resultCompare.fisherGreater(1, 20, 5, 20) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('failures', [(0, 10, 0, 10), (2, 10, 2, 10), (5, 10, 1, 10)])
+def test_fisherNotGreater(failures):
+    assert resultCompare.fisherGreater(*failures) == 1.0
+
+
+def test_adjustPValues():
+    assert resultCompare.adjustPValues([0.01, 0.04, 0.03, 0.005]) == pytest.approx([0.02, 0.04, 0.04, 0.02])
+    # The adjusted p-values keep the order of the p-values.
+    assert resultCompare.adjustPValues([0.01, 0.011]) == pytest.approx([0.011, 0.011])
+    assert resultCompare.adjustPValues([0.5, 0.9]) == pytest.approx([0.9, 0.9])
+    assert resultCompare.adjustPValues([]) == []
+
+
+def test_sampleSet():
+    samples = resultCompare.sampleSet()
+    for status in ('NOERROR', 'NXDOMAIN', 'SERVFAIL', 'TIMEOUT', 'SKIPPED'):
+        samples.add({"responseStatus": status, "responseTime": 2.0})
+    # Lost queries are failures without a latency.
+    assert (list(samples.latencies), samples.total, samples.failures) == ([2.0, 2.0, 2.0], 5, 4)
+
+
+def test_loadSamplesWindow(tmp_path):
+    runsFile = tmp_path / 'history.jsonl'
+    with open(runsFile, 'w', encoding='utf-8') as historyFile:
+        for index in range(4):
+            historyFile.write(json.dumps(makeRun('run-' + str(index), {'ns1': [('a', 'example.com', float(index), 'NOERROR')]})) + '\n')
+        # A second line of the last run, as written by --ofstream.
+        historyFile.write(json.dumps(makeRun('run-3', {'ns1': [('a', 'example.net', 3.0, 'NOERROR')]})) + '\n')
+        historyFile.write(json.dumps(makeRun('other', {'ns1': [('a', 'example.com', 9.0, 'NOERROR')]}, deviceTag='other')) + '\n')
+
+    samples, runs = resultCompare.loadSamples(str(runsFile), deviceTag='test')
+    assert runs == 4
+    assert list(samples[('ns1', 'a', 'example.com')].latencies) == [0.0, 1.0, 2.0, 3.0]
+    assert samples[('ns1', '*', '*')].total == 5
+
+    samples, runs = resultCompare.loadSamples(str(runsFile), window=2, deviceTag='test', keys={('ns1', 'a', 'example.com')})
+    assert runs == 2
+    assert list(samples[('ns1', 'a', 'example.com')].latencies) == [2.0, 3.0]
+    assert set(samples) == {('ns1', 'a', 'example.com')}
+
+
+def test_flagRegressions():
+    baseline = {
+        ('ns1', 'a', 'slow.example'): samplesOf([1.0, 2.0, 3.0, 4.0, 5.0] * 2),
+        ('ns1', 'a', 'failing.example'): samplesOf([1.0] * 20),
+        ('ns1', 'a', 'same.example'): samplesOf([1.0, 2.0, 3.0, 4.0, 5.0] * 2),
+        ('ns1', 'a', 'rare.example'): samplesOf([1.0, 2.0]),
+        ('ns1', 'a', 'baseline.example'): samplesOf([1.0] * 5)
+    }
+    current = {
+        ('ns1', 'a', 'slow.example'): samplesOf([6.0, 7.0, 8.0, 9.0, 10.0] * 2),
+        ('ns1', 'a', 'failing.example'): samplesOf([1.0] * 10, failures=10),
+        ('ns1', 'a', 'same.example'): samplesOf([1.0, 2.0, 3.0, 4.0, 5.0] * 2),
+        ('ns1', 'a', 'rare.example'): samplesOf([9.0, 9.0]),
+        ('ns1', 'a', 'current.example'): samplesOf([1.0] * 5)
+    }
+    entries = resultCompare.compareSamples(baseline, current)
+    assert [entry['query']['a'] for entry in entries] == ['slow.example', 'failing.example', 'same.example', 'rare.example']
+
+    assert resultCompare.flagRegressions(entries) == 2
+    verdicts = {entry['query']['a']: entry for entry in entries}
+    assert verdicts['slow.example']['verdict'] == 'latency'
+    assert verdicts['slow.example']['cliffsDelta'] == 1.0
+    assert verdicts['failing.example']['verdict'] == 'errors'
+    assert verdicts['failing.example']['currentErrorRate'] == 0.5
+    assert verdicts['same.example']['verdict'] == 'ok'
+    assert verdicts['rare.example']['verdict'] == 'insufficient'
+    assert verdicts['rare.example']['errorPValue'] is None
+
+    # The smallest of the 6 p-values of the 3 queries with enough samples is adjusted x 6, to 3 digits.
+    rawPValue, _ = resultCompare.mannWhitney(sorted([1.0, 2.0, 3.0, 4.0, 5.0] * 2), sorted([6.0, 7.0, 8.0, 9.0, 10.0] * 2))
+    assert verdicts['slow.example']['latencyPValue'] == float(f'{rawPValue * 6:.3g}')
+
+
+def test_flagRegressionsEffect():
+    # A significant but small shift is not a regression with the default minEffect.
+    baseline = {('ns1', 'a', 'example.com'): samplesOf([float(value) for value in range(200)])}
+    current = {('ns1', 'a', 'example.com'): samplesOf([value + 20.0 for value in range(200)])}
+    entries = resultCompare.compareSamples(baseline, current)
+    assert resultCompare.flagRegressions(entries) == 0
+    assert entries[0]['latencyPValue'] < 0.01
+    assert 0 < entries[0]['cliffsDelta'] < 0.33
+    assert entries[0]['verdict'] == 'ok'
+    assert resultCompare.flagRegressions(resultCompare.compareSamples(baseline, current), minEffect=0.1) == 1
+
+
+def runCompare(*arguments):
+    """Run resultCompare and return the completed process."""
+    return subprocess.run([sys.executable, '-m', 'queryStats.resultCompare'] + list(arguments), cwd=repoDir,
+                          capture_output=True, text=True, timeout=60)
+
+
+def test_compareErrors(tmp_path):
+    missing = runCompare('--baseline', str(tmp_path / 'missing.jsonl'), '--current', str(tmp_path / 'missing.json'))
+    assert missing.returncode == 2
+    assert 'Unable to read the results' in missing.stdout
+
+    (tmp_path / 'broken.json').write_text('{"queryResults": ')
+    broken = runCompare('--baseline', str(tmp_path / 'broken.json'), '--current', str(tmp_path / 'broken.json'))
+    assert broken.returncode == 2
+    assert 'Unable to read the results' in broken.stdout
+
+    (tmp_path / 'current.json').write_text(json.dumps(makeRun('run-1', {'ns1': [('a', 'example.com', 1.0, 'NOERROR')]})))
+    (tmp_path / 'empty.jsonl').write_text('')
+    empty = runCompare('--baseline', str(tmp_path / 'empty.jsonl'), '--current', str(tmp_path / 'current.json'))
+    assert empty.returncode == 2
+    assert 'No baseline runs to compare.' in empty.stdout
+
+
+def test_compareRuns(startStandIn, tmp_path):
+    standIn = startStandIn()
+    (tmp_path / 'nameservers.txt').write_text(standIn.nameserver('udp') + '\n')
+    (tmp_path / 'queries.txt').write_text(''.join('host' + str(index) + '.example.com\n' for index in range(10)))
+    measure = [sys.executable, os.path.join(repoDir, 'dns-resolution-test.py'), '--ofresults']
+
+    subprocess.run(measure, cwd=str(tmp_path), capture_output=True, timeout=60, check=True)
+    shutil.move(str(tmp_path / 'output.json'), str(tmp_path / 'baseline.json'))
+    subprocess.run(measure, cwd=str(tmp_path), capture_output=True, timeout=60, check=True)
+    same = runCompare('--baseline', str(tmp_path / 'baseline.json'), '--current', str(tmp_path / 'output.json'))
+    assert same.returncode == 0
+    assert 'No regressions' in same.stdout
+
+    # The nameserver gets 30 ms slower.
+    standIn.config.latency = 30.0
+    subprocess.run(measure, cwd=str(tmp_path), capture_output=True, timeout=60, check=True)
+    slower = runCompare('--baseline', str(tmp_path / 'baseline.json'), '--current', str(tmp_path / 'output.json'),
+                        '--output', str(tmp_path / 'compare.json'))
+    assert slower.returncode == 1
+    assert '1 regression(s)' in slower.stdout
+
+    with open(tmp_path / 'compare.json', encoding='utf-8') as compareFile:
+        comparison = json.load(compareFile)
+    assert comparison['regressions'] == 1
+    serverEntry = [entry for entry in comparison['entries'] if entry['query'] == {'*': '*'}][0]
+    assert serverEntry['verdict'] == 'latency'
+    assert serverEntry['currentMedian'] >= 30
+    assert all(entry['verdict'] == 'insufficient' for entry in comparison['entries'] if entry is not serverEntry)
@@ -0,0 +1,71 @@
+import json
+import os
+import time
+
+import pytest
+
+from resultStore import resultSink
+
+
+def makeResult(queryName):
+    """Return a query result for queryName."""
+    return {"query": {"a": queryName}, "response": ["192.0.2.1"], "responseTime": 1.0, "responseTTL": 300}
+
+
+def readRecords(fileName):
+    """Return the queryResults of every line, as {server: [queryName, ...]}."""
+    with open(fileName, encoding='utf-8') as streamFile:
+        return [{server: [queryResult['query']['a'] for queryResult in results] for server, results in json.loads(line)['queryResults'].items()}
+                for line in streamFile]
+
+
+def test_queryGranularity(tmp_path):
+    fileName = str(tmp_path / 'stream.jsonl')
+    with resultSink.resultSink(fileName, {"deviceTag": "test"}) as sink:
+        sink.add('ns1', makeResult('a.example'))
+        sink.add('ns2', makeResult('b.example'))
+    assert readRecords(fileName) == [{'ns1': ['a.example']}, {'ns2': ['b.example']}]
+
+
+def test_nameserverWrittenWhenComplete(tmp_path):
+    fileName = str(tmp_path / 'stream.jsonl')
+    sink = resultSink.resultSink(fileName, {}, 'nameserver')
+    sink.startPass(['a.example', 'b.example'])
+    sink.add('ns1', makeResult('a.example'))
+    sink.add('ns2', makeResult('a.example'))
+    sink.add('ns1', makeResult('b.example'))
+    assert sink.records == 1
+    sink.add('ns2', makeResult('b.example'))
+    sink.endPass()
+    sink.close()
+    assert readRecords(fileName) == [{'ns1': ['a.example', 'b.example']}, {'ns2': ['a.example', 'b.example']}]
+
+
+def test_nameserverRecordsDoNotSpanPasses(tmp_path):
+    # A --rank round or a resumed checkpoint performs fewer queries than the list has.
+    fileName = str(tmp_path / 'stream.jsonl')
+    sink = resultSink.resultSink(fileName, {}, 'nameserver')
+    for round in range(2):
+        sink.startPass(['a.example', 'b.example', 'c.example'])
+        sink.add('ns1', makeResult('round' + str(round) + '.example'))
+        sink.endPass()
+    sink.close()
+    assert readRecords(fileName) == [{'ns1': ['round0.example']}, {'ns1': ['round1.example']}]
+
+
+def test_writtenBeforeClose(tmp_path):
+    fileName = str(tmp_path / 'stream.jsonl')
+    sink = resultSink.resultSink(fileName, {}, fsyncInterval=0.1)
+    for index in range(10):
+        sink.add('ns1', makeResult('host' + str(index) + '.example'))
+        time.sleep(0.03)
+    # A kill now leaves the lines of all but the last interval.
+    assert os.path.getsize(fileName) > 0
+    assert len(readRecords(fileName)) >= 5
+    sink.close()
+    assert len(readRecords(fileName)) == 10
+
+
+def test_invalidGranularity(tmp_path):
+    with pytest.raises(ValueError):
+        resultSink.resultSink(str(tmp_path / 'stream.jsonl'), {}, 'run')
@@ -0,0 +1,132 @@
+import gzip
+import http.server
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import makeRun
+from resultStore import resultUploader
+
+
+class recordingHandler(http.server.BaseHTTPRequestHandler):
+    """Keeps every POST and answers with the next scripted status, 200 when there are none left."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def collector():
+    """A local HTTP server that records the uploads."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), recordingHandler)
+    server.requests = []
+    server.statuses = []
+    server.url = 'http://127.0.0.1:' + str(server.server_address[1]) + '/ingest'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def makeUploader(url, spoolDir, **options):
+    """Return an uploader with short retry delays."""
+    options.setdefault('backoffBase', 0.001)
+    options.setdefault('backoffMax', 0.01)
+    return resultUploader.resultUploader(url, str(spoolDir), **options)
+
+
+def uploadedRuns(request):
+    """Return the start times of the runs in a json lines upload."""
+    return [json.loads(line)['scriptUTCStartTime'] for line in request[1].splitlines()]
+
+
+def test_uploadWithoutSpool(collector):
+    uploader = resultUploader.resultUploader(collector.url, compression='gzip')
+    assert uploader.upload(makeRun('run-1', {})).status_code == 200
+    headers, body = collector.requests[0]
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body))['scriptUTCStartTime'] == 'run-1'
+
+
+def test_spoolBatchSize(collector, tmp_path):
+    uploader = makeUploader(collector.url, tmp_path, batchSize=3, batchInterval=3600)
+    assert uploader.upload(makeRun('run-1', {})) is None
+    assert uploader.upload(makeRun('run-2', {})) is None
+    assert not collector.requests
+    assert len(uploader.spoolFiles()) == 2
+
+    assert uploader.upload(makeRun('run-3', {})).status_code == 200
+    assert len(collector.requests) == 1
+    assert collector.requests[0][0]['Content-Type'] == 'application/x-ndjson'
+    assert uploadedRuns(collector.requests[0]) == ['run-1', 'run-2', 'run-3']
+    assert uploader.spoolFiles() == []
+
+
+def test_spoolInterval(collector, tmp_path):
+    uploader = makeUploader(collector.url, tmp_path, batchSize=10, batchInterval=0)
+    uploader.upload(makeRun('run-1', {}))
+    uploader.upload(makeRun('run-2', {}))
+    assert [uploadedRuns(request) for request in collector.requests] == [['run-1'], ['run-2']]
+
+
+def test_spoolDropsOldest(tmp_path):
+    uploader = makeUploader('http://127.0.0.1:9/', tmp_path)
+    uploader.spoolRun(makeRun('run-1', {}))
+    runBytes = os.path.getsize(uploader.spoolFiles()[0])
+    uploader.maxSpoolBytes = runBytes * 2 + runBytes // 2
+
+    uploader.spoolRun(makeRun('run-2', {}))
+    uploader.spoolRun(makeRun('run-3', {}))
+    spooled = []
+    for fileName in uploader.spoolFiles():
+        with gzip.open(fileName) as spoolFile:
+            spooled.append(json.load(spoolFile)['scriptUTCStartTime'])
+    assert spooled == ['run-2', 'run-3']
+
+
+def test_retryThenSuccess(collector, tmp_path):
+    collector.statuses = [503, 429]
+    uploader = makeUploader(collector.url, tmp_path, batchInterval=0, retries=2)
+    assert uploader.upload(makeRun('run-1', {})).status_code == 200
+    assert len(collector.requests) == 3
+    assert uploader.spoolFiles() == []
+
+
+def test_failedUploadStaysInSpool(collector, tmp_path):
+    collector.statuses = [500, 500]
+    uploader = makeUploader(collector.url, tmp_path, batchSize=2, batchInterval=0, retries=1)
+    assert uploader.upload(makeRun('run-1', {})) is None
+    assert len(uploader.spoolFiles()) == 1
+
+    # The next upload sends the kept run first, in batches of batchSize.
+    uploader.upload(makeRun('run-2', {}))
+    uploader.upload(makeRun('run-3', {}))
+    assert [uploadedRuns(request) for request in collector.requests[2:]] == [['run-1', 'run-2'], ['run-3']]
+
+
+def test_rejectedUploadIsNotRetried(collector, tmp_path):
+    collector.statuses = [400]
+    uploader = makeUploader(collector.url, tmp_path, batchInterval=0)
+    assert uploader.upload(makeRun('run-1', {})) is None
+    assert len(collector.requests) == 1
+    assert len(uploader.spoolFiles()) == 1
+
+
+def test_backgroundUpload(collector, tmp_path):
+    collector.statuses = [503]
+    uploader = makeUploader(collector.url, tmp_path, batchInterval=0, background=True)
+    assert uploader.upload(makeRun('run-1', {})) is None
+    uploader.close()
+    assert len(collector.requests) == 2
+    assert uploader.spoolFiles() == []
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import repoDir
+from resultStore import runCheckpoint
+
+
+def makeResult(queryName, responseTime=1.5, status='NOERROR'):
+    """Return a query result for queryName."""
+    return {"query": {"a": queryName}, "response": ["192.0.2.1"], "responseStatus": status, "responseTime": responseTime,
+            "networkTime": responseTime, "processingTime": 0.0, "responseTTL": 300}
+
+
+def tearLastLine(fileName):
+    """Append half a line, as left by a crash in the middle of a write."""
+    with open(fileName, 'a', encoding='utf-8') as checkpointFile:
+        checkpointFile.write(json.dumps(['ns1', makeResult('torn.example')])[:40])
+
+
+def test_fingerprint():
+    nameservers = ['192.0.2.53', '198.51.100.53:5300']
+    queries = [{'a': 'example.com'}, {'mx': 'example.net'}]
+    expected = hashlib.sha1(json.dumps([nameservers, queries], sort_keys=True).encode('utf-8')).hexdigest()
+    assert runCheckpoint.matrixFingerprint(nameservers, queries) == expected
+    assert runCheckpoint.matrixFingerprint(nameservers, queries[:1]) != expected
+
+
+def test_resumeAfterTornLine(tmp_path):
+    fileName = str(tmp_path / 'run.checkpoint')
+    queries = [{'a': 'a.example'}, {'a': 'b.example'}, {'a': 'c.example'}]
+
+    checkpoint = runCheckpoint.runCheckpoint(fileName, ['ns1'], queries, 'start-1')
+    checkpoint.add('ns1', makeResult('a.example'))
+    checkpoint.add('ns1', makeResult('b.example', status='SKIPPED'))
+    checkpoint.close()
+    tearLastLine(fileName)
+
+    resumed = runCheckpoint.runCheckpoint(fileName, ['ns1'], queries, 'start-2')
+    assert resumed.scriptStartTime == 'start-1'
+    assert resumed.completedCount == 1
+    assert resumed.takeCompleted('ns1', 'a', 'a.example')['responseTime'] == 1.5
+    assert resumed.takeCompleted('ns1', 'a', 'a.example') is None
+    assert resumed.takeCompleted('ns1', 'a', 'b.example') is None
+
+    # The lines after the torn one are still read.
+    resumed.add('ns1', makeResult('b.example'))
+    resumed.close()
+    again = runCheckpoint.runCheckpoint(fileName, ['ns1'], queries, 'start-3')
+    assert again.completedCount == 2
+    again.remove()
+    assert not os.path.exists(fileName)
+
+
+def test_differentMatrix(tmp_path):
+    fileName = str(tmp_path / 'run.checkpoint')
+    runCheckpoint.runCheckpoint(fileName, ['ns1'], [{'a': 'a.example'}], 'start-1').close()
+    with pytest.raises(ValueError):
+        runCheckpoint.runCheckpoint(fileName, ['ns2'], [{'a': 'a.example'}], 'start-2')
+
+
+def test_resumeRun(standIn, tmp_path):
+    server = standIn.nameserver('udp')
+    queryNames = ['host' + str(index) + '.example.com' for index in range(4)]
+    (tmp_path / 'nameservers.txt').write_text(server + '\n')
+    (tmp_path / 'queries.txt').write_text(''.join(name + '\n' for name in queryNames))
+
+    # The interrupted run completed the first two queries and was killed in the middle of the third line.
+    checkpoint = runCheckpoint.runCheckpoint(str(tmp_path / 'run.checkpoint'), [server], [{'a': name} for name in queryNames], '2026-10-18 10:00:00.000000')
+    checkpoint.add(server, makeResult(queryNames[0], 123.25))
+    checkpoint.add(server, makeResult(queryNames[1], 123.5))
+    checkpoint.close()
+    tearLastLine(str(tmp_path / 'run.checkpoint'))
+
+    output = subprocess.run([sys.executable, os.path.join(repoDir, 'dns-resolution-test.py'), '--checkpoint', 'run.checkpoint', '--ofresults'],
+                            cwd=str(tmp_path), capture_output=True, text=True, timeout=60, check=True).stdout
+    assert '2 of 4 queries already completed' in output
+
+    with open(tmp_path / 'output.json', encoding='utf-8') as outputFile:
+        myData = json.load(outputFile)
+    assert myData['scriptUTCStartTime'] == '2026-10-18 10:00:00.000000'
+    results = myData['queryResults'][server]
+    assert [list(result['query'].values())[0] for result in results] == queryNames
+    assert [result['responseTime'] for result in results[:2]] == [123.25, 123.5]
+    assert all(result['responseStatus'] == 'NOERROR' for result in results)
+    assert not (tmp_path / 'run.checkpoint').exists()
@@ -0,0 +1,31 @@
+import pytest
+
+from benchmark import selfBenchmark
+from queryEngine import loadGenerator
+
+
+def scriptedSteps(monkeypatch, steps):
+    """Make every load step return the next of steps {rate: step}."""
+    def run(self):
+        rate = self.rates[0]
+        step = {"targetQps": rate, "achievedQps": rate, "sent": 1000, "timeouts": 0, "maxSendLagMs": 1.0}
+        step.update(steps.get(rate, {}))
+        return {"nameservers": {self.nameservers[0]: [step]}}
+    monkeypatch.setattr(loadGenerator.loadGenerator, 'run', run)
+
+
+@pytest.mark.parametrize('failedStep', [
+    {"achievedQps": 1900.0},
+    {"maxSendLagMs": 250.0},
+    {"timeouts": 2}
+])
+def test_maxSustainableQps(monkeypatch, failedStep):
+    scriptedSteps(monkeypatch, {2000: failedStep})
+    sustained, steps = selfBenchmark.maxSustainableQps('127.0.0.1', [{'a': 'example.com'}], 0.1, 8000)
+    assert sustained == 1000
+    assert [step['targetQps'] for step in steps] == [500, 1000, 2000]
+
+
+def test_maxSustainableQpsLimit(monkeypatch):
+    scriptedSteps(monkeypatch, {})
+    assert selfBenchmark.maxSustainableQps('127.0.0.1', [{'a': 'example.com'}], 0.1, 8000)[0] == 8000
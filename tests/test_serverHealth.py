@@ -0,0 +1,91 @@
+import pytest
+
+from queryEngine import responseParser, serverHealth
+
+
+def makeResult(status, networkTime=10.0):
+    """Return a query result with status."""
+    return {"query": {"a": "example.com"}, "responseStatus": status, "networkTime": networkTime}
+
+
+timeout = makeResult(responseParser.statusTimeout, 2000.0)
+
+
+def tripped(health, server='ns1'):
+    """Trip the circuit of server with tripAfter timeouts."""
+    for _ in range(health.tripAfter):
+        health.addResult(server, timeout, health.shouldQuery(server))
+    assert health.state(server).tripped
+    return health
+
+
+def test_tripAndClose():
+    health = tripped(serverHealth.serverHealth(tripAfter=3, probeInterval=0))
+    probe = health.shouldQuery('ns1')
+    assert probe not in (None, serverHealth.regularQuery)
+    # Only one probe at a time.
+    assert health.shouldQuery('ns1') is None
+
+    health.addResult('ns1', makeResult(responseParser.statusOk), probe)
+    assert not health.state('ns1').tripped
+    assert health.shouldQuery('ns1') == serverHealth.regularQuery
+    results = health.healthResults()['nameservers']['ns1']
+    assert (results['trips'], results['probes'], results['skipped']) == (1, 1, 1)
+
+
+def test_lateTimeoutIsNotTheProbe():
+    # A query that was in flight when the circuit tripped times out after the probe was sent.
+    health = serverHealth.serverHealth(tripAfter=2, probeInterval=0)
+    inFlight = health.shouldQuery('ns1')
+    tripped(health)
+    probe = health.shouldQuery('ns1')
+
+    health.addResult('ns1', timeout, inFlight)
+    assert health.state('ns1').probing == probe
+    assert health.shouldQuery('ns1') is None
+
+    health.addResult('ns1', timeout, probe)
+    nextProbe = health.shouldQuery('ns1')
+    assert nextProbe not in (None, serverHealth.regularQuery, probe)
+
+    # The result of the old probe does not count for the new one.
+    health.addResult('ns1', timeout, probe)
+    assert health.state('ns1').probing == nextProbe
+
+
+def test_localErrorIsNotAResponse():
+    health = serverHealth.serverHealth(tripAfter=2, probeInterval=0, timeoutFactor=3)
+    health.addResult('ns1', timeout, health.shouldQuery('ns1'))
+    # A failed send does not reset the consecutive timeouts.
+    health.addResult('ns1', makeResult(responseParser.statusError, 0.0), health.shouldQuery('ns1'))
+    health.addResult('ns1', timeout, health.shouldQuery('ns1'))
+    assert health.state('ns1').tripped
+
+    # Nor does it close the circuit, but the next probe can be sent.
+    probe = health.shouldQuery('ns1')
+    health.addResult('ns1', makeResult(responseParser.statusBadType, 0.0), probe)
+    assert health.state('ns1').tripped
+    assert health.shouldQuery('ns1') not in (None, serverHealth.regularQuery, probe)
+    assert not health.state('ns1').networkTimes
+
+
+def test_probeInterval():
+    health = tripped(serverHealth.serverHealth(tripAfter=1, probeInterval=3600))
+    assert health.shouldQuery('ns1') is None
+
+
+def test_adaptiveTimeout():
+    health = serverHealth.serverHealth(timeoutFactor=3)
+    assert health.timeouts('ns1') == (2.0, 5.0)
+
+    for _ in range(serverHealth.minSamples):
+        health.addResult('ns1', makeResult(responseParser.statusOk, 100.0))
+    assert health.timeouts('ns1') == (pytest.approx(0.3), pytest.approx(0.75))
+
+    # The timeout is only derived again after recomputeAfter new network times.
+    for _ in range(serverHealth.recomputeAfter - 1):
+        health.addResult('ns1', makeResult(responseParser.statusOk, 500.0))
+    assert health.timeouts('ns1')[0] == pytest.approx(0.3)
+    health.addResult('ns1', makeResult(responseParser.statusOk, 500.0))
+    assert health.timeouts('ns1')[0] == pytest.approx(1.5)
+
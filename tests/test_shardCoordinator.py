@@ -0,0 +1,202 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from conftest import makeRun, repoDir
+from queryEngine import shardCoordinator
+
+
+def worker(deviceUuid):
+    """Return the identity of a worker."""
+    return {"deviceUuid": deviceUuid, "deviceTag": "test", "hostName": deviceUuid + "-host"}
+
+
+def completeLease(coordinator, shardLease, deviceUuid, responseTime=1.0):
+    """Send the results of a leased shard as deviceUuid."""
+    server = shardLease['nameservers'][0]
+    results = [(list(query)[0], list(query.values())[0], responseTime, 'NOERROR') for query in shardLease['queries']]
+    myData = makeRun('start', {server: results}, deviceUuid=deviceUuid)
+    myData['shard'] = shardLease['shard']
+    myData['lease'] = shardLease['lease']
+    return coordinator.complete(myData)
+
+
+@pytest.fixture
+def queries():
+    return [{'a': 'host' + str(index) + '.example.com'} for index in range(5)]
+
+
+def test_shards(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1', 'ns2'], queries, shardSize=2)
+    assert [(shard.server, shard.start, len(shard.queries)) for shard in coordinator.shards] == [
+        ('ns1', 0, 2), ('ns1', 2, 2), ('ns1', 4, 1), ('ns2', 0, 2), ('ns2', 2, 2), ('ns2', 4, 1)]
+
+    while not coordinator.finished.is_set():
+        assert completeLease(coordinator, coordinator.lease(worker('w1')), 'w1') == {"accepted": True}
+    assert coordinator.lease(worker('w1')) == {"done": True}
+    assert coordinator.allWorkersDone()
+    assert [len(results) for results in coordinator.mergedResults().values()] == [5, 5]
+    assert [result['query'] for result in coordinator.mergedResults()['ns2']] == queries
+
+
+def test_noQueries():
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], [])
+    assert coordinator.lease(worker('w1')) == {"done": True}
+
+
+def test_waitForRunningShard(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=10)
+    assert coordinator.lease(worker('w1'))['shard'] == 0
+    assert coordinator.lease(worker('w2')) == {"wait": shardCoordinator.waitInterval}
+
+
+def test_leaseExpiry(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=2, leaseTimeout=0.05)
+    lost = coordinator.lease(worker('w1'))
+    time.sleep(0.1)
+
+    # The shard of the lost worker is handed out before the pending shards.
+    reassigned = coordinator.lease(worker('w2'))
+    assert reassigned['shard'] == lost['shard']
+    assert reassigned['lease'] != lost['lease']
+    assert coordinator.reassignedShards == 1
+
+    assert completeLease(coordinator, reassigned, 'w2') == {"accepted": True}
+    # The late result of the lost worker is a duplicate.
+    assert completeLease(coordinator, lost, 'w1') == {"accepted": False, "reason": "duplicate"}
+    assert coordinator.shardResults()['duplicateResults'] == 1
+    assert coordinator.shardResults()['shardWorkers'][0]['deviceUuid'] == 'w2'
+
+
+def test_expiredLeaseIsAccepted(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=2, leaseTimeout=0.05)
+    slow = coordinator.lease(worker('w1'))
+    time.sleep(0.1)
+    coordinator.lease(worker('w2'))
+
+    # The work is done, so the result of the expired lease is kept and the copy is not needed.
+    assert completeLease(coordinator, slow, 'w1', responseTime=2.0) == {"accepted": True}
+    assert coordinator.status()['running'] == 0
+    assert coordinator.mergedResults()['ns1'][0]['responseTime'] == 2.0
+
+
+def test_expiredLeaseIsNotPendingTwice(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=5, leaseTimeout=0.05)
+    slow = coordinator.lease(worker('w1'))
+    time.sleep(0.1)
+    coordinator.expireLeases(time.monotonic())
+    assert coordinator.status()['pending'] == 1
+
+    assert completeLease(coordinator, slow, 'w1') == {"accepted": True}
+    assert coordinator.status() == {"shards": 1, "remaining": 0, "pending": 0, "running": 0, "workers": 1}
+    assert coordinator.lease(worker('w2')) == {"done": True}
+
+
+def test_backupShard(queries):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries[:2], shardSize=1)
+    fast = coordinator.lease(worker('w1'))
+    time.sleep(0.2)
+    slow = coordinator.lease(worker('w2'))
+    assert completeLease(coordinator, fast, 'w1') == {"accepted": True}
+
+    # The slow shard has not run backupFactor times longer than the other shard yet.
+    assert coordinator.lease(worker('w3')) == {"wait": shardCoordinator.waitInterval}
+    time.sleep(shardCoordinator.backupFactor * coordinator.shardDurations[0] + 0.05)
+    # Its own worker gets no copy.
+    assert coordinator.lease(worker('w2')) == {"wait": shardCoordinator.waitInterval}
+
+    backup = coordinator.lease(worker('w3'))
+    assert backup['shard'] == slow['shard']
+    assert coordinator.backupShards == 1
+    # A shard gets a single backup copy.
+    assert coordinator.lease(worker('w1')) == {"wait": shardCoordinator.waitInterval}
+
+    assert completeLease(coordinator, backup, 'w3') == {"accepted": True}
+    assert completeLease(coordinator, slow, 'w2') == {"accepted": False, "reason": "duplicate"}
+    assert coordinator.shardResults()['shardWorkers'][1]['deviceUuid'] == 'w3'
+
+
+@pytest.mark.parametrize('change, reason', [
+    (lambda myData: myData.update(shard=7), 'unknown shard'),
+    (lambda myData: myData.update(shard='0'), 'unknown shard'),
+    (lambda myData: myData['queryResults']['ns1'].pop(), 'incomplete'),
+    (lambda myData: myData.update(queryResults={}), 'incomplete'),
+])
+def test_rejectedResult(queries, change, reason):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=5)
+    shardLease = coordinator.lease(worker('w1'))
+    myData = makeRun('start', {'ns1': [('a', query['a'], 1.0, 'NOERROR') for query in queries]}, deviceUuid='w1')
+    myData['shard'] = shardLease['shard']
+    myData['lease'] = shardLease['lease']
+    change(myData)
+    assert coordinator.complete(myData) == {"accepted": False, "reason": reason}
+    assert coordinator.status()['remaining'] == 1
+
+
+@pytest.fixture
+def coordinatorUrl():
+    """Return a function that serves a shardCoordinator on a free port and returns its URL."""
+    servers = []
+
+    def serve(coordinator):
+        server = shardCoordinator.coordinatorServer(coordinator, port=0).start()
+        servers.append(server)
+        return 'http://127.0.0.1:' + str(server.port)
+
+    yield serve
+    for server in servers:
+        server.stop()
+
+
+def test_coordinatorClient(queries, coordinatorUrl):
+    coordinator = shardCoordinator.shardCoordinator(['ns1'], queries, shardSize=5)
+    client = shardCoordinator.coordinatorClient(coordinatorUrl(coordinator))
+    shardLease = client.lease(worker('w1'))
+    assert shardLease['nameservers'] == ['ns1']
+
+    myData = makeRun('start', {'ns1': [('a', query['a'], 1.0, 'NOERROR') for query in queries]}, deviceUuid='w1')
+    myData['shard'] = shardLease['shard']
+    myData['lease'] = shardLease['lease']
+    assert client.complete(myData) == {"accepted": True}
+    assert client.complete(myData) == {"accepted": False, "reason": "duplicate"}
+    assert client.lease(worker('w1')) == {"done": True}
+
+    with pytest.raises(OSError):
+        client.post('/missing', {})
+
+
+def test_coordinatorUnreachable(monkeypatch):
+    monkeypatch.setattr(shardCoordinator, 'clientRetries', 1)
+    with pytest.raises(OSError):
+        shardCoordinator.coordinatorClient('http://127.0.0.1:9', timeout=1).lease(worker('w1'))
+
+
+def test_workerRun(startStandIn, queries, coordinatorUrl, tmp_path):
+    first = startStandIn().nameserver('udp')
+    second = startStandIn().nameserver('udp')
+    coordinator = shardCoordinator.shardCoordinator([first, second], queries, shardSize=2, leaseTimeout=0.05)
+
+    # A worker that was lost with the first shard, which is given back to the pending shards.
+    lost = coordinator.lease(worker('lost-worker'))
+    time.sleep(0.1)
+    coordinator.expireLeases(time.monotonic())
+    coordinator.leaseTimeout = 60.0
+    url = coordinatorUrl(coordinator)
+
+    output = subprocess.run([sys.executable, os.path.join(repoDir, 'dns-resolution-test.py'), '--worker', url],
+                            cwd=str(tmp_path), capture_output=True, text=True, timeout=60, check=True).stdout
+    assert 'Completed 6 shards.' in output
+    assert coordinator.finished.is_set()
+    assert coordinator.reassignedShards == 1
+
+    assert completeLease(coordinator, lost, 'lost-worker') == {"accepted": False, "reason": "duplicate"}
+    results = coordinator.mergedResults()
+    for server in (first, second):
+        assert [result['query'] for result in results[server]] == queries
+        assert all(result['responseStatus'] == 'NOERROR' for result in results[server])
+    shardResults = coordinator.shardResults()
+    assert shardResults['completedShards'] == 6
+    assert [entry['shards'] for entry in shardResults['workers']] == [0, 6]